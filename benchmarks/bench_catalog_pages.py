@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+benchmark: serial vs concurrent page fetching in query_catalog against a mock /api/base/search
+
+every request pays the server side latency, so a catalog wide query of many pages is
+bound by round trips when the pages are fetched one after another
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import eodslib
+from mock_eods_server import MockEODSServer
+
+
+def make_search_route(records):
+
+    def search_route(handler):
+        params = dict(parse_qsl(urlparse(handler.path).query))
+        offset, limit = int(params['offset']), int(params['limit'])
+        body = json.dumps({'meta': {'total_count': len(records)}, 'objects': records[offset:offset + limit]})
+        return 200, {'Content-Type': 'application/json'}, body.encode('utf-8')
+
+    return search_route
+
+
+def run(server, output_dir, page_size, max_workers):
+    conn = {'domain': server.url, 'username': 'user', 'access_token': 'token'}
+    server.reset_counts()
+    start = time.perf_counter()
+    output_list, _ = eodslib.query_catalog(conn, page_size=page_size, max_workers=max_workers, output_dir=output_dir,
+                                           session=eodslib.make_session(pool_maxsize=max_workers))
+    return time.perf_counter() - start, server.request_count, output_list
+
+
+if __name__ == "__main__":
+
+    app_parser = argparse.ArgumentParser(description='parallel catalog page benchmark')
+    app_parser.add_argument('--records', type=int, default=10000)
+    app_parser.add_argument('--page-size', type=int, default=500)
+    app_parser.add_argument('--workers', type=int, default=8)
+    app_parser.add_argument('--latency', type=float, default=0.1, help='seconds of server side latency per request')
+    args = app_parser.parse_args()
+
+    records = [{'id': i, 'alternate': 'geonode:S2A_20210101_lat52lon1_T30UXC_ORB' + str(i % 143).zfill(3) + '_' + str(i),
+                'title': 'S2A_20210101_lat52lon1_T30UXC_ORB' + str(i % 143).zfill(3) + '_' + str(i)} for i in range(args.records)]
+
+    with MockEODSServer({('GET', '/api/base/search'): make_search_route(records)}, latency=args.latency) as server, \
+            tempfile.TemporaryDirectory() as output_dir:
+
+        serial_time, serial_requests, serial_list = run(server, output_dir, args.page_size, 1)
+        parallel_time, parallel_requests, parallel_list = run(server, output_dir, args.page_size, args.workers)
+
+    print('\n\t### ' + str(args.records) + ' records, pages of ' + str(args.page_size) + ', ' + str(args.latency) + ' s latency')
+    print('\t### serial pages        : requests = ' + str(serial_requests) + ', time (s) = ' + str(round(serial_time, 3)))
+    print('\t### ' + str(args.workers) + ' concurrent pages  : requests = ' + str(parallel_requests) + ', time (s) = ' + str(round(parallel_time, 3)))
+    print('\t### identical results   : ' + str(serial_list == parallel_list))
+    print('\t### speed-up            : ' + str(round(serial_time / parallel_time, 2)) + 'x')
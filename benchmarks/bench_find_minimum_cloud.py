@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+benchmark: the previous find_minimum_cloud_list (safe list read from disk per call, merge,
+sort_values + groupby.nth) vs the cached safe list and groupby idxmin of eodslib
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import eodslib
+import numpy as np
+import pandas as pd
+
+
+def make_frame(n_rows):
+    random.seed(0)
+    safe = pd.read_csv(eodslib.SAFE_GRANULE_ORBIT_LIST)['gran-orb'].tolist()
+    # mostly safe granule-orbits, some not in the list
+    pairs = [tuple(ref.split('_')) for ref in safe] + [('T30UZZ', 'ORB001'), ('T31UAA', 'ORB002')]
+    rows = []
+    for i in range(n_rows):
+        granule, orbit = random.choice(pairs)
+        split = random.random() < 0.1
+        title = 'S2A_2021' + str(random.randint(1, 12)).zfill(2) + str(random.randint(1, 28)).zfill(2) + '_lat52lon1_' + granule + ('SPLIT1' if split else '') + '_' + orbit + '_utm30n_' + str(i)
+        rows.append({
+            'title':title,
+            'alternate':'geonode:' + title,
+            'granule-ref':granule + ('SPLIT1' if split else ''),
+            'orbit-ref':orbit,
+            'split_granule.name':'geonode:split' + str(i) if random.random() < 0.05 else np.nan,
+            'split_cloud_cover':round(random.random(), 6),
+            })
+    return pd.DataFrame(rows)
+
+
+def previous(df):
+    df['title_stub'] = df['title'].str.partition('_T')[0] + '_' + df['granule-ref'].astype(str).str[:6]
+    no_split_df = df[~df['title'].str.contains("SPLIT")].copy()
+    df_safe_list = pd.read_csv(Path(eodslib.SAFE_GRANULE_ORBIT_LIST))
+    no_split_df['gran-orb'] = no_split_df['granule-ref'].astype(str).str[:6] + '_' + no_split_df['orbit-ref'].astype(str)
+    no_split_df['granule-stub'] = no_split_df['granule-ref'].astype(str).str[:6]
+    df['gran-orb'] = df['granule-ref'].astype(str).str[:6] + '_' + df['orbit-ref'].astype(str)
+    df['granule-stub'] = df['granule-ref'].astype(str).str[:6]
+    safe_df = pd.merge(no_split_df, df_safe_list)
+    return_df = safe_df.sort_values("split_cloud_cover").groupby(["granule-stub"], as_index=False).nth(0).sort_values("granule-stub")
+    matching_split_series = return_df[return_df['split_granule.name'].notna()]['split_granule.name']
+    matching_split_df = df[df['alternate'].isin(matching_split_series)]
+    return pd.concat([return_df, matching_split_df], ignore_index=True)
+
+
+def best_of(fn, frame, repeats):
+    times = []
+    for _ in range(repeats):
+        df = frame.copy()
+        start = time.perf_counter()
+        result = fn(df)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+
+    app_parser = argparse.ArgumentParser(description='find_minimum_cloud_list benchmark')
+    app_parser.add_argument('--rows', type=int, default=100000)
+    app_parser.add_argument('--repeats', type=int, default=5)
+    args = app_parser.parse_args()
+
+    frame = make_frame(args.rows)
+    eodslib.load_safe_granule_orbits()
+
+    previous_time, previous_df = best_of(previous, frame, args.repeats)
+    current_time, current_df = best_of(eodslib.find_minimum_cloud_list, frame, args.repeats)
+
+    # no tied cloud values in the synthetic data, so both pick the same layers
+    same = previous_df['alternate'].tolist() == current_df['alternate'].tolist()
+
+    print('\n\t### ' + str(args.rows) + ' rows, ' + str(len(current_df)) + ' layers returned, best of ' + str(args.repeats))
+    print('\t### merge + sort + nth    : time (ms) = ' + str(round(previous_time * 1000, 1)))
+    print('\t### cached set + idxmin   : time (ms) = ' + str(round(current_time * 1000, 1)))
+    print('\t### identical layers      : ' + str(same))
+    print('\t### speed-up              : ' + str(round(previous_time / current_time, 2)) + 'x')
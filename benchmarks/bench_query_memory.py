@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+benchmark: memory of the query_catalog DataFrame with every field vs fields= projection
+and compact=True, on a synthetic sentinel-2 search response
+
+reports the DataFrame size, memory_usage(deep=True)
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import eodslib
+
+
+def make_response(n_records):
+    random.seed(0)
+    objects = []
+    for i in range(n_records):
+        title = ('S2' + random.choice('AB') + '_2021' + str(random.randint(1, 12)).zfill(2) + str(random.randint(1, 28)).zfill(2)
+                 + '_lat52lon1_T30U' + random.choice('VWXY') + random.choice('ABCD') + '_ORB' + str(random.randint(1, 143)).zfill(3)
+                 + '_utm30n_osgb_vmsk_sharp_rad_srefdem_stdsref')
+        objects.append({
+            'id': i, 'uuid': '%032x' % random.getrandbits(128), 'title': title, 'alternate': 'geonode:' + title + '_' + str(i),
+            'abstract': 'Sentinel-2 analysis ready data processed with ARCSI. ' * 20,
+            'supplemental_information': 'Data Collection Time: 2021\nARCSI_CLOUD_COVER: ' + str(round(random.random(), 4)) + '\n' + 'ARCSI_META: x\n' * 30,
+            'csw_wkt_geometry': 'POLYGON((-2.4 51.9, -2.4 51.6, -1.9 51.6, -1.9 51.9, -2.4 51.9))',
+            'thumbnail_url': 'https://earthobs.defra.gov.uk/uploaded/thumbs/layer-' + '%032x' % random.getrandbits(128) + '-thumb.png',
+            'detail_url': '/layers/geonode:' + title, 'csw_type': 'dataset', 'category__gn_description': 'Imagery Base Maps Earth Cover',
+            'date': '2021-01-01T11:00:00', 'popular_count': random.randint(0, 50), 'share_count': 0, 'rating': 0,
+            'owner__username': 'eods', 'srid': 'EPSG:27700',
+        })
+    return {'meta': {'total_count': n_records}, 'objects': objects}
+
+
+def measure(json_response, output_dir, **kwargs):
+    kwargs.update({'sat_id': 2, 'output_dir': output_dir})
+    _, df = eodslib.process_query_response(json_response, kwargs)
+    return df.memory_usage(deep=True).sum() / 1e6, df.shape[1]
+
+
+if __name__ == "__main__":
+
+    app_parser = argparse.ArgumentParser(description='query DataFrame memory benchmark')
+    app_parser.add_argument('--records', type=int, default=20000)
+    args = app_parser.parse_args()
+
+    json_response = make_response(args.records)
+    fields = ['id', 'date', 'csw_wkt_geometry']
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        runs = [
+            ('every field           ', measure(json_response, output_dir)),
+            ('fields=' + str(len(fields)) + '              ', measure(json_response, output_dir, fields=fields)),
+            ('compact=True          ', measure(json_response, output_dir, compact=True)),
+            ('fields + compact      ', measure(json_response, output_dir, fields=fields, compact=True)),
+        ]
+
+    print('\n\t### ' + str(args.records) + ' sentinel-2 records')
+    for name, (df_mb, n_columns) in runs:
+        print('\t### ' + name + ': columns = ' + str(n_columns) + ', DataFrame (MB) = ' + str(round(df_mb, 1)))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+benchmark: the previous str.split chains vs eodslib.add_s2_columns one pass regex parsing
+of sentinel-2 titles, including the repeated astype(float) of string cloud values
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import eodslib
+import pandas as pd
+
+
+def make_frame(n_titles):
+    random.seed(0)
+    granules = ['T30U' + a + b for a in 'VWXY' for b in 'ABCDEFGH']
+    titles, info = [], []
+    for i in range(n_titles):
+        titles.append('S2' + random.choice('AB') + '_2021' + str(random.randint(1, 12)).zfill(2) + str(random.randint(1, 28)).zfill(2)
+                      + '_lat5' + str(random.randint(0, 9)) + 'lon' + str(random.randint(0, 9))
+                      + '_' + random.choice(granules) + '_ORB' + str(random.randint(1, 143)).zfill(3)
+                      + '_utm30n_osgb_vmsk_sharp_rad_srefdem_stdsref')
+        info.append('Data Collection Time: 2021\nARCSI_CLOUD_COVER: ' + str(round(random.random(), 6)) + '\nOTHER: 1')
+    return pd.DataFrame({'title': titles, 'supplemental_information': info})
+
+
+def split_chains(df):
+    df['granule-ref'] = df['title'].str.split('_', n=4).str[3]
+    df['orbit-ref'] = df['title'].str.split('_', n=5).str[-2]
+    df['ARCSI_CLOUD_COVER'] = df['supplemental_information'].str.split("ARCSI_CLOUD_COVER: ").str[-1].str.split("\n").str[0]
+    df['title_stub'] = df['title'].str.split('_T', expand=True).loc[:, 0] + '_' + df['granule-ref'].str[:6]
+    # cloud filter and sort as strings, converted at every use
+    df = df[df['ARCSI_CLOUD_COVER'].astype(float) * 100 >= 0]
+    df = df[df['ARCSI_CLOUD_COVER'].astype(float) * 100 <= 100]
+    return df.sort_values('ARCSI_CLOUD_COVER', kind='stable')
+
+
+def one_pass(df):
+    df = eodslib.add_s2_columns(df)
+    df['title_stub'] = df['title'].str.partition('_T')[0] + '_' + df['granule-ref'].astype(str).str[:6]
+    df = df[(df['ARCSI_CLOUD_COVER'] * 100 >= 0) & (df['ARCSI_CLOUD_COVER'] * 100 <= 100)]
+    return df.sort_values('ARCSI_CLOUD_COVER', kind='stable')
+
+
+def best_of(fn, frame, repeats):
+    times = []
+    for _ in range(repeats):
+        df = frame.copy()
+        start = time.perf_counter()
+        result = fn(df)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == "__main__":
+
+    app_parser = argparse.ArgumentParser(description='sentinel-2 title parsing benchmark')
+    app_parser.add_argument('--titles', type=int, default=100000)
+    app_parser.add_argument('--repeats', type=int, default=3)
+    args = app_parser.parse_args()
+
+    frame = make_frame(args.titles)
+
+    split_time, split_df = best_of(split_chains, frame, args.repeats)
+    regex_time, regex_df = best_of(one_pass, frame, args.repeats)
+
+    # compared in title order, sorting cloud values as strings misplaces eg '1e-05'
+    split_df, regex_df = split_df.sort_index(), regex_df.sort_index()
+    same = (split_df['granule-ref'].tolist() == regex_df['granule-ref'].astype(str).tolist()
+            and split_df['orbit-ref'].tolist() == regex_df['orbit-ref'].astype(str).tolist()
+            and split_df['ARCSI_CLOUD_COVER'].astype(float).tolist() == regex_df['ARCSI_CLOUD_COVER'].tolist())
+
+    print('\n\t### ' + str(args.titles) + ' titles, best of ' + str(args.repeats))
+    print('\t### str.split chains   : time (s) = ' + str(round(split_time, 3)) + ', memory (MB) = ' + str(round(split_df.memory_usage(deep=True).sum() / 1e6, 1)))
+    print('\t### one pass regex     : time (s) = ' + str(round(regex_time, 3)) + ', memory (MB) = ' + str(round(regex_df.memory_usage(deep=True).sum() / 1e6, 1)))
+    print('\t### identical values   : ' + str(same))
+    print('\t### speed-up           : ' + str(round(split_time / regex_time, 2)) + 'x')
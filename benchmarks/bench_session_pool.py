@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+benchmark: one-shot requests.get vs a pooled eodslib session against a local mock server
+
+counts the TCP connections the server accepts, i.e. the handshakes paid, and the wall time
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import eodslib
+import requests
+from mock_eods_server import MockEODSServer
+
+
+def status_route(handler):
+    body = b'<?xml version="1.0" encoding="UTF-8"?><wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0"><wps:Status><wps:ProcessStarted percentCompleted="50"/></wps:Status></wps:ExecuteResponse>'
+    return 200, {'Content-Type': 'application/xml'}, body
+
+
+def run(http, server, n_requests):
+    server.reset_counts()
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        response = http.get(server.url + '/geoserver/ows', params={'REQUEST': 'GetExecutionstatus'})
+        response.content
+    return time.perf_counter() - start, server.connection_count
+
+
+if __name__ == "__main__":
+
+    app_parser = argparse.ArgumentParser(description='session pooling benchmark')
+    app_parser.add_argument('--requests', type=int, default=500)
+    app_parser.add_argument('--latency', type=float, default=0.0, help='seconds of server side latency per request')
+    args = app_parser.parse_args()
+
+    with MockEODSServer({('GET', '/geoserver/ows'): status_route}, latency=args.latency) as server:
+
+        one_shot_time, one_shot_conns = run(requests, server, args.requests)
+        pooled_time, pooled_conns = run(eodslib.make_session(), server, args.requests)
+
+    print('\n\t### ' + str(args.requests) + ' status requests')
+    print('\t### requests.get      : connections = ' + str(one_shot_conns) + ', time (s) = ' + str(round(one_shot_time, 3)))
+    print('\t### pooled session    : connections = ' + str(pooled_conns) + ', time (s) = ' + str(round(pooled_time, 3)))
+    print('\t### handshakes saved  : ' + str(one_shot_conns - pooled_conns))
@@ -0,0 +1,93 @@
+"""
+minimal local stand-in for the EODS endpoints used by the benchmark scripts
+
+serves over plain HTTP/1.1 with keep-alive, counts accepted TCP connections and
+can add a fixed latency per request to mimic a remote host
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockEODSServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, routes, latency=0.0):
+        """
+        routes: dict mapping a (method, path) tuple to a callable(handler) returning (status, headers, body bytes)
+        latency: float, seconds slept before answering each request
+        """
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.routes = routes
+        self.latency = latency
+        self.connection_count = 0
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def get_request(self):
+        conn = super().get_request()
+        with self._lock:
+            self.connection_count += 1
+        return conn
+
+    def reset_counts(self):
+        with self._lock:
+            self.connection_count = 0
+            self.request_count = 0
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self, method):
+        with self.server._lock:
+            self.server.request_count += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+
+        route = self.server.routes.get((method, self.path.split('?')[0]))
+        if route is None:
+            status, headers, body = 404, {}, b''
+        else:
+            status, headers, body = route(self)
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
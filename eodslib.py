@@ -11,21 +11,225 @@ import sys
 import pandas as pd
 pd.options.mode.chained_assignment = None
 from pandas import json_normalize
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import requests
 from requests.exceptions import ConnectionError
 import json
+import re
+import codecs
 import time
+import random
+import hashlib
+import threading
+import asyncio
+import ssl
+import shutil
+import sqlite3
+import pickle
+import heapq
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, FIRST_EXCEPTION
 import xmltodict
 from zipfile import ZipFile
 import shapely
 import shapely.wkt
-from shapely.ops import transform
+import shapely.wkb
+from shapely.strtree import STRtree
+from shapely.geometry.base import BaseGeometry
 import pyproj
 import numpy as np
+try:
+    import aiohttp
+except ImportError:
+    # only required by the async_* functions
+    aiohttp = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # only required by query_catalog(..., output_format='parquet'/'geoparquet'/'feather')
+    pyarrow = None
+try:
+    import fcntl
+except ImportError:
+    # windows, QueryCache locks with msvcrt instead
+    fcntl = None
+    import msvcrt
 os.environ['PROJ_NETWORK'] = 'OFF'
 
+# shapely 2 has vectorised geometry arrays and index-returning STRtree queries
+SHAPELY2 = int(shapely.__version__.split('.')[0]) >= 2
+
+# shared keep-alive session used by run_wps and query_catalog when no session is given
+_default_session = None
+
+def make_session(pool_connections=10, pool_maxsize=10, pool_block=False, headers=None, verify=True, max_retries=0):
+    """
+    create a requests session holding a keep-alive connection pool, so repeated calls
+    to the same EODS host reuse TCP/TLS connections instead of opening a new one per request
+
+    Parameters:
+    -----------
+        pool_connections: int, optional,
+            number of per-host connection pools to cache
+            Default Value:
+                * 10
+
+        pool_maxsize: int, optional,
+            maximum number of connections kept open to any single host
+            Default Value:
+                * 10
+
+        pool_block: bool, optional,
+            if True, block when all connections to a host are in use rather than
+            opening a throwaway connection
+            Default Value:
+                * False
+
+        headers: dict, optional,
+            default headers sent with every request made through the session
+
+        verify: bool or str, optional:
+            default certificate verification for the session
+            Default Value:
+                * True
+            Possible Value:
+                * 'dir/dir/cert.file'
+
+        max_retries: int, optional,
+            connection-level retries handed to the underlying urllib3 adapter
+            Default Value:
+                * 0
+
+    Returns:
+    -----------
+        session: requests.Session,
+            session that can be passed as "session" to eodslib functions
+    """
+
+    session = requests.Session()
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=max_retries)
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers.update({'User-Agent': 'python'})
+    if headers is not None:
+        session.headers.update(headers)
+
+    session.verify = verify
+
+    return session
+
+def get_default_session():
+    """
+    return the module level keep-alive session, creating it on first use
+    """
+
+    global _default_session
+
+    if _default_session is None:
+        _default_session = make_session()
+
+    return _default_session
+
+def _http(request_config):
+    """
+    return the session held in a request config, or the requests module itself
+    so callers that never set up a session keep the original one-shot behaviour
+    """
+
+    return request_config.get('session') or requests
+
+# BackoffPolling arguments per wps template, "default" is used for any template not listed.
+# edit or extend to tune polling for other templates
+POLLING_DEFAULTS = {
+    'default': {'min_interval':2, 'max_interval':60},
+    'rascropcoverage_template.xml': {'min_interval':1, 'max_interval':30},
+    'bandselect_template_rgb.xml': {'min_interval':1, 'max_interval':30},
+    'gsdownload_template.xml': {'min_interval':5, 'max_interval':300},
+    'gsdownload-EODS-small-s2.xml': {'min_interval':5, 'max_interval':120},
+    # whole sentinel-1 scenes can take an hour or more to package
+    'gsdownload-EODS-large-s1.xml': {'min_interval':30, 'max_interval':900},
+}
+
+class BackoffPolling():
+    """
+    polling strategy for wps jobs, called as polling(execution_dict, attempt) and returning
+    the seconds to wait before the next status check
+
+    without progress information the wait grows exponentially from min_interval by
+    factor per attempt. once the server reports percentCompleted the wait is the
+    predicted time remaining, extrapolated from the time since wps:ProcessStarted.
+    the wait has +/- jitter applied and is always kept between min_interval and max_interval
+
+    Parameters:
+    -----------
+        min_interval: int or float, optional,
+            shortest wait in seconds
+            Default Value:
+                * 2
+
+        max_interval: int or float, optional,
+            longest wait in seconds
+            Default Value:
+                * 60
+
+        factor: int or float, optional,
+            multiplier applied to the wait after each attempt
+            Default Value:
+                * 2
+
+        jitter: float, optional,
+            fraction of random spread applied to each wait
+            Default Value:
+                * 0.1
+    """
+
+    def __init__(self, min_interval=2, max_interval=60, factor=2, jitter=0.1):
+
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError('ERROR. polling intervals must satisfy 0 < min_interval <= max_interval, aborting ...')
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+
+    def __call__(self, execution_dict, attempt):
+
+        interval = self.min_interval * self.factor ** (attempt - 1)
+
+        percent_completed = execution_dict.get('percent_completed')
+        timestamp_started = execution_dict.get('timestamp_process_started')
+
+        if percent_completed is not None and 0 < percent_completed < 100 and timestamp_started is not None:
+            elapsed = (datetime.utcnow() - timestamp_started).total_seconds()
+            interval = elapsed * (100 - percent_completed) / percent_completed
+
+        interval = interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        return min(self.max_interval, max(self.min_interval, interval))
+
+def get_polling(config_wpsprocess, kwargs):
+    """
+    return the polling strategy given in kwargs, or a BackoffPolling built from
+    POLLING_DEFAULTS for the template of the wps job
+    """
+
+    if 'polling' in kwargs:
+        return kwargs['polling']
+
+    template_xml = config_wpsprocess.get('template_xml')
+
+    return BackoffPolling(**POLLING_DEFAULTS.get(template_xml, POLLING_DEFAULTS['default']))
+
 def run_wps(conn, config_wpsprocess, **kwargs):
     """
     primary function to orchestrate running the wps job from submission to download (if required)
@@ -63,6 +267,70 @@ def run_wps(conn, config_wpsprocess, **kwargs):
             Possible Value:
                 * 'dir/dir/cert.file'    
 
+        session: requests.Session, optional:
+            keep-alive session used for every WPS request of the job, see make_session()
+            Default Value:
+                * the shared session returned by get_default_session()
+
+        download_retries: int, optional:
+            number of download attempts, each resuming from the bytes already on disk
+            Default Value:
+                * 3
+
+        download_backoff: int or float, optional:
+            seconds to wait after the first failed download attempt, doubling after each
+            further failure
+            Default Value:
+                * 5
+
+        segmented_download: bool, optional:
+            if True, large results are fetched as concurrent byte ranges, see
+            download_wps_result_segmented()
+            Default Value:
+                * False
+
+        max_segments: int, optional:
+            upper limit on the number of concurrent byte ranges of a segmented download
+            Default Value:
+                * 8
+
+        min_segment_size: int, optional:
+            smallest byte range of a segmented download, results smaller than two
+            segments are downloaded as a single stream
+            Default Value:
+                * 67108864 (64 MB)
+
+        polling: callable, optional:
+            polling strategy called as polling(execution_dict, attempt) after each status
+            check, returning the seconds to wait before the next one
+            Default Value:
+                * BackoffPolling built from POLLING_DEFAULTS for the job's template_xml
+            Possible Value:
+                * BackoffPolling(min_interval=1, max_interval=60)
+                * lambda execution_dict, attempt: 15
+
+        journal: bool, optional:
+            if True, every state transition of the job is appended to
+            "wps-journal.jsonl" in output_dir, see JobJournal
+            Default Value:
+                * False
+
+        resume: bool, optional:
+            if True, reuse the journal in output_dir: a job that already finished
+            post-processing is returned without a request, a job with an execution ID
+            is reattached and polled, and only a job that never started or that the
+            server reported as failed is submitted. implies journal=True
+            Default Value:
+                * False
+
+        cache: ResultCache or str or Pathlib object, optional:
+            result cache (or its directory) checked before submission. a job whose
+            rendered payload and wps server match a cached result is served from disk
+            without a geoserver execution, see ResultCache. runs given the same
+            directory share one ResultCache, see get_result_cache()
+            Default Value:
+                * None
+                
     Returns:
     -----------
         list_download_paths: list,
@@ -70,24 +338,19 @@ def run_wps(conn, config_wpsprocess, **kwargs):
 
     """
 
-    # set output path if not specified
-    if 'output_dir' not in kwargs:
-        kwargs['output_dir']=Path.cwd()
+    request_config = make_request_config(conn, kwargs)
+    execution_dict = resume_or_none(request_config, config_wpsprocess, kwargs)
 
-    if 'verify' not in kwargs:
-        kwargs['verify'] = True
+    if execution_dict is None:
+        execution_dict = cache_lookup(request_config, config_wpsprocess, kwargs['output_dir'])
 
-    # set the request config dictionary 
-    request_config = {
-        'wps_server':conn['domain'] + '/geoserver/ows',
-        'access_token':conn['access_token'],
-        'headers':{'Content-type': 'application/xml','User-Agent': 'python'},
-        'verify':kwargs['verify']
-    }
+    if execution_dict is not None and execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL':
+        return finalise_execution_dict(execution_dict, make_output_dir(kwargs['output_dir']))
 
     # submit wps jobs
     try:
-        execution_dict = submit_wps_queue(request_config, config_wpsprocess)
+        if execution_dict is None:
+            execution_dict = submit_wps_queue(request_config, config_wpsprocess)
     except Exception as error:
         print(error.args)
         print('The WPS submission has failed')
@@ -97,612 +360,3261 @@ def run_wps(conn, config_wpsprocess, **kwargs):
         path_output = make_output_dir(kwargs['output_dir'])
 
 
+        polling = get_polling(config_wpsprocess, kwargs)
+
         # keep calling the wps job status until 'continue_process' = False 
+        attempt = 0
         while True:
 
             execution_dict = poll_api_status(execution_dict, request_config, path_output)
+            attempt += 1
 
             if execution_dict['continue_process']:
-                time.sleep(15)
+                time.sleep(polling(execution_dict, attempt))
             else:
                 break
 
         # after download is complete, process downloaded files (eg renames and extracting zips)
         if execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL':
-            execution_dict = process_wps_downloaded_files(execution_dict)
+            execution_dict = process_and_record(request_config, execution_dict)
         
-        # set log file and job duration in dict
-        execution_dict['log_file_path'] = path_output / 'wps-log.csv'
-        execution_dict['total_job_duration'] = (execution_dict['timestamp_job_end'] - execution_dict['timestamp_job_start']).total_seconds() / 60
+        return finalise_execution_dict(execution_dict, path_output)
 
-        return execution_dict
+def run_wps_batch(conn, configs, max_in_flight=4, **kwargs):
+    """
+    run many wps jobs with bounded concurrency from a single scheduler loop
 
-def submit_wps_queue(request_config, config_wpsprocess):
-   
-    print('\n\t\t### ' + datetime.utcnow().isoformat() + ' :: WPS SUBMISSION :: lyr=' + config_wpsprocess['xml_config']['template_layer_name'])
+    up to max_in_flight jobs are kept executing on the server at once. every outstanding
+    execution ID is polled each pass of the loop, and finished results are downloaded in
+    worker threads while the remaining jobs are still running
 
-    try:
-        # overwrite xml string with job specific parameters
-        payload = mod_the_xml(config_wpsprocess)
+    Parameters:
+    -----------
+        conn: dict,
+            Connection parameters, see run_wps()
 
-        response = requests.post(
-            request_config['wps_server'],
-            params={'access_token':request_config['access_token'],'SERVICE':'WPS','VERSION':'1.0.0','REQUEST':'EXECUTE'},
-            data=payload,
-            headers=request_config['headers'],
-            verify=request_config['verify'])
+        configs: list,
+            list of config_wpsprocess dictionaries, one per wps job, see run_wps()
 
-        try:
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            # response status was not 200
-            raise ValueError('non-200 response, additional info (MAY CONTAIN SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE)' , str(e))
+        max_in_flight: int, optional,
+            maximum number of jobs submitted to the server and not yet finished
+            Default Value:
+                * 4
 
-        else:
-            if not response.text.find('ExceptionReport') > 0:
+        max_downloads: int, optional,
+            maximum number of concurrent downloads
+            Default Value:
+                * max_in_flight
 
-                execution_dict = {
-                        'job_id':response.text.split('executionId=')[1].split('&')[0],
-                        'layer_name':config_wpsprocess['xml_config']['template_layer_name'],
-                        'timestamp_job_start':datetime.utcnow(),
-                        'continue_process':True,
-                        }
+        output_dir, verify, session, polling, journal, resume, cache: optional,
+            as for run_wps(), without "polling" each job uses the default for its template
 
-                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: WPS JOB SUBMITTED')
-                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: WPS STATUS CHECK URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) : ' + request_config['wps_server'] + '?SERVICE=WPS&VERSION=1.0.0&REQUEST=GETEXECUTIONSTATUS&EXECUTIONID=' + execution_dict['job_id'] + '&access_token=' + request_config['access_token'])
-                
-                return execution_dict
-            else:
-                raise ValueError('wps server returned an exception', str(response.text))
-                    
-    except ValueError as error:
+    Returns:
+    -----------
+        list_of_results: list,
+            execution dicts in the same order as configs, suitable for output_log()
+    """
 
-        # handle two different valueErrors for connection fail and incorrect WPS submission parmeters
+    if 'output_dir' not in kwargs:
+        kwargs['output_dir'] = Path.cwd()
 
-        execution_dict = error
+    if 'max_downloads' not in kwargs:
+        kwargs['max_downloads'] = max_in_flight
 
-        print(datetime.utcnow().isoformat() + ' :: WPS submission failed :: check log for errors (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + str(error.args))
+    if max_in_flight < 1:
+        raise ValueError('ERROR. max_in_flight must be 1 or more, aborting ...')
 
-        return execution_dict
+    request_config = make_request_config(conn, kwargs)
+    path_output = make_output_dir(kwargs['output_dir'])
 
-def poll_api_status(execution_dict, request_config, path_output):
-    """
-    for each execution job, return the status of the job
-    """
+    pending = list(enumerate(configs))
+    in_flight = {}
+    next_poll = {}
+    downloads = {}
+    list_of_results = [None] * len(configs)
 
-    try:
+    with ThreadPoolExecutor(max_workers=kwargs['max_downloads']) as pool:
 
-        if execution_dict['continue_process']:
+        while pending or in_flight or downloads:
 
-            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: CHECKING STATUS')
+            # top up the jobs executing on the server
+            while pending and len(in_flight) < max_in_flight:
 
-            params = {
-                'access_token':request_config['access_token'],
-                'SERVICE':'WPS',
-                'VERSION':'1.0.0',
-                'REQUEST':'GetExecutionstatus',
-                'EXECUTIONID':execution_dict['job_id'],
-                }
+                i, config_wpsprocess = pending.pop(0)
+                execution_dict = resume_or_none(request_config, config_wpsprocess, kwargs)
 
-            response = requests.get(
-                request_config['wps_server'],
-                params=params,
-                headers=request_config['headers'],
-                verify=request_config['verify']
-                )
+                if execution_dict is None:
+                    execution_dict = cache_lookup(request_config, config_wpsprocess, path_output)
 
-            # parse xml to python dictionary 
-            d = xmltodict.parse(response.content)
+                if execution_dict is None:
+                    try:
+                        execution_dict = submit_wps_queue(request_config, config_wpsprocess)
+                    except Exception as error:
+                        # a connection error or timeout fails this job only, not the whole batch
+                        print(datetime.utcnow().isoformat() + ' :: WPS submission failed :: lyr=' + config_wpsprocess['xml_config']['template_layer_name'] + ' :: ' + repr(error))
+                        execution_dict = error
+                elif execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL':
+                    list_of_results[i] = finalise_execution_dict(execution_dict, path_output)
+                    continue
+                elif execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL':
+                    downloads[pool.submit(download_and_process, request_config, execution_dict, path_output)] = i
+                    continue
+
+                if isinstance(execution_dict, dict):
+                    in_flight[i] = execution_dict
+                    next_poll[i] = (time.monotonic(), 0, get_polling(config_wpsprocess, kwargs))
+                else:
+                    execution_dict = submission_failed_dict(config_wpsprocess, execution_dict)
+                    record_state(request_config, execution_dict)
+                    list_of_results[i] = finalise_execution_dict(execution_dict, path_output)
+
+            # status check for every outstanding execution ID that is due
+            for i, execution_dict in list(in_flight.items()):
+
+                due, attempt, polling = next_poll[i]
+                if due > time.monotonic():
+                    continue
+
+                execution_dict = poll_api_status(execution_dict, request_config, path_output, download=False)
+                attempt += 1
+
+                if execution_dict.get('job_status') == 'READY-TO-DOWNLOAD':
+                    del in_flight[i], next_poll[i]
+                    downloads[pool.submit(download_and_process, request_config, execution_dict, path_output)] = i
+                elif not execution_dict['continue_process']:
+                    del in_flight[i], next_poll[i]
+                    list_of_results[i] = finalise_execution_dict(execution_dict, path_output)
+                else:
+                    next_poll[i] = (time.monotonic() + polling(execution_dict, attempt), attempt, polling)
 
-            if 'wps:ExecuteResponse' in d:
+            # collect any finished downloads
+            for future in [f for f in downloads if f.done()]:
+                list_of_results[downloads.pop(future)] = finalise_execution_dict(future.result(), path_output)
 
-                if 'wps:ProcessSucceeded' in d['wps:ExecuteResponse']['wps:Status']:
+            if in_flight:
+                time.sleep(max(0, min(due for due, _, _ in next_poll.values()) - time.monotonic()))
+            elif downloads and not pending:
+                wait(list(downloads), return_when=FIRST_COMPLETED)
 
-                    execution_dict.update({
-                        'job_status':'READY-TO-DOWNLOAD',
-                        'dl_url':d['wps:ExecuteResponse']['wps:ProcessOutputs']['wps:Output']['wps:Reference']['@href'] + '&access_token=' + request_config['access_token'],
-                        'mime_type':d['wps:ExecuteResponse']['wps:ProcessOutputs']['wps:Output']['wps:Reference']['@mimeType'],
-                        'timestamp_ready_to_dl':datetime.utcnow(),
-                        })
+    return list_of_results
 
-                    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: READY FOR DOWNLOAD')
+def make_request_config(conn, kwargs):
+    """
+    build the request config dictionary shared by the wps functions, filling in
+    defaults for "output_dir", "session" and "verify" in kwargs
+    """
 
-                    # if successful, return status = DOWNLOADED
-                    execution_dict = download_wps_result_single(request_config, execution_dict, path_output)
+    # set output path if not specified
+    if 'output_dir' not in kwargs:
+        kwargs['output_dir']=Path.cwd()
 
-                elif 'wps:ProcessFailed' in d['wps:ExecuteResponse']['wps:Status']:
+    if 'session' not in kwargs:
+        kwargs['session'] = get_default_session()
 
-                    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: JOB-FAILED ... check LOG for further details')
+    if 'verify' not in kwargs:
+        kwargs['verify'] = kwargs['session'].verify
 
-                    # TODO: add exception message. Needs testing
-                    execution_dict.update({
-                        'job_status':'WPS-FAILURE',
-                        'continue_process':False,
-                        'message':'GEOSERVER FAILURE REPORT',
-                        'timestamp_job_end':datetime.utcnow(),
-                        })
-                else:
-                    execution_dict.update({'job_status':'OUTSTANDING'})
-                    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STILL IN PROGRESS')
+    # set the request config dictionary 
+    request_config = {
+        'wps_server':conn['domain'] + '/geoserver/ows',
+        'access_token':conn['access_token'],
+        'headers':{'Content-type': 'application/xml','User-Agent': 'python'},
+        'verify':kwargs['verify'],
+        'session':kwargs['session'],
+    }
 
-            elif 'ows:ExceptionReport' in d:
+    # optional download settings, see download_wps_result_single() and download_wps_result_segmented()
+    for key in ['download_retries', 'download_backoff', 'segmented_download', 'max_segments', 'min_segment_size']:
+        if key in kwargs:
+            request_config[key] = kwargs[key]
 
-                exception_text = d['ows:ExceptionReport']['ows:Exception']['ows:ExceptionText']
+    # optional result cache, see ResultCache
+    if kwargs.get('cache') is not None:
+        request_config['cache'] = kwargs['cache'] if isinstance(kwargs['cache'], ResultCache) else get_result_cache(kwargs['cache'])
 
-                execution_dict.update({
-                    'job_status':'WPS-GENERAL-ERROR',
-                    'continue_process':False,
-                    'message':'THIS IS A GENERAL ERROR WITH A WPS JOB. ERROR MESSAGE = ' + str(exception_text),
-                    'timestamp_job_end':datetime.utcnow(),
-                    })
+    return request_config
 
-                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: JOB-FAILED ... check LOG for further details')
-              
-        return execution_dict
+def download_and_process(request_config, execution_dict, path_output):
+    """
+    download a READY-TO-DOWNLOAD wps result and post-process the downloaded file,
+    catching any error so a failure in a download worker only fails its own job
+    """
+
+    try:
+        if execution_dict['job_status'] == 'READY-TO-DOWNLOAD':
+            execution_dict = download_wps_result(request_config, execution_dict, path_output)
+
+        if execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL':
+            execution_dict = process_and_record(request_config, execution_dict)
 
     except Exception as error:
 
-        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: UNKNOWN EXCEPTION')
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + str(execution_dict.get('job_id')) + ' :: UNKNOWN EXCEPTION')
 
         execution_dict.update({
             'job_status':'UNKNOWN-GENERAL-ERROR',
             'continue_process':False,
-            'message':'UNKNOWN GENERAL ERROR ENCOUNTERED WHEN CHECKING STATUS OF WPS JOB. ERROR MESSAGE:' + str(error),
+            'message':'UNKNOWN GENERAL ERROR ENCOUNTERED WHEN DOWNLOADING OR PROCESSING WPS RESULT. ERROR MESSAGE:' + str(error),
             'timestamp_job_end':datetime.utcnow(),
             })
-        return execution_dict
 
-def download_wps_result_single(request_config, execution_dict, path_output):
+        try:
+            record_state(request_config, execution_dict)
+        except Exception as journal_error:
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + str(execution_dict.get('job_id')) + ' :: JOURNAL WRITE FAILED :: ' + str(journal_error))
+
+    return execution_dict
+
+def process_and_record(request_config, execution_dict):
     """
-    function to get a wps result if the response is SUCCEEDED AND download is set to True in the config
+    post-process a downloaded wps result and journal the outcome, first adding the
+    download to the result cache if the job missed it
     """
-    
-    file_extension = '.' + execution_dict['mime_type'].split('/')[1]
-    filename_stub = execution_dict['layer_name'].split(':')[-1]
-    dl_path = path_output / filename_stub
-    dl_path.mkdir(parents=True, exist_ok=True)
-    local_file_name = Path(dl_path / str( filename_stub + file_extension))
 
-    # make three download attempts
-    for i in [1,2,3]:
+    cache = request_config.get('cache')
 
-        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD START : TRY ' + str(i) + ' of 3')
-        
+    if cache is not None and execution_dict.get('cache_status') == 'MISS':
         try:
+            cache.store(execution_dict)
+        except Exception as error:
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: CACHE STORE FAILED :: ' + str(error))
 
-            with requests.get(
-                execution_dict['dl_url'],
-                headers=request_config['headers'],
-                verify=request_config['verify'],
-                stream=True) as response:
-                
-                with open(local_file_name, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192*1024):
-                        f.write(chunk)
-
-            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD COMPLETE ON TRY ' + str(i))
+    execution_dict = process_wps_downloaded_files(execution_dict)
+    record_state(request_config, execution_dict)
 
-            execution_dict.update({
-                'job_status':'DOWNLOAD-SUCCESSFUL',
-                'continue_process':False,
-                'dl_file':local_file_name,
-                'file_extension':file_extension,
-                'filename_stub':filename_stub,
-                'timestamp_dl_end':datetime.utcnow(),
-                'timestamp_job_end':datetime.utcnow(),
-                'download_try':i
-                })
+    return execution_dict
 
-            return execution_dict
+def submission_failed_dict(config_wpsprocess, error):
+    """
+    execution dict recording a wps submission that never returned an execution ID
+    """
 
-        except Exception as error:
+    return {
+        'job_id':None,
+        'job_key':job_key(config_wpsprocess),
+        'layer_name':config_wpsprocess['xml_config']['template_layer_name'],
+        'job_status':'WPS-SUBMISSION-FAILED',
+        'continue_process':False,
+        'message':str(error.args),
+        'timestamp_job_start':datetime.utcnow(),
+        'timestamp_job_end':datetime.utcnow(),
+        }
+
+def finalise_execution_dict(execution_dict, path_output):
+    """
+    set log file and job duration in the execution dict of a finished job
+    """
 
-            if i == 3:
+    execution_dict['log_file_path'] = path_output / 'wps-log.csv'
+    execution_dict['total_job_duration'] = (execution_dict['timestamp_job_end'] - execution_dict['timestamp_job_start']).total_seconds() / 60
 
-                execution_dict.update({
-                    'job_status':'DOWNLOAD-FAILED',
-                    'continue_process':False,
-                    'message':str(error),
-                    'timestamp_job_end':datetime.utcnow(),
-                    'download_try': i,
-                    })
+    return execution_dict
 
-                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STATUS : ' + execution_dict['job_status'] + ' :: MESSAGE :' + execution_dict['message'])
+class JobJournal():
+    """
+    append-only JSON lines journal of wps job state transitions, so an interrupted
+    run can be resumed without resubmitting jobs that already started
 
-                return execution_dict
+    one line is written per transition, holding the execution dict of the job. the
+    latest line for each job_key wins when the journal is read back
 
-def process_wps_downloaded_files(execution_dict):
-    """
-    function to rename downloaded file if TIFF or extract from zip 
+    Parameters:
+    -----------
+        path: str or Pathlib object,
+            journal file, created if it does not exist
     """
-    
-    try:
 
-        source_file_to_extract = execution_dict['dl_file']
+    def __init__(self, path):
 
-        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: PROCESS DOWNLOAD START')
+        self.path = Path(path)
+        self.latest = {}
+        self._lock = threading.Lock()
 
-        # handle rename of zip contents
-        if source_file_to_extract.suffix.lower() == '.zip':
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash mid-write
+                        continue
+                    self.latest[record['job_key']] = decode_execution_dict(record)
 
-            zip_ref = ZipFile(source_file_to_extract, 'r')
-            zip_ref.extractall(source_file_to_extract.parent.parent)
-            zip_list = zip_ref.filelist
-            zip_ref.close()
-            source_file_to_extract.unlink()            
+    def record(self, execution_dict):
+        """
+        append the execution dict if its job_status changed since the last record
+        """
 
-            # loop through zip contents
-            for f in zip_list:
-            
-                f_path = Path(source_file_to_extract.parent.parent / f.filename)
-            
-                if f_path.suffix.lower() == ".sld":
-                    f_path.unlink()
-                else:
-                    Path(f_path).replace(source_file_to_extract.parent.parent / str(execution_dict['filename_stub'] + f_path.suffix.lower()))
+        with self._lock:
 
-        else:
-            Path(source_file_to_extract).rename(source_file_to_extract.parent.parent / str(execution_dict['filename_stub'] + source_file_to_extract.suffix.lower()))
+            previous = self.latest.get(execution_dict['job_key'])
+            if previous is not None and previous.get('job_status') == execution_dict.get('job_status'):
+                return
 
-        # del download directory
-        if source_file_to_extract.parent.is_dir():
-            source_file_to_extract.parent.rmdir()
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(execution_dict, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
 
-        execution_dict.update({
-            'job_status':'LOCAL-POST-PROCESSING-SUCCESSFUL',
-            'timestamp_extraction_end':datetime.utcnow(),
-            'timestamp_job_end':datetime.utcnow(),
-        })
+            self.latest[execution_dict['job_key']] = dict(execution_dict)
+
+    def resume(self, config_wpsprocess):
+        """
+        return the latest execution dict of a job that can be resumed or skipped, or
+        None if the job never started or failed on the server and must be submitted
+        """
+
+        execution_dict = self.latest.get(job_key(config_wpsprocess))
+
+        if execution_dict is None or execution_dict.get('job_id') is None:
+            return None
+
+        execution_dict = dict(execution_dict)
+
+        if execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL':
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: RESUME :: ALREADY COMPLETE, SKIPPING')
+            return execution_dict
+
+        if execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL' and Path(execution_dict['dl_file']).exists():
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: RESUME :: ALREADY DOWNLOADED')
+            return execution_dict
+
+        # a client side error, eg a dropped connection on the status request, leaves the execution
+        # running on the server, so only WPS-FAILURE and WPS-GENERAL-ERROR are resubmitted
+        if execution_dict['job_status'] in ['SUBMITTED', 'OUTSTANDING', 'READY-TO-DOWNLOAD', 'DOWNLOAD-SUCCESSFUL', 'DOWNLOAD-FAILED', 'UNKNOWN-GENERAL-ERROR']:
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: RESUME :: REATTACHING TO EXISTING EXECUTION ID')
+            execution_dict.update({'continue_process':True})
+            return execution_dict
+
+        return None
+
+def decode_execution_dict(record):
+    """
+    restore datetime and path values of an execution dict read back from the journal
+    """
+
+    for key, value in record.items():
+        if value is not None and key.startswith('timestamp_'):
+            record[key] = datetime.fromisoformat(value)
+        elif value is not None and key in ['dl_file', 'log_file_path']:
+            record[key] = Path(value)
+
+    return record
+
+def job_key(config_wpsprocess):
+    """
+    stable identifier of a wps job, a hash of its template and xml_config
+    """
+
+    key_source = json.dumps(
+        {'template_xml':config_wpsprocess.get('template_xml'), 'xml_config':config_wpsprocess.get('xml_config')},
+        sort_keys=True, default=str)
+
+    return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+def record_state(request_config, execution_dict):
+    """
+    write the execution dict to the journal in the request config, if there is one
+    """
+
+    journal = request_config.get('journal')
+
+    if journal is not None and isinstance(execution_dict, dict) and 'job_key' in execution_dict:
+        journal.record(execution_dict)
+
+def resume_or_none(request_config, config_wpsprocess, kwargs):
+    """
+    set up the journal requested by the "journal"/"resume" kwargs and return the
+    resumable execution dict for the job, or None if it has to be submitted
+    """
+
+    if 'journal' not in kwargs:
+        kwargs['journal'] = False
+
+    if 'resume' not in kwargs:
+        kwargs['resume'] = False
+
+    if not (kwargs['journal'] or kwargs['resume']):
+        return None
+
+    if 'journal' not in request_config:
+        path_output = make_output_dir(kwargs['output_dir'])
+        request_config['journal'] = JobJournal(path_output / 'wps-journal.jsonl')
+
+    if kwargs['resume']:
+        return request_config['journal'].resume(config_wpsprocess)
+
+    return None
+
+class ResultCache():
+    """
+    content-addressed cache of downloaded wps results, keyed by the rendered xml payload
+    and the wps server, so a repeat job is served from disk without a geoserver execution
+
+    each entry is a directory named by its key, holding the downloaded file and an
+    "entry.json" of its metadata. entries older than max_age are dropped when looked up,
+    and the least recently used entries are evicted once the cache grows past max_bytes.
+    lookups, writes and evictions hold a lock file, so several processes can share one
+    cache directory. use get_result_cache() to share one instance, and its hit and miss
+    counts, between runs in a process
+
+    Parameters:
+    -----------
+        path: str or Pathlib object,
+            cache directory, created if it does not exist
+
+        max_bytes: int, optional,
+            size limit of the cached files
+            Default Value:
+                * None (unlimited)
+
+        max_age: int or float, optional,
+            seconds after which a cached result is no longer used
+            Default Value:
+                * None (never expires)
+    """
+
+    def __init__(self, path, max_bytes=None, max_age=None):
+
+        self.path = make_output_dir(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        with file_lock(self.path / '.lock'):
+            self._load()
+
+    def _load(self):
+
+        # entries written or evicted by other processes since the last load
+        self.entries = {}
+
+        for entry_file in self.path.glob('*/entry.json'):
+            try:
+                self.entries[entry_file.parent.name] = json.loads(entry_file.read_text())
+            except (OSError, ValueError):
+                continue
+
+    def fetch(self, key, path_output):
+        """
+        copy a cached result into its download directory under path_output and return
+        a DOWNLOAD-SUCCESSFUL execution dict, or None on a miss
+        """
+
+        with self._lock, file_lock(self.path / '.lock'):
+
+            try:
+                entry = self.entries[key] = json.loads((self.path / key / 'entry.json').read_text())
+            except (OSError, ValueError):
+                self.entries.pop(key, None)
+                entry = None
+
+            if entry is not None and self.max_age is not None and time.time() - entry['created'] > self.max_age:
+                self._evict(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry['last_used'] = time.time()
+            self._write_entry(key, entry)
+
+            execution_dict = {
+                'job_id':'CACHE-' + key[:12],
+                'layer_name':entry['layer_name'],
+                'mime_type':entry['mime_type'],
+                'timestamp_job_start':datetime.utcnow(),
+                }
+
+            file_extension, filename_stub, local_file_name = make_download_path(execution_dict, path_output)
+            shutil.copyfile(self.path / key / entry['file_name'], local_file_name)
+
+            execution_dict.update({
+                'job_status':'DOWNLOAD-SUCCESSFUL',
+                'continue_process':False,
+                'dl_file':local_file_name,
+                'file_extension':file_extension,
+                'filename_stub':filename_stub,
+                'timestamp_job_end':datetime.utcnow(),
+                'cache_key':key,
+                'cache_status':'HIT',
+                'cache_hits':self.hits,
+                'cache_misses':self.misses,
+                })
+
+        return execution_dict
+
+    def store(self, execution_dict):
+        """
+        copy the downloaded file of an execution dict into the cache under its cache_key,
+        then evict least recently used entries beyond max_bytes
+        """
+
+        key = execution_dict['cache_key']
+        source = Path(execution_dict['dl_file'])
+        entry_dir = self.path / key
+        entry_dir.mkdir(exist_ok=True)
+
+        part_file = entry_dir / (source.name + '.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.part')
+        shutil.copyfile(source, part_file)
+
+        entry = {
+            'file_name':source.name,
+            'layer_name':execution_dict['layer_name'],
+            'mime_type':execution_dict['mime_type'],
+            'size':part_file.stat().st_size,
+            'created':time.time(),
+            'last_used':time.time(),
+            }
+
+        with self._lock, file_lock(self.path / '.lock'):
+
+            # another process may have evicted the entry directory since the copy
+            entry_dir.mkdir(exist_ok=True)
+            if not part_file.exists():
+                return
+            os.replace(part_file, entry_dir / source.name)
+
+            self._load()
+            self.entries[key] = entry
+            self._write_entry(key, entry)
+
+            if self.max_bytes is not None:
+                total = sum(e['size'] for e in self.entries.values())
+                for old_key in sorted(self.entries, key=lambda k: self.entries[k]['last_used']):
+                    if total <= self.max_bytes:
+                        break
+                    total -= self.entries[old_key]['size']
+                    self._evict(old_key)
+
+    def _write_entry(self, key, entry):
+
+        part_file = self.path / key / ('entry.json.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.part')
+
+        with open(part_file, 'w') as f:
+            json.dump(entry, f)
+
+        os.replace(part_file, self.path / key / 'entry.json')
+
+    def _evict(self, key):
+
+        self.entries.pop(key, None)
+        shutil.rmtree(self.path / key, ignore_errors=True)
+
+# ResultCache instances by resolved path, so repeat runs in a process share one and its counts
+_result_caches = {}
+_result_caches_lock = threading.Lock()
+
+def get_result_cache(path):
+    """
+    return the ResultCache of the cache directory path, creating it on first use
+    """
+
+    key = Path(path).expanduser().resolve()
+
+    with _result_caches_lock:
+
+        if key not in _result_caches:
+            _result_caches[key] = ResultCache(key)
+
+        return _result_caches[key]
+
+def result_cache_key(request_config, config_wpsprocess):
+    """
+    ResultCache key of a wps job, a hash of the wps server and the rendered xml payload
+    """
+
+    key_source = request_config['wps_server'] + '\n' + mod_the_xml(config_wpsprocess)
+
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def cache_lookup(request_config, config_wpsprocess, path_output):
+    """
+    return the post-processed execution dict of a cached wps result, or None if there is
+    no cache in the request config or the job is not in it
+    """
+
+    cache = request_config.get('cache')
+
+    if cache is None:
+        return None
+
+    execution_dict = cache.fetch(result_cache_key(request_config, config_wpsprocess), make_output_dir(path_output))
+
+    if execution_dict is None:
+        return None
+
+    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: RESULT CACHE HIT, SKIPPING SUBMISSION')
+
+    return process_and_record(request_config, execution_dict)
+
+def submit_wps_queue(request_config, config_wpsprocess):
+   
+    print('\n\t\t### ' + datetime.utcnow().isoformat() + ' :: WPS SUBMISSION :: lyr=' + config_wpsprocess['xml_config']['template_layer_name'])
+
+    try:
+        # overwrite xml string with job specific parameters
+        payload = mod_the_xml(config_wpsprocess)
+
+        response = _http(request_config).post(
+            request_config['wps_server'],
+            params={'access_token':request_config['access_token'],'SERVICE':'WPS','VERSION':'1.0.0','REQUEST':'EXECUTE'},
+            data=payload,
+            headers=request_config['headers'],
+            verify=request_config['verify'])
+
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            # response status was not 200
+            raise ValueError('non-200 response, additional info (MAY CONTAIN SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE)' , str(e))
+
+        else:
+            return parse_submission_response(response.text, request_config, config_wpsprocess)
+                    
+    except ValueError as error:
+
+        # handle two different valueErrors for connection fail and incorrect WPS submission parmeters
+
+        execution_dict = error
+
+        print(datetime.utcnow().isoformat() + ' :: WPS submission failed :: check log for errors (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + str(error.args))
+
+        return execution_dict
+
+def parse_submission_response(text, request_config, config_wpsprocess):
+    """
+    build the execution dict from the body of a WPS Execute response, raising a
+    ValueError if the wps server returned an exception report
+    """
+
+    if not text.find('ExceptionReport') > 0:
+
+        execution_dict = {
+                'job_id':text.split('executionId=')[1].split('&')[0],
+                'layer_name':config_wpsprocess['xml_config']['template_layer_name'],
+                'timestamp_job_start':datetime.utcnow(),
+                'continue_process':True,
+                }
+
+        if request_config.get('cache') is not None:
+            cache = request_config['cache']
+            execution_dict.update({
+                'cache_key':result_cache_key(request_config, config_wpsprocess),
+                'cache_status':'MISS',
+                'cache_hits':cache.hits,
+                'cache_misses':cache.misses,
+                })
+
+        if request_config.get('journal') is not None:
+            execution_dict.update({'job_key':job_key(config_wpsprocess), 'job_status':'SUBMITTED'})
+            record_state(request_config, execution_dict)
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: WPS JOB SUBMITTED')
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: WPS STATUS CHECK URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) : ' + request_config['wps_server'] + '?SERVICE=WPS&VERSION=1.0.0&REQUEST=GETEXECUTIONSTATUS&EXECUTIONID=' + execution_dict['job_id'] + '&access_token=' + request_config['access_token'])
         
-        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: PROCESS DOWNLOAD END')
+        return execution_dict
+    else:
+        raise ValueError('wps server returned an exception', str(text))
+
+def poll_api_status(execution_dict, request_config, path_output, download=True):
+    """
+    for each execution job, return the status of the job
+
+    if download is False a succeeded job is left as READY-TO-DOWNLOAD with
+    continue_process still True, so the caller can schedule the download itself
+    """
+
+    try:
+
+        if execution_dict['continue_process']:
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: CHECKING STATUS')
+
+            params = {
+                'access_token':request_config['access_token'],
+                'SERVICE':'WPS',
+                'VERSION':'1.0.0',
+                'REQUEST':'GetExecutionstatus',
+                'EXECUTIONID':execution_dict['job_id'],
+                }
+
+            response = _http(request_config).get(
+                request_config['wps_server'],
+                params=params,
+                headers=request_config['headers'],
+                verify=request_config['verify']
+                )
+
+            # parse xml to python dictionary 
+            d = xmltodict.parse(response.content)
+
+            execution_dict = parse_execution_status(d, execution_dict, request_config)
+
+            # if successful, return status = DOWNLOADED
+            if download and execution_dict.get('job_status') == 'READY-TO-DOWNLOAD':
+                execution_dict = download_wps_result(request_config, execution_dict, path_output)
+
+        return execution_dict
+
+    except Exception as error:
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: UNKNOWN EXCEPTION')
+
+        execution_dict.update({
+            'job_status':'UNKNOWN-GENERAL-ERROR',
+            'continue_process':False,
+            'message':'UNKNOWN GENERAL ERROR ENCOUNTERED WHEN CHECKING STATUS OF WPS JOB. ERROR MESSAGE:' + str(error),
+            'timestamp_job_end':datetime.utcnow(),
+            })
+        record_state(request_config, execution_dict)
+        return execution_dict
+
+def parse_execution_status(d, execution_dict, request_config):
+    """
+    update the execution dict from a GetExecutionStatus response parsed with xmltodict
+    """
+
+    if 'wps:ExecuteResponse' in d:
+
+        if 'wps:ProcessSucceeded' in d['wps:ExecuteResponse']['wps:Status']:
+
+            execution_dict.update({
+                'job_status':'READY-TO-DOWNLOAD',
+                'dl_url':d['wps:ExecuteResponse']['wps:ProcessOutputs']['wps:Output']['wps:Reference']['@href'] + '&access_token=' + request_config['access_token'],
+                'mime_type':d['wps:ExecuteResponse']['wps:ProcessOutputs']['wps:Output']['wps:Reference']['@mimeType'],
+                'timestamp_ready_to_dl':datetime.utcnow(),
+                })
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: READY FOR DOWNLOAD')
+
+        elif 'wps:ProcessFailed' in d['wps:ExecuteResponse']['wps:Status']:
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: JOB-FAILED ... check LOG for further details')
+
+            # TODO: add exception message. Needs testing
+            execution_dict.update({
+                'job_status':'WPS-FAILURE',
+                'continue_process':False,
+                'message':'GEOSERVER FAILURE REPORT',
+                'timestamp_job_end':datetime.utcnow(),
+                })
+        else:
+            execution_dict.update({'job_status':'OUTSTANDING'})
+
+            # record progress reported by the server, used by the polling strategy
+            if 'wps:ProcessStarted' in d['wps:ExecuteResponse']['wps:Status']:
+
+                process_started = d['wps:ExecuteResponse']['wps:Status']['wps:ProcessStarted']
+
+                if isinstance(process_started, dict) and '@percentCompleted' in process_started:
+                    execution_dict['percent_completed'] = float(process_started['@percentCompleted'])
+
+                if 'timestamp_process_started' not in execution_dict:
+                    execution_dict['timestamp_process_started'] = parse_wps_time(d['wps:ExecuteResponse']['wps:Status'].get('@creationTime'))
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STILL IN PROGRESS')
+
+    elif 'ows:ExceptionReport' in d:
+
+        exception_text = d['ows:ExceptionReport']['ows:Exception']['ows:ExceptionText']
+
+        execution_dict.update({
+            'job_status':'WPS-GENERAL-ERROR',
+            'continue_process':False,
+            'message':'THIS IS A GENERAL ERROR WITH A WPS JOB. ERROR MESSAGE = ' + str(exception_text),
+            'timestamp_job_end':datetime.utcnow(),
+            })
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: JOB-FAILED ... check LOG for further details')
+
+    record_state(request_config, execution_dict)
+
+    return execution_dict
+
+def parse_wps_time(value):
+    """
+    naive UTC datetime of an xs:dateTime attribute such as wps:Status/@creationTime,
+    or the current time if the attribute is missing or cannot be parsed
+    """
+
+    try:
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return datetime.utcnow()
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return timestamp
+
+def make_download_path(execution_dict, path_output):
+    """
+    create the per-layer download directory and return the file extension,
+    filename stub and local file name for a wps result
+    """
+
+    file_extension = '.' + execution_dict['mime_type'].split('/')[1]
+    filename_stub = execution_dict['layer_name'].split(':')[-1]
+    dl_path = path_output / filename_stub
+    dl_path.mkdir(parents=True, exist_ok=True)
+    local_file_name = Path(dl_path / str( filename_stub + file_extension))
+
+    return file_extension, filename_stub, local_file_name
+
+def download_wps_result(request_config, execution_dict, path_output):
+    """
+    download a wps result with the method selected by "segmented_download" in the request config
+    """
+
+    if request_config.get('segmented_download'):
+        return download_wps_result_segmented(request_config, execution_dict, path_output)
+
+    return download_wps_result_single(request_config, execution_dict, path_output)
+
+def download_wps_result_single(request_config, execution_dict, path_output):
+    """
+    function to get a wps result if the response is SUCCEEDED AND download is set to True in the config
+
+    the result is streamed to a ".part" file that is renamed once complete. a ".part" left
+    on disk before the first attempt may belong to another job with the same layer name,
+    so it is discarded. a failed attempt is retried from the bytes already on disk with an
+    HTTP Range request, guarded by If-Range on the first response's ETag / Last-Modified,
+    falling back to a full restart if the server ignores the Range header. the number of
+    attempts and the exponential backoff between them are set by "download_retries"
+    (default 3) and "download_backoff" (seconds, default 5) in the request config
+    """
+    
+    file_extension, filename_stub, local_file_name = make_download_path(execution_dict, path_output)
+    part_file = local_file_name.with_name(local_file_name.name + '.part')
+    retries = request_config.get('download_retries', 3)
+    validator = None
+
+    for i in range(1, retries + 1):
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD START : TRY ' + str(i) + ' of ' + str(retries))
+        
+        try:
+
+            if i == 1 and part_file.exists():
+                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DISCARDING PARTIAL DOWNLOAD LEFT BY AN EARLIER RUN')
+                part_file.unlink()
+
+            headers, offset = make_range_headers(request_config, part_file, execution_dict, validator)
+
+            with _http(request_config).get(
+                execution_dict['dl_url'],
+                headers=headers,
+                verify=request_config['verify'],
+                stream=True) as response:
+
+                if offset and response.status_code == 416:
+
+                    # the part file is complete only if it holds all N bytes of "Content-Range: bytes */N"
+                    total_size = parse_content_range(response.headers.get('Content-Range'))[2]
+                    if total_size != offset:
+                        part_file.unlink()
+                        raise ValueError('range not satisfiable for ' + str(offset) + ' bytes on disk, result is ' + str(total_size) + ' bytes, restarting download')
+
+                else:
+
+                    if offset and response.status_code == 206 and parse_content_range(response.headers.get('Content-Range'))[0] != offset:
+                        part_file.unlink()
+                        raise ValueError('range response does not start at byte ' + str(offset) + ', restarting download')
+
+                    if offset and response.status_code != 206:
+                        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: SERVER IGNORED RANGE REQUEST, RESTARTING DOWNLOAD')
+                        offset = 0
+
+                    response.raise_for_status()
+
+                    if not offset:
+                        validator = range_validator(response)
+
+                    with open(part_file, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=8192*1024):
+                            f.write(chunk)
+
+            os.replace(part_file, local_file_name)
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD COMPLETE ON TRY ' + str(i))
+
+            execution_dict.update({
+                'job_status':'DOWNLOAD-SUCCESSFUL',
+                'continue_process':False,
+                'dl_file':local_file_name,
+                'file_extension':file_extension,
+                'filename_stub':filename_stub,
+                'timestamp_dl_end':datetime.utcnow(),
+                'timestamp_job_end':datetime.utcnow(),
+                'download_try':i
+                })
+
+            record_state(request_config, execution_dict)
+
+            return execution_dict
+
+        except Exception as error:
+
+            if i == retries:
+
+                execution_dict.update({
+                    'job_status':'DOWNLOAD-FAILED',
+                    'continue_process':False,
+                    'message':str(error),
+                    'timestamp_job_end':datetime.utcnow(),
+                    'download_try': i,
+                    })
+
+                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STATUS : ' + execution_dict['job_status'] + ' :: MESSAGE :' + execution_dict['message'])
+
+                record_state(request_config, execution_dict)
+
+                return execution_dict
+
+            time.sleep(download_backoff(request_config, i))
+
+def make_range_headers(request_config, part_file, execution_dict, validator=None):
+    """
+    return the request headers for a download attempt and the byte offset it resumes
+    from, adding a Range header if a partial download is already on disk, and an
+    If-Range header if the validator of the response it came from is known
+    """
+
+    offset = part_file.stat().st_size if part_file.exists() else 0
+
+    if offset == 0:
+        return request_config['headers'], 0
+
+    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: RESUMING DOWNLOAD FROM BYTE ' + str(offset))
+
+    headers = dict(request_config['headers'])
+    headers['Range'] = 'bytes=' + str(offset) + '-'
+
+    if validator:
+        headers['If-Range'] = validator
+
+    return headers, offset
+
+def range_validator(response):
+    """
+    the strong ETag, or else the Last-Modified date, of a download response for an
+    If-Range header. None if it has neither
+    """
+
+    etag = response.headers.get('ETag')
+
+    if isinstance(etag, str) and etag and not etag.startswith('W/'):
+        return etag
+
+    last_modified = response.headers.get('Last-Modified')
+
+    return last_modified if isinstance(last_modified, str) and last_modified else None
+
+CONTENT_RANGE_PATTERN = re.compile(r'^\s*bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)\s*$')
+
+def parse_content_range(value):
+    """
+    return the (start, end, total) byte positions of a Content-Range header, each
+    None if absent, e.g. "bytes 0-99/1000" or "bytes */1000"
+    """
+
+    match = CONTENT_RANGE_PATTERN.match(value) if isinstance(value, str) else None
+
+    if match is None:
+        return None, None, None
+
+    return tuple(int(group) if group is not None and group.isdigit() else None for group in match.groups())
+
+def download_backoff(request_config, attempt):
+    """
+    seconds to wait after a failed download attempt, doubling with each attempt
+    """
+
+    return request_config.get('download_backoff', 5) * 2 ** (attempt - 1)
+
+def download_wps_result_segmented(request_config, execution_dict, path_output):
+    """
+    function to get a large wps result as concurrent HTTP Range requests
+
+    the size is read from a one byte Range probe. the ".part" file is preallocated
+    and each segment is written at its own offset by a worker thread. a failed segment
+    is retried from the bytes it already wrote, without touching the other segments.
+    the segment count is Content-Length / "min_segment_size", capped at "max_segments".
+    if the server does not support ranges, or the result is smaller than two segments,
+    this falls back to download_wps_result_single()
+    """
+
+    max_segments = request_config.get('max_segments', 8)
+    min_segment_size = request_config.get('min_segment_size', 64 * 1024 * 1024)
+
+    try:
+        total_size = probe_range_support(request_config, execution_dict['dl_url'])
+    except Exception:
+        total_size = None
+
+    if total_size is None or total_size < 2 * min_segment_size:
+        return download_wps_result_single(request_config, execution_dict, path_output)
+
+    file_extension, filename_stub, local_file_name = make_download_path(execution_dict, path_output)
+    part_file = local_file_name.with_name(local_file_name.name + '.part')
+
+    n_segments = min(max_segments, -(-total_size // min_segment_size))
+    segment_size = -(-total_size // n_segments)
+    segments = [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+
+    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: SEGMENTED DOWNLOAD START : ' + str(total_size) + ' BYTES IN ' + str(len(segments)) + ' SEGMENTS')
+
+    # preallocate so every segment can write at its offset
+    with open(part_file, 'wb') as f:
+        f.truncate(total_size)
+
+    # set on the first failed segment so the others stop early
+    abort = threading.Event()
+
+    try:
+
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            futures = [pool.submit(download_segment, request_config, execution_dict, part_file, start, end, abort) for start, end in segments]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                abort.set()
+                for future in pending:
+                    future.cancel()
+                raise failed[0].exception()
+
+        os.replace(part_file, local_file_name)
+
+    except Exception as error:
+
+        # the zero filled preallocation must not be mistaken for a partial download later
+        part_file.unlink(missing_ok=True)
+
+        execution_dict.update({
+            'job_status':'DOWNLOAD-FAILED',
+            'continue_process':False,
+            'message':str(error),
+            'timestamp_job_end':datetime.utcnow(),
+            'download_segments':len(segments),
+            })
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STATUS : ' + execution_dict['job_status'] + ' :: MESSAGE :' + execution_dict['message'])
+
+        record_state(request_config, execution_dict)
+
+        return execution_dict
+
+    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: SEGMENTED DOWNLOAD COMPLETE')
+
+    execution_dict.update({
+        'job_status':'DOWNLOAD-SUCCESSFUL',
+        'continue_process':False,
+        'dl_file':local_file_name,
+        'file_extension':file_extension,
+        'filename_stub':filename_stub,
+        'timestamp_dl_end':datetime.utcnow(),
+        'timestamp_job_end':datetime.utcnow(),
+        'download_try':1,
+        'download_segments':len(segments),
+        })
+
+    record_state(request_config, execution_dict)
+
+    return execution_dict
+
+def probe_range_support(request_config, dl_url):
+    """
+    request the first byte of a download, returning the total size in bytes if
+    the server answers with a Content-Range, otherwise None
+    """
+
+    headers = dict(request_config['headers'])
+    headers['Range'] = 'bytes=0-0'
+
+    with _http(request_config).get(dl_url, headers=headers, verify=request_config['verify'], stream=True) as response:
+
+        if response.status_code != 206 or '/' not in response.headers.get('Content-Range', ''):
+            return None
+
+        total_size = response.headers['Content-Range'].split('/')[-1]
+
+    return int(total_size) if total_size.isdigit() else None
+
+def download_segment(request_config, execution_dict, part_file, start, end, abort=None):
+    """
+    write bytes start to end (inclusive) of a download into part_file at their offset,
+    retrying from the last byte written. every response must be a 206 whose
+    Content-Range starts at the requested byte. stops once the abort event is set
+    """
+
+    retries = request_config.get('download_retries', 3)
+    position = start
+
+    with open(part_file, 'r+b') as f:
+
+        for i in range(1, retries + 1):
+
+            try:
+
+                if abort is not None and abort.is_set():
+                    raise ValueError('segment ' + str(start) + '-' + str(end) + ' aborted after another segment failed')
+
+                headers = dict(request_config['headers'])
+                headers['Range'] = 'bytes=' + str(position) + '-' + str(end)
+
+                with _http(request_config).get(execution_dict['dl_url'], headers=headers, verify=request_config['verify'], stream=True) as response:
+
+                    if response.status_code != 206:
+                        raise ValueError('segment request for bytes ' + str(position) + '-' + str(end) + ' returned status ' + str(response.status_code))
+
+                    if parse_content_range(response.headers.get('Content-Range'))[0] != position:
+                        raise ValueError('segment request for bytes ' + str(position) + '-' + str(end) + ' returned Content-Range ' + str(response.headers.get('Content-Range')))
+
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=1024*1024):
+                        if abort is not None and abort.is_set():
+                            raise ValueError('segment ' + str(start) + '-' + str(end) + ' aborted after another segment failed')
+                        # never write past the segment, into the next one
+                        chunk = chunk[:end + 1 - position]
+                        f.write(chunk)
+                        position += len(chunk)
+
+                if position != end + 1:
+                    raise ValueError('segment ' + str(start) + '-' + str(end) + ' ended early at byte ' + str(position))
+
+                return
+
+            except Exception as error:
+
+                if i == retries or (abort is not None and abort.is_set()):
+                    raise
+
+                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: SEGMENT ' + str(start) + '-' + str(end) + ' RETRY ' + str(i) + ' :: ' + str(error))
+
+                time.sleep(download_backoff(request_config, i))
+
+def process_wps_downloaded_files(execution_dict):
+    """
+    function to rename downloaded file if TIFF or extract from zip 
+    """
+    
+    try:
+
+        source_file_to_extract = execution_dict['dl_file']
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: PROCESS DOWNLOAD START')
+
+        # extract zip contents straight to their final names
+        if source_file_to_extract.suffix.lower() == '.zip':
+
+            extract_wps_zip(source_file_to_extract, source_file_to_extract.parent.parent, execution_dict['filename_stub'])
+            source_file_to_extract.unlink()
+
+        else:
+            Path(source_file_to_extract).rename(source_file_to_extract.parent.parent / str(execution_dict['filename_stub'] + source_file_to_extract.suffix.lower()))
+
+        # del download directory
+        if source_file_to_extract.parent.is_dir():
+            source_file_to_extract.parent.rmdir()
+
+        execution_dict.update({
+            'job_status':'LOCAL-POST-PROCESSING-SUCCESSFUL',
+            'timestamp_extraction_end':datetime.utcnow(),
+            'timestamp_job_end':datetime.utcnow(),
+        })
+        
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: PROCESS DOWNLOAD END')
+
+        return execution_dict
+
+    except Exception as error:
+
+        execution_dict.update({
+            'message':'ERROR in extraction of files :: MESSAGE = ' + str(error)
+        })
+
+        return execution_dict
+
+def extract_wps_zip(zip_file, path_output, filename_stub):
+    """
+    stream each member of a wps result zip directly to path_output / filename_stub + suffix,
+    skipping .sld members and directory entries without writing them
+    """
+
+    extracted = []
+
+    with ZipFile(zip_file, 'r') as zip_ref:
+
+        for member in zip_ref.infolist():
+
+            suffix = Path(member.filename).suffix.lower()
+
+            if member.is_dir() or suffix == '.sld':
+                continue
+
+            final_path = Path(path_output / str(filename_stub + suffix))
+
+            with zip_ref.open(member) as source, open(final_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 8192*1024)
+
+            extracted.append(final_path)
+
+    return extracted
+
+def output_log(list_of_results):
+
+    df = pd.DataFrame(list_of_results)
+    log_file_name = list_of_results[0]['log_file_path']
+    df.to_csv(log_file_name, index_label='num')
+    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: JOB FINISHED. LOG FILE LOCATION : ' + str(log_file_name))
+
+def make_output_dir(path_output):
+    """
+    generate output directory if it does not exist
+    """
+
+    if isinstance(path_output, Path) == False:
+        path_output = Path(path_output)
+
+    path_output.mkdir(parents=True, exist_ok=True)
+
+    return path_output
+
+SAFE_GRANULE_ORBIT_LIST = Path(os.path.dirname(os.path.realpath(__file__))) / 'static' / 'safe-granule-orbit-list.txt'
+
+# safe granule-orbit refs, read once by load_safe_granule_orbits()
+_safe_granule_orbits = None
+
+def load_safe_granule_orbits(refresh=False):
+    """
+    return the 'safe' granule-orbit refs of static/safe-granule-orbit-list.txt as a
+    pandas Index, read from disk on the first call only. refresh=True re-reads the file
+    """
+
+    global _safe_granule_orbits
+
+    if _safe_granule_orbits is None or refresh:
+
+        if Path(SAFE_GRANULE_ORBIT_LIST).exists():
+            df_safe_list = pd.read_csv(SAFE_GRANULE_ORBIT_LIST)
+        else:
+            raise ValueError('ERROR :: safe-granule-orbit-list.txt cannot be found')
+
+        _safe_granule_orbits = pd.Index(df_safe_list['gran-orb'].astype(str).unique())
+
+    return _safe_granule_orbits
+
+def resolve_split_pairs(df):
+    """
+    pair each half of a SPLIT sentinel-2 granule with its counterpart
+
+    adds "split_ARCSI_CLOUD_COVER", the cloud cover of the layer named by
+    "split_granule.name", found with one lookup on "alternate", and "split_cloud_cover",
+    the average cloud of the pair or the layer's own cloud when it is not split. both
+    stay float. takes a query_catalog(sat_id=2) DataFrame, the sentinel-2 columns are
+    added first if missing
+
+    Parameters:
+    -----------
+        df: DataFrame,
+            query results with "alternate" and "ARCSI_CLOUD_COVER" or the fields
+            add_s2_columns() parses it from
+
+    Returns:
+    -----------
+        df: DataFrame,
+            df with the two split cloud columns
+    """
+
+    if 'ARCSI_CLOUD_COVER' not in df.columns:
+        df = add_s2_columns(df)
+
+    cloud = pd.to_numeric(df['ARCSI_CLOUD_COVER'], errors='coerce')
+
+    if 'split_granule.name' not in df.columns:
+        df['split_cloud_cover'] = cloud
+        return df
+
+    is_split = df['split_granule.name'].notna().to_numpy()
+
+    # cloud cover of every split half by layer name, a name listed twice keeps its first row
+    halves = pd.Series(cloud.to_numpy()[is_split], index=df['alternate'].to_numpy()[is_split])
+    halves = halves[~halves.index.duplicated()]
+
+    df['split_ARCSI_CLOUD_COVER'] = df['split_granule.name'].map(halves).astype(float)
+
+    # average cloud of the split granule pair, own cloud otherwise
+    df['split_cloud_cover'] = cloud.where(~is_split, (cloud + df['split_ARCSI_CLOUD_COVER'])/2)
+
+    return df
+
+NO_SAFE_GRANULE_ERROR = 'ERROR : You have selected find_least_cloud=True BUT your search criteria is too narrow, spatially or temporally and did not match any granule references in "./static/safe-granule-orbit-list.txt". Suggest widening your search'
+
+def safe_granule_candidates(df):
+    """
+    add the title_stub, gran-orb and granule-stub columns to df and return the rows
+    that are not SPLIT halves and whose granule-orbit is in the safe list
+    """
+
+    granule_stub = df['granule-ref'].astype(str).str[:6]
+
+    df['title_stub'] = df['title'].str.replace('_T.*', '', regex=True) + '_' + granule_stub
+
+    # create new col that matches the granule-orbit syntax
+    df['gran-orb'] = granule_stub + '_' + df['orbit-ref'].astype(str)
+    df['granule-stub'] = granule_stub
+
+    no_split = ~df['title'].str.contains("SPLIT")
+
+    return df[no_split & df['gran-orb'].isin(load_safe_granule_orbits())].reset_index(drop=True)
+
+def find_minimum_cloud_list(df):
+    """
+    eods query "special" keyword function
+    + cross checks the dataframe with a static csv file of 'safe' granule list
+    + then groups by the unique granule-reference
+    + takes the lowest cloud value per granule
+    + returns a new dataframe
+    """
+    
+    safe_df = safe_granule_candidates(df)
+
+    if len(safe_df) > 0:
+        # first row of least cloud per granule-stub, a layer without cloud cover only when its granule has no other
+        cloud = pd.to_numeric(safe_df['split_cloud_cover'], errors='coerce').fillna(np.inf)
+        least_cloud = cloud.groupby(safe_df['granule-stub'].to_numpy(), sort=True).idxmin()
+        return_df = safe_df.loc[least_cloud.to_numpy()]
+
+        if 'split_granule.name' in df.columns:
+            matching_split_series = return_df[return_df['split_granule.name'].notna()]['split_granule.name']
+            matching_split_df = df[df['alternate'].isin(matching_split_series)]
+
+            return_df = pd.concat([return_df, matching_split_df], ignore_index=True)
+        else:
+            return_df = return_df.reset_index(drop=True)
+        
+    else:
+        raise ValueError(NO_SAFE_GRANULE_ERROR)
+
+    return return_df  
+
+
+def find_least_cloud_k(df, k, by=['granule-stub'], window=None):
+    """
+    the k least cloud layers per granule, and per time window if given, e.g. to build
+    cloud free composites from several scenes of each granule
+
+    candidates are chosen as for find_minimum_cloud_list(): no SPLIT halves and only
+    safe list granule-orbits, ranked on split_cloud_cover so a split granule counts
+    the average of its pair. the SPLIT counterparts of chosen layers are appended with
+    the same rank. one stable sort and a grouped count, no python loop over groups
+
+    Parameters:
+    -----------
+        df: DataFrame,
+            query_catalog(sat_id=2) results
+
+        k: int,
+            number of layers kept per group
+
+        by: list, optional:
+            columns grouping the layers
+            Default Value:
+                * ['granule-stub']
+
+        window: str, optional:
+            pandas frequency binning "acquisition_date" into time windows, fixed
+            frequencies (e.g. '10D') are floored, calendar ones (e.g. 'M', 'Q') are
+            periods. the bin start is in a "time_bin" column
+            Default Value:
+                * None (no time windows)
+
+    Returns:
+    -----------
+        return_df: DataFrame,
+            the chosen layers ordered by group then cloud, with a 1 based "cloud_rank"
+    """
+
+    if k < 1:
+        raise ValueError('ERROR. k must be at least 1, aborting ...')
+
+    if 'ARCSI_CLOUD_COVER' not in df.columns:
+        df = add_s2_columns(df)
+
+    if 'split_cloud_cover' not in df.columns:
+        df = resolve_split_pairs(df)
+
+    safe_df = safe_granule_candidates(df)
+
+    if len(safe_df) == 0:
+        raise ValueError(NO_SAFE_GRANULE_ERROR)
+
+    keys = list(by)
+
+    if window is not None:
+        dates = pd.to_datetime(safe_df['acquisition_date'])
+        try:
+            safe_df['time_bin'] = dates.dt.floor(window)
+        except ValueError:
+            safe_df['time_bin'] = dates.dt.to_period(window).dt.start_time
+        keys.append('time_bin')
+
+    safe_df['_cloud'] = pd.to_numeric(safe_df['split_cloud_cover'], errors='coerce')
+    safe_df = safe_df.sort_values(keys + ['_cloud'], kind='stable', na_position='last')
+    safe_df['cloud_rank'] = safe_df.groupby(keys, sort=False, dropna=False).cumcount() + 1
+
+    return_df = safe_df[safe_df['cloud_rank'] <= k].drop(columns='_cloud')
+
+    if 'split_granule.name' in df.columns:
+        picked = return_df[return_df['split_granule.name'].notna()].drop_duplicates('split_granule.name')
+        matching_split_df = df[df['alternate'].isin(picked['split_granule.name'])].copy()
+
+        # a counterpart takes the rank and time window of the half that chose it
+        partner = picked.set_index('split_granule.name')
+        for column in ['cloud_rank'] + (['time_bin'] if window is not None else []):
+            matching_split_df[column] = matching_split_df['alternate'].map(partner[column])
+
+        return_df = pd.concat([return_df, matching_split_df], ignore_index=True)
+    else:
+        return_df = return_df.reset_index(drop=True)
+
+    return return_df
+
+def query_catalog(conn, **kwargs):
+    """Transform vectors from source to target coordinate reference system.
+    Transform vectors of x, y and optionally z from source
+    coordinate reference system into target.
+
+    Parameters
+    ------------
+    conn: dict
+        connection dictionary 
+        Example: conn = {
+            'domain': 'https://earthobs.defra.gov.uk',
+            'username': '<insert-username>',
+            'access_token': '<insert-access-token>',
+            }}
+    start_date: str, optional
+        filter start date in format YYYY-MM-DD
+    end_date: str, optional
+        filter start end in format YYYY-MM-DD
+    sat_id: int, optional
+        filter for either sentinel-1 and sentinel-2
+        Possible values:
+            * 1
+            * 2        
+    type: str, optional,
+        filter on data type, user can override default
+        Default value:
+            * 'layer'        
+        Possible values:
+            * 'raster'
+            * 'vector'
+    title: str, optional,
+        filter on match or partial match of the layer name/title
+    updated_since: str, optional,
+        filter on records modified on or after this ISO date/time, sent as
+        "last_updated__gte"
+    cloud_min: int, optional,
+        filter on minima cloud value for s2 data, must be used
+        with cloud_max keyword
+        Possible values:
+            * 0 to 100
+    cloud_max: int, optional,
+        filter on minima cloud value for s2 data, must be used
+        with cloud_min keyword
+        Possible values:
+            * 0 to 100
+    geom: str, optional,
+        filter layers that intersect with Well Know Text WGS84 geometry
+        Example:
+            geom = 'Polygon((-2.4 51.9, -2.4 51.6, -1.9 51.6, -1.9 51.9, -2.4 51.9))'
+    limit: int, optional:
+        limit the number of records returned by query. As of 2020-09-11 there
+        are ~ 10,500 records on EODS
+        Default Value:
+            * 20000
+        Possible values:
+            * 0 to n 
+    find_least_cloud: bool, optional:
+        custom filter to generate a list of least cloud per granule
+    verify: str, optional:
+        add custom path to any organisation certificate stores that the
+        environment needs
+        Default Value:
+            * True
+        Possible Value:
+            * 'dir/dir/cert.file'
+    output_dir: str or pathlib object, optional:
+        user can specify custom output directory for data
+        Default Value:
+            * Path.cwd() the current working path.
+        Possible Value:
+            * 'some/dir/'
+            * Path('some/dir')
+    session: requests.Session, optional:
+        keep-alive session used for the search request, see make_session()
+        Default Value:
+            * the shared session returned by get_default_session()
+    cache: QueryCache or str or pathlib object, optional:
+        response cache (or its directory) shared by repeat queries. a query with the
+        same search parameters is answered from disk until the cache ttl expires
+        Default Value:
+            * None
+    fields: list, optional:
+        only keep these record fields (dotted names for nested fields, eg
+        'split_granule.name') plus 'alternate' and the columns derived for sat_id=2
+        and find_least_cloud. fields the derived columns are parsed from are read
+        and then dropped if not requested
+        Default Value:
+            * None, every field returned by the api
+    compact: bool, optional:
+        shrink the returned DataFrame: integer columns are downcast, float columns
+        are downcast where float32 holds them exactly, repeated strings become
+        categoricals and bulky text (COMPACT_DROP_FIELDS) is dropped once the
+        sentinel-2 values have been extracted
+        Default Value:
+            * False
+    stream: bool, optional:
+        decode the response incrementally from the connection, keeping only the
+        needed fields of each record in column lists, instead of holding the body,
+        the decoded json and the DataFrame at once. pairs with "fields"
+        Default Value:
+            * False
+    output_format: str, optional:
+        format of the "eods-query-all-results" file written to output_dir. parquet and
+        feather keep dtypes, geoparquet also stores csw_wkt_geometry as a WKB
+        "geometry" column, see read_query_results(). all but csv need pyarrow
+        Default Value:
+            * 'csv'
+        Possible values:
+            * 'csv'
+            * 'parquet'
+            * 'geoparquet'
+            * 'feather'
+    page_size: int, optional:
+        records requested per page. the first page gives meta.total_count, and the
+        remaining pages up to "limit" are fetched concurrently, then joined in order
+        Default Value:
+            * 1000
+    max_workers: int, optional:
+        maximum number of pages fetched at once
+        Default Value:
+            * 4
+    source: str, optional:
+        where the query is answered. 'local' evaluates the same filters against
+        the catalog mirror kept up to date by sync_catalog(), without a request
+        Default Value:
+            * 'remote'
+        Possible values:
+            * 'remote'
+            * 'local'
+    catalog_path: str or pathlib object, optional:
+        sqlite file of the local catalog mirror, used with source='local'
+        Default Value:
+            * CATALOG_PATH
+
+    Returns
+    ---------
+    list_of_layers: list,
+        List of layer names that match the EODS input query
+    
+    df: Pandas DataFrame,
+        DataFrame table of results containing all metadata of query results
+    """
+
+    if 'session' not in kwargs:
+        kwargs['session'] = get_default_session()
+
+    if 'verify' not in kwargs:
+        kwargs['verify'] = kwargs['session'].verify
+
+    params = build_query_params(conn, kwargs)
+
+    if 'source' not in kwargs:
+        kwargs['source'] = 'remote'
+
+    if kwargs['source'] == 'local':
+        return query_local_catalog(params, kwargs)
+    elif kwargs['source'] != 'remote':
+        raise ValueError("ERROR. source must be 'remote' or 'local', aborting ...")
+
+    cache, cache_key, df = query_cache_lookup(conn, params, kwargs)
+    if df is not None:
+        return process_query_frame(df, kwargs)
+
+    # request the first page only, the rest are fetched once total_count is known
+    limit = params['limit']
+    params['limit'] = min(kwargs.get('page_size', 1000), limit)
+
+    if 'stream' not in kwargs:
+        kwargs['stream'] = False
+
+    try:
+        response = kwargs['session'].get(
+            conn['domain'] + '/api/base/search',
+            params=params,
+            verify=kwargs['verify'],
+            headers={'User-Agent': 'python'},
+            stream=kwargs['stream']
+        )
+
+        if response.status_code == 200:
+
+            print(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = 200 (SUCCESS)')
+            print(datetime.utcnow().isoformat() + ' :: QUERY URL USED (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
+            
+            # create a json object of the api payload content
+            json_response = decode_search_page(response, kwargs)
+            json_response = fetch_remaining_pages(conn, params, limit, json_response, kwargs)
+            df = query_response_frame(json_response, kwargs)
+
+            if cache is not None and df is not None:
+                cache.put(cache_key, df)
+
+            return process_query_frame(df, kwargs)
+
+        else:
+            raise ValueError(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = ' + str(response.status_code) + ' (NOT SUCCESSFUL)' + str(response.status_code) + ' :: QUERY URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
+
+    except requests.exceptions.RequestException as e:
+        print('\n' + datetime.utcnow().isoformat() + ' :: ERROR, an Exception was raised, no list returned')
+        print(e)
+        return None
+    
+class QueryCache():
+    """
+    on-disk cache of query_catalog results, keyed on the search parameters without the
+    credentials, so repeat queries skip the request and the json decoding
+
+    each entry is a json file of the normalised DataFrame's columns, their dtypes and the
+    time it was fetched, so reading an entry written by another user cannot run code.
+    entries older than ttl are ignored and removed, and the least recently used are
+    evicted once the cache grows past max_bytes. writes and evictions hold a lock file,
+    so several processes can share one cache directory
+
+    Parameters:
+    -----------
+        path: str or Pathlib object,
+            cache directory, created if it does not exist
+
+        ttl: int or float, optional,
+            seconds a cached response is used for
+            Default Value:
+                * 3600
+
+        max_bytes: int, optional,
+            size limit of the cache files
+            Default Value:
+                * None (unlimited)
+    """
+
+    def __init__(self, path, ttl=3600, max_bytes=None):
+
+        self.path = make_output_dir(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        return the cached DataFrame for key, or None on a miss
+        """
+
+        entry_file = self.path / (key + '.json')
+
+        with file_lock(self.path / '.lock'):
+
+            try:
+                with open(entry_file, 'r') as f:
+                    entry = json.load(f)
+                fetched = entry['fetched']
+                df = pd.DataFrame(entry['data'], columns=entry['columns']).astype(entry['dtypes'])
+            except (OSError, ValueError, KeyError, TypeError):
+                self.misses += 1
+                return None
+
+            if time.time() - fetched > self.ttl:
+                entry_file.unlink()
+                self.misses += 1
+                return None
+
+            # the modification time tracks the last use for eviction
+            os.utime(entry_file)
+
+        self.hits += 1
+
+        return df
+
+    def put(self, key, df):
+        """
+        write the DataFrame for key, then evict least recently used entries beyond max_bytes
+        """
+
+        entry_file = self.path / (key + '.json')
+        part_file = self.path / (key + '.json.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.part')
+
+        entry = {
+            'fetched':time.time(),
+            'columns':[str(c) for c in df.columns],
+            'dtypes':{str(c):str(dtype) for c, dtype in df.dtypes.items()},
+            'data':{str(c):values for c, values in df.to_dict(orient='list').items()},
+            }
+
+        with open(part_file, 'w') as f:
+            json.dump(entry, f, default=query_cache_value)
+
+        with file_lock(self.path / '.lock'):
+
+            os.replace(part_file, entry_file)
+
+            if self.max_bytes is not None:
+                entries = sorted(self.path.glob('*.json'), key=lambda p: p.stat().st_mtime)
+                total = sum(p.stat().st_size for p in entries)
+                for old_file in entries:
+                    if total <= self.max_bytes:
+                        break
+                    total -= old_file.stat().st_size
+                    old_file.unlink()
+
+def query_cache_value(value):
+    """
+    json encoding of the numpy and pandas values in a DataFrame written by QueryCache
+    """
+
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+
+    if hasattr(value, 'item'):
+        return value.item()
+
+    raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+@contextmanager
+def file_lock(path):
+    """
+    exclusive lock on path shared between processes, flock on posix and msvcrt on windows
+    """
+
+    with open(path, 'a+b') as f:
+
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def query_cache_key(conn, params):
+    """
+    QueryCache key of a search, a hash of the domain and the search params without
+    the username and api_key
+    """
+
+    key_params = {key:str(value) for key, value in params.items() if key not in ['username', 'api_key']}
+    key_source = json.dumps({'domain':conn['domain'], 'params':key_params}, sort_keys=True)
+
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+def fetch_remaining_pages(conn, params, limit, json_response, kwargs):
+    """
+    fetch the search pages after the first one concurrently, up to the smaller of
+    meta.total_count and limit, and append their objects to json_response in order
+    """
+
+    objects = json_response.get('objects', [])
+    wanted = min(json_response.get('meta', {}).get('total_count', 0), limit)
+
+    # step by the records the server actually returned, in case it caps the page size
+    step = len(objects)
+    offsets = list(range(params['offset'] + step, wanted, step)) if step else []
+
+    if not offsets:
+        return json_response
+
+    def fetch_page(offset):
+
+        page_params = dict(params, offset=offset, limit=min(step, wanted - offset))
+
+        response = kwargs['session'].get(
+            conn['domain'] + '/api/base/search',
+            params=page_params,
+            verify=kwargs['verify'],
+            headers={'User-Agent': 'python'},
+            stream=kwargs.get('stream', False)
+        )
+
+        if response.status_code != 200:
+            raise ValueError(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = ' + str(response.status_code) + ' (NOT SUCCESSFUL) :: QUERY URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
+
+        return decode_search_page(response, kwargs).get('objects', [])
+
+    print(datetime.utcnow().isoformat() + ' :: FETCHING ' + str(len(offsets)) + ' MORE PAGES OF ' + str(step) + ' RECORDS')
+
+    with ThreadPoolExecutor(max_workers=kwargs.get('max_workers', 4)) as pool:
+        for page in pool.map(fetch_page, offsets):
+            objects.extend(page)
+
+    json_response['objects'] = objects
+
+    return json_response
+
+QUERY_OUTPUT_FORMATS = {'csv':'.csv', 'parquet':'.parquet', 'geoparquet':'.geoparquet', 'feather':'.feather'}
+
+def write_query_results(df, path_output, output_format='csv'):
+    """
+    write the query results DataFrame to path_output as eods-query-all-results in
+    output_format, returning the file path
+    """
+
+    if output_format not in QUERY_OUTPUT_FORMATS:
+        raise ValueError('ERROR. output_format must be one of ' + ', '.join(QUERY_OUTPUT_FORMATS) + ', aborting ...')
+
+    log_file_name = path_output / str('eods-query-all-results' + QUERY_OUTPUT_FORMATS[output_format])
+
+    if output_format == 'csv':
+        df.to_csv(log_file_name)
+        return log_file_name
+
+    if pyarrow is None:
+        raise ValueError('ERROR. output_format=' + output_format + ' requires pyarrow, aborting ...')
+
+    if output_format == 'feather':
+        df.reset_index(drop=True).to_feather(log_file_name)
+        return log_file_name
+
+    table = pyarrow.Table.from_pandas(df)
+
+    if output_format == 'geoparquet':
+
+        if 'csw_wkt_geometry' not in df.columns:
+            raise ValueError("ERROR. output_format='geoparquet' needs the csw_wkt_geometry column, aborting ...")
+
+        geometry = [None if wkt is None or wkt != wkt else shapely.wkb.dumps(shapely.wkt.loads(wkt)) for wkt in df['csw_wkt_geometry']]
+        table = table.append_column('geometry', pyarrow.array(geometry, type=pyarrow.binary()))
+
+        # geoparquet 1.0 file metadata, the catalog footprints are WGS84 lon/lat
+        geo = {
+            'version':'1.0.0',
+            'primary_column':'geometry',
+            'columns':{'geometry':{'encoding':'WKB', 'geometry_types':[]}},
+            }
+        table = table.replace_schema_metadata(dict(table.schema.metadata or {}, geo=json.dumps(geo)))
+
+    pyarrow.parquet.write_table(table, log_file_name)
+
+    return log_file_name
+
+def read_query_results(path):
+    """
+    read back a query results file written by query_catalog(..., output_format=...),
+    with the WKB "geometry" column of a geoparquet file decoded to shapely geometries
+    """
+
+    path = Path(path)
+
+    if path.suffix == '.csv':
+        return pd.read_csv(path, index_col=0)
+
+    if pyarrow is None:
+        raise ValueError('ERROR. reading ' + path.suffix + ' query results requires pyarrow, aborting ...')
+
+    if path.suffix == '.feather':
+        return pd.read_feather(path)
+
+    df = pd.read_parquet(path)
+
+    if 'geometry' in df.columns:
+        df['geometry'] = [None if wkb is None else shapely.wkb.loads(bytes(wkb)) for wkb in df['geometry']]
+
+    return df
+
+def decode_search_page(response, kwargs):
+    """
+    decode one /api/base/search response into {'meta': ..., 'objects': ...}, with the
+    objects as a ColumnBuffer when the "stream" kwarg is set
+    """
+
+    if kwargs.get('stream'):
+        return stream_search_response(response, query_input_fields(kwargs))
+
+    return json.loads(response.content)
+
+class ColumnBuffer():
+    """
+    column lists of flattened search records, built one record at a time
+
+    the streaming stand-in for the list of record dicts: nested fields are flattened to
+    dotted names as json_normalize does, and with fields given only those columns (and
+    the children of nested ones) are kept
+    """
+
+    def __init__(self, fields=None):
+
+        self.fields = fields
+        self.columns = {}
+        self.n_rows = 0
+        self._keep = {}
+
+    def __len__(self):
+
+        return self.n_rows
+
+    def keep(self, key):
+
+        if key not in self._keep:
+            self._keep[key] = self.fields is None or key in self.fields or any(key.startswith(f + '.') for f in self.fields)
+
+        return self._keep[key]
+
+    def append(self, record):
+
+        for key, value in flatten_record(record).items():
+
+            if not self.keep(key):
+                continue
+
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [None] * self.n_rows
+            column.append(value)
+
+        self.n_rows += 1
+
+        for column in self.columns.values():
+            if len(column) < self.n_rows:
+                column.append(None)
+
+    def extend(self, other):
+
+        for key in other.columns:
+            if key not in self.columns:
+                self.columns[key] = [None] * self.n_rows
+
+        for key, column in self.columns.items():
+            column.extend(other.columns.get(key, [None] * other.n_rows))
+
+        self.n_rows += other.n_rows
+
+    def to_frame(self):
+
+        return pd.DataFrame(self.columns, index=pd.RangeIndex(self.n_rows))
+
+def flatten_record(record, prefix=''):
+    """
+    flatten nested dicts of a search record into dotted keys, as json_normalize does
+    """
+
+    flat = {}
+
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            flat.update(flatten_record(value, prefix + key + '.'))
+        else:
+            flat[prefix + key] = value
+
+    return flat
+
+def stream_search_response(response, fields=None, chunk_size=1024*1024):
+    """
+    decode a /api/base/search response straight from its byte stream
+
+    the top level object is walked key by key with json.JSONDecoder.raw_decode. records of
+    the "objects" array are decoded one at a time into a ColumnBuffer and dropped, so only
+    a chunk of the body and one record are held besides the kept columns
+
+    Returns:
+    -----------
+        json_response: dict,
+            {'meta': ..., 'objects': ColumnBuffer}, plus any other top level keys
+    """
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = response.iter_content(chunk_size=chunk_size)
+    state = {'buffer':'', 'pos':0}
+
+    def read_more():
+        chunk = next(chunks, None)
+        buffer = state['buffer'][state['pos']:]
+        state['buffer'] = buffer + (text.decode(b'', final=True) if chunk is None else text.decode(chunk))
+        state['pos'] = 0
+        return chunk is not None
+
+    def next_char():
+        # first non whitespace character, '' at the end of the stream
+        while True:
+            buffer, pos = state['buffer'], state['pos']
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                return ''
+
+    def expect(char):
+        if next_char() != char:
+            raise ValueError('ERROR. malformed search response, expected ' + char + ', aborting ...')
+        state['pos'] += 1
+
+    def decode_value():
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buffer'], state['pos'])
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise ValueError('ERROR. search response ended mid record, aborting ...')
+                continue
+            # a number or literal at the very end of the buffer may continue in the next chunk
+            if end == len(state['buffer']) and read_more():
+                continue
+            state['pos'] = end
+            return value
+
+    json_response = {'meta':{}, 'objects':ColumnBuffer(fields)}
+
+    expect('{')
+
+    while next_char() != '}':
+
+        if next_char() == ',':
+            state['pos'] += 1
+
+        key = decode_value()
+        expect(':')
+
+        if key != 'objects':
+            json_response[key] = decode_value()
+            continue
+
+        expect('[')
+        while next_char() != ']':
+            if next_char() == ',':
+                state['pos'] += 1
+            json_response['objects'].append(decode_value())
+        expect(']')
+
+    return json_response
+
+def build_query_params(conn, kwargs):
+    """
+    validate the query_catalog keyword arguments and build the /api/base/search
+    request parameters, filling in defaults for "output_dir" and "type" in kwargs and
+    adding csw_wkt_geometry to the "fields" of a geoparquet query
+    """
+
+    params = {
+        'username':conn['username'],
+        'api_key':conn['access_token'],
+        'offset':0,
+    }
+
+    # set output path if not specified
+    if 'output_dir' not in kwargs:
+        kwargs['output_dir']=Path.cwd()
+
+    # geoparquet output is built from the footprints, so a "fields" query has to read them
+    if kwargs.get('output_format') == 'geoparquet' and kwargs.get('fields') is not None and 'csw_wkt_geometry' not in kwargs['fields']:
+        kwargs['fields'] = list(kwargs['fields']) + ['csw_wkt_geometry']
+
+    # set limit to a sufficiently big number if not specified
+    if 'limit' not in kwargs:
+        params.update({'limit':20000})
+    else:
+        params.update({'limit':kwargs['limit']})
+
+    # set type to layer if "raster" or "vector" not specified
+    if 'type' not in kwargs:
+        kwargs['type']='layer'
+    else:
+        params.update({'type__in':kwargs['type']})
+
+    if 'sat_id' in kwargs and 'find_least_cloud' in kwargs:
+        if kwargs['sat_id'] == 1 and kwargs['find_least_cloud'] == True:            
+            # throw an error if user specifies an s2 custom function with s1
+            raise ValueError("QUERY failed, you have specified 'sat_id'=1 and 'find_least_cloud'=True. Use 'sat_id'=2 and 'find_least_cloud'=True")
+    
+    if 'sat_id' in kwargs:
+        params.update({'keywords__slug__in': 'sentinel-' + str(kwargs['sat_id'])})        
+    
+    # date filter condition check and set
+    if 'start_date' in kwargs and 'end_date' not in kwargs:
+        raise ValueError("QUERY failed, if querying by date, please specify *BOTH* 'start_date' and 'end_date'")
+    elif 'start_date' not in kwargs and 'end_date' in kwargs:
+        raise ValueError("QUERY failed, if querying by date, please specify *BOTH* 'start_date' and 'end_date'")
+    elif 'start_date' in kwargs and 'end_date' in kwargs:
+        params.update({'date__range': kwargs['start_date'] + ' 00:00,' + kwargs['end_date'] + ' 23:59'})
+    
+    if 'title' in kwargs:
+        params.update({'q': kwargs['title']})
+
+    if 'updated_since' in kwargs:
+        params.update({'last_updated__gte': kwargs['updated_since']})
+
+    if 'geom' in kwargs:
+        params.update({'geometry': kwargs['geom']})
+
+    # cloud filter condition check and set    
+    if 'cloud_min' in kwargs and 'cloud_max' not in kwargs:
+        raise ValueError("QUERY failed, if querying by cloud cover, please specify *BOTH* 'cloud_min' and 'cloud_max'")
+    elif 'cloud_min' not in kwargs and 'cloud_max' in kwargs:
+        raise ValueError("QUERY failed, if querying by cloud cover, please specify *BOTH* 'cloud_min' and 'cloud_max'")
+    elif 'cloud_min' in kwargs and 'cloud_max' in kwargs:
+        if kwargs['sat_id'] == 1:
+            raise ValueError("QUERY failed, if querying by cloud cover, please specify 'sat_id'=2")
+        elif kwargs['sat_id'] == 2:
+            if 'find_least_cloud' not in kwargs:
+                params.update({'cc_min': kwargs['cloud_min']})
+                params.update({'cc_max': kwargs['cloud_max']})
+            elif kwargs['find_least_cloud'] != True:
+                params.update({'cc_min': kwargs['cloud_min']})
+                params.update({'cc_max': kwargs['cloud_max']})
+
+    return params
+
+def query_local_catalog(params, kwargs):
+    """
+    answer a query_catalog(..., source='local') query from the CatalogStore mirror
+    """
+
+    json_response = CatalogStore(kwargs.get('catalog_path', CATALOG_PATH)).query(params)
+    print(datetime.utcnow().isoformat() + ' :: QUERY ANSWERED FROM LOCAL CATALOG')
+
+    return process_query_response(json_response, kwargs)
+
+def query_cache_lookup(conn, params, kwargs):
+    """
+    return the QueryCache of the "cache" kwarg, the key of the query and the cached
+    DataFrame, which is None on a miss or without a cache
+    """
+
+    cache = kwargs.get('cache')
+    if cache is None:
+        return None, None, None
+
+    cache = cache if isinstance(cache, QueryCache) else QueryCache(cache)
+    # key on the fields actually read, which also depend on sat_id and find_least_cloud
+    cache_key = query_cache_key(conn, params if kwargs.get('fields') is None else dict(params, fields=sorted(query_input_fields(kwargs))))
+    df = cache.get(cache_key)
+
+    if df is not None:
+        print(datetime.utcnow().isoformat() + ' :: QUERY ANSWERED FROM RESPONSE CACHE')
+
+    return cache, cache_key, df
+
+def process_query_response(json_response, kwargs):
+    """
+    turn a decoded /api/base/search response into the (list_of_layers, df) pair
+    returned by query_catalog, applying the sentinel-2 keyword functions and
+    writing the query results csv
+    """
+
+    return process_query_frame(query_response_frame(json_response, kwargs), kwargs)
+
+def query_response_frame(json_response, kwargs=None):
+    """
+    DataFrame of the objects in a decoded /api/base/search response, or None if
+    the query matched no records. with a "fields" kwarg only the fields needed by
+    the query are normalised
+    """
+
+    if json_response['meta']['total_count'] > 0:
+
+        fields = query_input_fields(kwargs or {})
+
+        # a streamed response is already decoded into the needed columns
+        if isinstance(json_response.get('objects'), ColumnBuffer):
+            return json_response['objects'].to_frame()
+
+        if fields is None:
+            return json_normalize(json_response, 'objects')
+
+        top_keys = set(field.split('.')[0] for field in fields)
+        objects = [{key:value for key, value in o.items() if key in top_keys} for o in json_response.get('objects', [])]
+        df = json_normalize(objects)
+
+        return df[[c for c in df.columns if c in fields or any(c.startswith(f + '.') for f in fields)]]
+
+    return None
+
+# long free text fields dropped by query_catalog(..., compact=True)
+COMPACT_DROP_FIELDS = [
+    'abstract', 'raw_abstract', 'supplemental_information', 'raw_supplemental_information',
+    'purpose', 'raw_purpose', 'constraints_other', 'raw_constraints_other',
+    'data_quality_statement', 'raw_data_quality_statement', 'thumbnail_url',
+    ]
+
+def query_input_fields(kwargs):
+    """
+    the record fields a query with a "fields" kwarg has to read: the requested fields,
+    'alternate', and the fields the sentinel-2 columns are parsed from. None without fields
+    """
+
+    if kwargs.get('fields') is None:
+        return None
+
+    fields = ['alternate'] + [f for f in kwargs['fields'] if f != 'alternate']
+
+    if kwargs.get('sat_id') == 2:
+        fields += ['title', 'supplemental_information']
+        if kwargs.get('find_least_cloud'):
+            fields += ['split_granule.name']
+
+    return list(dict.fromkeys(fields))
+
+def shape_query_frame(df, kwargs):
+    """
+    drop the input only fields of a "fields" query and apply compact=True to the
+    final query DataFrame
+    """
+
+    if kwargs.get('fields') is not None:
+        requested = set(kwargs['fields']) | {'alternate'}
+        input_only = set(query_input_fields(kwargs)) - requested
+        df = df.drop(columns=[c for c in df.columns if c in input_only])
+
+    if kwargs.get('compact'):
+        df = compact_frame(df.drop(columns=[c for c in df.columns if c in COMPACT_DROP_FIELDS]))
+
+    return df
+
+def compact_frame(df):
+    """
+    downcast integer columns, downcast float columns that float32 holds exactly
+    and turn repeated string columns into categoricals
+    """
+
+    df = df.copy()
+
+    for column in df.columns:
+
+        series = df[column]
+
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            downcast = series.astype('float32')
+            if downcast.astype(series.dtype).equals(series):
+                df[column] = downcast
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            try:
+                if series.nunique() < 0.5 * len(series):
+                    df[column] = series.astype('category')
+            except TypeError:
+                # lists or dicts, not hashable
+                continue
+
+    return df
+
+def process_query_frame(df, kwargs):
+    """
+    apply the sentinel-2 keyword functions to the DataFrame of a query, write the
+    query results csv and return the (list_of_layers, df) pair
+    """
+
+    if df is not None:
+
+        # add extra cols to df for s2 info
+        if 'sat_id' in kwargs:
+            if kwargs['sat_id'] == 2:
+                df = add_s2_columns(df)
+
+        if 'find_least_cloud' in kwargs and kwargs['sat_id'] == 2:
+            if kwargs['find_least_cloud']:
+                df = resolve_split_pairs(df)
+
+                if 'split_granule.name' in df.columns and 'cloud_min' in kwargs and 'cloud_max' in kwargs:
+                    df = df[(df['split_cloud_cover']*100 >= kwargs['cloud_min']) & (df['split_cloud_cover']*100 <= kwargs['cloud_max'])]
+
+                filtered_df = find_minimum_cloud_list(df)
+            else:
+                filtered_df = df.copy()
+        else:
+            filtered_df = df.copy()
+
+
+        filtered_df = shape_query_frame(filtered_df, kwargs)
+
+        # make output paths
+        path_output = make_output_dir(kwargs['output_dir'])
+        write_query_results(filtered_df, path_output, kwargs.get('output_format', 'csv'))
+    
+        output_list = filtered_df['alternate'].tolist()
+
+        print('\nMatching Layers:\n')
+        for item in output_list:
+            print('\t' + item)
+        print('\n' + datetime.utcnow().isoformat() + ' :: NUMBER OF LAYERS RETURNED = ' + str(len(output_list)) + '\n')
+
+    else:
+        output_list = []
+        filtered_df = None
+        print('\n' + datetime.utcnow().isoformat() + ' :: QUERY WAS ACCEPTED BUT PARAMETERS USED RETURNED ZERO MATCHING RECORDS, TRY A DIFFERENT SET OF PARAMETERS')
+
+    return output_list, filtered_df
+
+# one pass parse of sentinel-2 layer titles, eg S2A_20210101_lat52lon1_T30UXC_ORB037_...
+S2_TITLE_PATTERN = re.compile(r'^(?P<satellite>[^_]+)_(?P<acquisition_date>[^_]+)_(?P<latlon>[^_]+)_(?P<granule>[^_]+)_(?P<orbit>[^_]+)(?:_|$)')
+ARCSI_CLOUD_PATTERN = re.compile(r'ARCSI_CLOUD_COVER: ([^\n]*)')
+
+def add_s2_columns(df):
+    """
+    add the typed sentinel-2 columns parsed from the title and supplemental_information:
+    satellite, acquisition_date (datetime64), latlon, granule-ref and orbit-ref
+    (categorical) and ARCSI_CLOUD_COVER (float)
+    """
+
+    parts = df['title'].str.extract(S2_TITLE_PATTERN)
+
+    df['satellite'] = parts['satellite'].astype('category')
+    df['acquisition_date'] = pd.to_datetime(parts['acquisition_date'], format='%Y%m%d', errors='coerce')
+    df['latlon'] = parts['latlon'].astype('category')
+    df['granule-ref'] = parts['granule'].astype('category')
+    df['orbit-ref'] = parts['orbit'].astype('category')
+    df['ARCSI_CLOUD_COVER'] = pd.to_numeric(df['supplemental_information'].str.extract(ARCSI_CLOUD_PATTERN)[0], errors='coerce')
+
+    return df
+
+def iter_catalog(conn, page_size=1000, **kwargs):
+    """
+    walk the /api/base/search results one page at a time
+
+    a generator version of query_catalog() for catalog wide scans: each page is
+    requested only when the previous one has been consumed, so memory use is bound by
+    page_size and work can start on the first page straight away
+
+    Parameters:
+    -----------
+        conn: dict,
+            Connection parameters, see query_catalog()
+
+        page_size: int, optional,
+            records requested per page
+            Default Value:
+                * 1000
+
+        as_frame: bool, optional,
+            if True each page is yielded as a DataFrame, with the sentinel-2 columns
+            of query_catalog() when sat_id=2, otherwise as the list of record dicts
+            Default Value:
+                * True
+
+        start_date, end_date, sat_id, type, title, cloud_min, cloud_max, geom, verify, session: optional,
+            filters and request settings as for query_catalog(). "limit" caps the total
+            number of records yielded
+
+    Yields:
+    -----------
+        page: DataFrame or list,
+            the records of one page
+    """
+
+    if page_size < 1:
+        raise ValueError('ERROR. page_size must be 1 or more, aborting ...')
+
+    if 'session' not in kwargs:
+        kwargs['session'] = get_default_session()
+
+    if 'verify' not in kwargs:
+        kwargs['verify'] = kwargs['session'].verify
+
+    as_frame = kwargs.pop('as_frame', True)
+    limit = kwargs.pop('limit', None)
+
+    params = build_query_params(conn, kwargs)
+    yielded = 0
+
+    while limit is None or yielded < limit:
+
+        params['limit'] = page_size if limit is None else min(page_size, limit - yielded)
+
+        response = kwargs['session'].get(
+            conn['domain'] + '/api/base/search',
+            params=params,
+            verify=kwargs['verify'],
+            headers={'User-Agent': 'python'}
+        )
+
+        if response.status_code != 200:
+            raise ValueError(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = ' + str(response.status_code) + ' (NOT SUCCESSFUL) :: QUERY URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
+
+        json_response = json.loads(response.content)
+        objects = json_response.get('objects', [])
+
+        if not objects:
+            break
+
+        yielded += len(objects)
+        params['offset'] += len(objects)
+
+        if not as_frame:
+            yield objects
+        elif kwargs.get('sat_id') == 2:
+            yield add_s2_columns(json_normalize(objects))
+        else:
+            yield json_normalize(objects)
+
+        # a short page may only mean the server caps the page size, so step on until total_count
+        if params['offset'] >= json_response.get('meta', {}).get('total_count', float('inf')):
+            break
+
+CATALOG_PATH = Path.home() / '.eodslib' / 'eods-catalog.sqlite'
+
+class CatalogStore():
+    """
+    sqlite mirror of the /api/base/search records, so query_catalog(source='local') can
+    answer queries offline
+
+    every record is kept as its original json, next to the columns the search filters
+    need: sentinel number, acquisition date, title, cloud cover, data type and the bbox
+    of csw_wkt_geometry. query() takes the params built by build_query_params() and
+    returns a dict shaped like the search response
+
+    Parameters:
+    -----------
+        path: str or Pathlib object,
+            sqlite file, created with its directory if it does not exist
+    """
+
+    def __init__(self, path):
+
+        self.path = Path(path)
+        make_output_dir(self.path.parent)
+
+        with self._connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                'id TEXT PRIMARY KEY, alternate TEXT, title TEXT, date TEXT, last_updated TEXT, '
+                'sat_id INTEGER, data_type TEXT, cloud REAL, '
+                'minx REAL, miny REAL, maxx REAL, maxy REAL, record TEXT)')
+            db.execute('CREATE INDEX IF NOT EXISTS records_date ON records (date)')
+            db.execute('CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connect(self):
+
+        return sqlite3.connect(str(self.path))
+
+    def upsert(self, records):
+        """
+        insert new records and rewrite changed ones, returning the number of
+        records inserted, updated and unchanged
+        """
+
+        counts = {'inserted':0, 'updated':0, 'unchanged':0}
+
+        db = self._connect()
+
+        try:
+            with db:
+                for record in records:
+
+                    row = catalog_row(record)
+                    stored = db.execute('SELECT last_updated, record FROM records WHERE id = ?', (row[0],)).fetchone()
+
+                    if stored is None:
+                        counts['inserted'] += 1
+                    elif (row[4] is not None and stored[0] == row[4]) or stored[1] == row[-1]:
+                        counts['unchanged'] += 1
+                        continue
+                    else:
+                        counts['updated'] += 1
+
+                    db.execute('INSERT OR REPLACE INTO records VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
+        finally:
+            db.close()
+
+        return counts
+
+    def get_state(self, key):
+
+        db = self._connect()
+        try:
+            row = db.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        finally:
+            db.close()
+
+        return None if row is None else row[0]
+
+    def set_state(self, key, value):
+
+        db = self._connect()
+        try:
+            with db:
+                db.execute('INSERT OR REPLACE INTO sync_state VALUES (?,?)', (key, value))
+        finally:
+            db.close()
+
+    def count(self):
+
+        db = self._connect()
+        try:
+            return db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        finally:
+            db.close()
+
+    def query(self, params):
+        """
+        evaluate /api/base/search params against the mirror, returning
+        {'meta': {'total_count': n}, 'objects': [...]}
+        """
+
+        clauses, args = [], []
+
+        if 'keywords__slug__in' in params:
+            clauses.append('sat_id = ?')
+            args.append(int(str(params['keywords__slug__in']).split('-')[-1]))
+
+        if 'date__range' in params:
+            date_from, date_to = params['date__range'].split(',')
+            clauses.append('substr(date, 1, 16) BETWEEN ? AND ?')
+            args += [date_from, date_to]
+
+        if 'q' in params:
+            clauses.append('title LIKE ?')
+            args.append('%' + params['q'] + '%')
+
+        if 'last_updated__gte' in params:
+            clauses.append('last_updated >= ?')
+            args.append(params['last_updated__gte'])
+
+        if 'type__in' in params:
+            clauses.append('data_type = ?')
+            args.append(params['type__in'])
+
+        if 'cc_min' in params and 'cc_max' in params:
+            clauses.append('cloud * 100 BETWEEN ? AND ?')
+            args += [params['cc_min'], params['cc_max']]
+
+        aoi = None
+        if 'geometry' in params:
+            aoi = shapely.wkt.loads(params['geometry'])
+            minx, miny, maxx, maxy = aoi.bounds
+            clauses.append('maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ?')
+            args += [minx, maxx, miny, maxy]
+
+        sql = 'SELECT record FROM records'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY date DESC, id'
+
+        db = self._connect()
+        try:
+            rows = db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+        objects = [json.loads(row[0]) for row in rows]
+
+        # exact intersection test for the records passing the bbox prefilter
+        if aoi is not None:
+            objects = [o for o in objects if shapely.wkt.loads(o['csw_wkt_geometry']).intersects(aoi)]
+
+        offset = params.get('offset', 0)
+        objects = objects[offset:offset + params['limit']] if 'limit' in params else objects[offset:]
+
+        return {'meta':{'total_count':len(objects)}, 'objects':objects}
+
+def catalog_row(record):
+    """
+    CatalogStore row of a search record, its filter columns followed by the record json
+    """
+
+    sat_id = None
+    for keyword in record.get('keywords') or []:
+        slug = keyword.get('slug') if isinstance(keyword, dict) else keyword
+        if slug in ['sentinel-1', 'sentinel-2']:
+            sat_id = int(slug[-1])
+    title = record.get('title') or ''
+    if sat_id is None and title[:2] in ['S1', 'S2']:
+        sat_id = int(title[1])
+
+    data_type = {'coverageStore':'raster', 'dataStore':'vector'}.get(record.get('storeType'), record.get('subtype'))
+
+    cloud = None
+    if 'ARCSI_CLOUD_COVER: ' in (record.get('supplemental_information') or ''):
+        try:
+            cloud = float(record['supplemental_information'].split('ARCSI_CLOUD_COVER: ')[-1].split('\n')[0])
+        except ValueError:
+            pass
+
+    bounds = [None] * 4
+    if record.get('csw_wkt_geometry'):
+        try:
+            bounds = list(shapely.wkt.loads(record['csw_wkt_geometry']).bounds)
+        except Exception:
+            pass
+
+    date = record.get('date')
+    if date is not None:
+        date = date.replace('T', ' ')
+
+    record_id = str(record.get('id', record.get('alternate')))
+
+    return tuple([record_id, record.get('alternate'), title, date, record.get('last_updated'),
+                  sat_id, data_type, cloud] + bounds + [json.dumps(record, sort_keys=True)])
+
+def sync_catalog(conn, **kwargs):
+    """
+    incrementally mirror the EODS catalog into a local CatalogStore for
+    query_catalog(..., source='local')
+
+    the first sync fetches the whole catalog. later syncs fetch only the records
+    modified since the latest "last_updated" already mirrored, paging through
+    /api/base/search. if the records carry no "last_updated", or the server rejects the
+    filter, the acquisition dates from overlap_days before the latest mirrored date are
+    re-scanned instead, so layers ingested late with older dates are still picked up.
+    records whose "last_updated" (or content) is unchanged are not rewritten
+
+    Parameters:
+    -----------
+        conn: dict,
+            Connection parameters, see query_catalog()
+
+        catalog_path: str or pathlib object, optional:
+            sqlite file of the mirror
+            Default Value:
+                * CATALOG_PATH
+
+        start_date, end_date: str, optional:
+            re-sync an explicit acquisition date window, format YYYY-MM-DD, to pick up
+            records modified after they were first mirrored. the sync state is left
+            as it was
+
+        overlap_days: int, optional:
+            days before the latest mirrored acquisition date re-scanned by an
+            incremental sync that cannot filter on "last_updated"
+            Default Value:
+                * 7
+
+        full: bool, optional:
+            if True, ignore the sync state and fetch the whole catalog
+            Default Value:
+                * False
+
+        page_size: int, optional:
+            records requested per page
+            Default Value:
+                * 1000
+
+        verify, session: optional,
+            as for query_catalog()
+
+    Returns:
+    -----------
+        summary: dict,
+            counts of records fetched, inserted, updated and unchanged, plus the
+            total held by the mirror
+    """
+
+    if 'session' not in kwargs:
+        kwargs['session'] = get_default_session()
+
+    if 'verify' not in kwargs:
+        kwargs['verify'] = kwargs['session'].verify
+
+    store = CatalogStore(kwargs.get('catalog_path', CATALOG_PATH))
+    page_size = kwargs.get('page_size', 1000)
+
+    filters = {key:kwargs[key] for key in ['session', 'verify']}
+    backfill = 'start_date' in kwargs or 'end_date' in kwargs
+    synced_to = store.get_state('synced_to')
+    updated_to = store.get_state('updated_to')
+
+    summary = {'fetched':0, 'inserted':0, 'updated':0, 'unchanged':0}
+
+    if backfill:
+        if 'start_date' not in kwargs or 'end_date' not in kwargs:
+            raise ValueError("SYNC failed, if syncing by date, please specify *BOTH* 'start_date' and 'end_date'")
+        filters.update({key:kwargs[key] for key in ['start_date', 'end_date']})
+        pages = iter_catalog(conn, page_size=page_size, as_frame=False, **filters)
+    elif kwargs.get('full') or synced_to is None:
+        pages = iter_catalog(conn, page_size=page_size, as_frame=False, **filters)
+    else:
+        overlap_from = datetime.strptime(synced_to, '%Y-%m-%d') - timedelta(days=kwargs.get('overlap_days', 7))
+        window = dict(filters, start_date=overlap_from.strftime('%Y-%m-%d'), end_date=datetime.utcnow().strftime('%Y-%m-%d'))
+        pages = iter_updated_since(conn, page_size, updated_to, dict(filters, updated_since=updated_to), window)
+
+    print(datetime.utcnow().isoformat() + ' :: CATALOG SYNC START :: ' + (
+        filters['start_date'] + ' TO ' + filters['end_date'] if backfill
+        else 'FULL CATALOG' if kwargs.get('full') or synced_to is None
+        else 'CHANGES SINCE ' + (updated_to or synced_to)))
+
+    for objects in pages:
+
+        for key, value in store.upsert(objects).items():
+            summary[key] += value
+        summary['fetched'] += len(objects)
+
+        dates = [o['date'][:10] for o in objects if o.get('date')]
+        if dates and (synced_to is None or max(dates) > synced_to):
+            synced_to = max(dates)
+
+        modified = [o['last_updated'] for o in objects if o.get('last_updated')]
+        if modified and (updated_to is None or max(modified) > updated_to):
+            updated_to = max(modified)
+
+    # an explicit date window has not seen the whole catalog, so it cannot move the high-water marks
+    if not backfill:
+        if synced_to is not None:
+            store.set_state('synced_to', synced_to)
+        if updated_to is not None:
+            store.set_state('updated_to', updated_to)
+
+    summary['total'] = store.count()
+
+    print(datetime.utcnow().isoformat() + ' :: CATALOG SYNC END :: FETCHED = ' + str(summary['fetched']) + ', INSERTED = ' + str(summary['inserted']) + ', UPDATED = ' + str(summary['updated']) + ', TOTAL = ' + str(summary['total']))
+
+    return summary
+
+def iter_updated_since(conn, page_size, updated_to, modified_filters, window_filters):
+    """
+    pages of the records modified since updated_to, falling back to the acquisition date
+    window if there is no "last_updated" high-water mark or the server rejects the filter
+    """
+
+    if updated_to is not None:
+        try:
+            pages = iter_catalog(conn, page_size=page_size, as_frame=False, **modified_filters)
+            first = next(pages, None)
+        except ValueError as error:
+            print(datetime.utcnow().isoformat() + ' :: CATALOG SYNC :: LAST_UPDATED FILTER REJECTED, RE-SCANNING FROM ' + window_filters['start_date'] + ' :: ' + str(error.args[0]).split(' :: QUERY URL')[0])
+        else:
+            if first is not None:
+                yield first
+                yield from pages
+            return
+
+    yield from iter_catalog(conn, page_size=page_size, as_frame=False, **window_filters)
+
+def as_geometries(aois):
+    """
+    return a list of shapely geometries from a single geometry or WKT string, or an
+    iterable of them
+    """
+
+    if isinstance(aois, (str, BaseGeometry)):
+        aois = [aois]
+
+    return [shapely.wkt.loads(aoi) if isinstance(aoi, str) else aoi for aoi in aois]
+
+class CatalogIndex():
+    """
+    in-memory spatial index over the footprints of a query_catalog() DataFrame, to answer
+    intersects / contains / nearest for many AOIs locally instead of one search per AOI
+
+    the footprint WKT is parsed once into an STRtree. pickling (or save() / load())
+    keeps the geometries as WKB, so a reloaded index does not parse the WKT again
+
+    Parameters:
+    -----------
+        df: DataFrame,
+            query results holding a footprint column, rows without a footprint are
+            left out of the index
+
+        geometry_column: str, optional:
+            column of footprint WKT
+            Default Value:
+                * 'csw_wkt_geometry'
+    """
+
+    # AOI-side predicate for each query, e.g. a footprint contains the AOI when the AOI is within it
+    PREDICATES = {'intersects':'intersects', 'contains':'within'}
+
+    def __init__(self, df, geometry_column='csw_wkt_geometry'):
+        self.df = df
+        self.geometry_column = geometry_column
+
+        valid = df[geometry_column].notna().to_numpy()
+        wkts = df[geometry_column].to_numpy()[valid]
+
+        self.positions = np.flatnonzero(valid)
+        self.build(shapely.from_wkt(wkts) if SHAPELY2 else [shapely.wkt.loads(wkt) for wkt in wkts])
+
+    def build(self, geoms):
+        self.geoms = list(geoms)
+        self.tree = STRtree(self.geoms)
+
+        if not SHAPELY2:
+            # shapely 1.x queries return geometries, map them back to their position
+            self.tree_ids = {id(geom):i for i, geom in enumerate(self.geoms)}
 
-        return execution_dict
+    def __len__(self):
+        return len(self.geoms)
 
-    except Exception as error:
+    def __getstate__(self):
+        return {
+            'df':self.df,
+            'geometry_column':self.geometry_column,
+            'positions':self.positions,
+            'wkb':[geom.wkb for geom in self.geoms],
+            }
 
-        execution_dict.update({
-            'message':'ERROR in extraction of files :: MESSAGE = ' + str(error)
-        })
+    def __setstate__(self, state):
+        self.df = state['df']
+        self.geometry_column = state['geometry_column']
+        self.positions = state['positions']
+        self.build(shapely.from_wkb(state['wkb']) if SHAPELY2 else [shapely.wkb.loads(wkb) for wkb in state['wkb']])
 
-        return execution_dict
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
-def output_log(list_of_results):
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
 
-    df = pd.DataFrame(list_of_results)
-    log_file_name = list_of_results[0]['log_file_path']
-    df.to_csv(log_file_name, index_label='num')
-    print('\t\t### ' + datetime.utcnow().isoformat() + ' :: JOB FINISHED. LOG FILE LOCATION : ' + str(log_file_name))
+    def query(self, aois, predicate='intersects'):
+        """
+        return the (aoi, row) position pairs matching predicate, as two int arrays
+        ordered by aoi then row, rows being positions in self.df
+        """
 
-def make_output_dir(path_output):
+        if predicate not in self.PREDICATES:
+            raise ValueError('ERROR. predicate must be one of ' + ', '.join(self.PREDICATES) + ', aborting ...')
+
+        aois = as_geometries(aois)
+
+        if not aois or not self.geoms:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+
+        if SHAPELY2:
+            aoi_idx, tree_idx = self.tree.query(np.array(aois, dtype=object), predicate=self.PREDICATES[predicate])
+        else:
+            pairs = [(i, self.tree_ids[id(geom)]) for i, aoi in enumerate(aois) for geom in self.tree.query(aoi)
+                     if getattr(aoi, self.PREDICATES[predicate])(geom)]
+            aoi_idx = np.array([pair[0] for pair in pairs], dtype=np.intp)
+            tree_idx = np.array([pair[1] for pair in pairs], dtype=np.intp)
+
+        rows = self.positions[tree_idx]
+        # one int64 sort key is several times quicker than lexsort on millions of pairs
+        order = np.argsort(aoi_idx.astype(np.int64) * len(self.df) + rows)
+
+        return aoi_idx[order], rows[order]
+
+    def join(self, aois, predicate='intersects'):
+        """
+        return the rows of self.df matching predicate for each AOI, in long format
+        with the AOI position in an "aoi" column
+        """
+
+        aoi_idx, rows = self.query(aois, predicate)
+
+        df = self.df.iloc[rows].copy()
+        df.insert(0, 'aoi', aoi_idx)
+
+        return df
+
+    def intersects(self, aois):
+        """
+        rows whose footprint intersects each AOI, see join()
+        """
+        return self.join(aois, 'intersects')
+
+    def contains(self, aois):
+        """
+        rows whose footprint fully contains each AOI, see join()
+        """
+        return self.join(aois, 'contains')
+
+    def nearest(self, aois):
+        """
+        the row whose footprint is nearest to each AOI, one row per AOI
+        """
+
+        aois = as_geometries(aois)
+
+        if not self.geoms:
+            raise ValueError('ERROR. CatalogIndex is empty, aborting ...')
+
+        if SHAPELY2:
+            tree_idx = np.asarray(self.tree.nearest(np.array(aois, dtype=object)))
+        else:
+            tree_idx = np.array([self.tree_ids[id(self.tree.nearest(aoi))] for aoi in aois], dtype=np.intp)
+
+        df = self.df.iloc[self.positions[tree_idx]].copy()
+        df.insert(0, 'aoi', np.arange(len(aois)))
+
+        return df
+
+XML_TEMPLATE_DIR = Path(os.path.dirname(os.path.realpath(__file__))) / 'xml'
+
+# whole template_* tokens of the xml templates, so template_ll never matches inside template_layer_name
+XML_PLACEHOLDER_PATTERN = re.compile(r'(?<![A-Za-z0-9_])(template_[A-Za-z0-9_]+)')
+
+# compiled templates by path, with the mtime they were read at
+_xml_templates = {}
+_xml_templates_lock = threading.Lock()
+
+def compile_xml_template(path_xml_file):
     """
-    generate output directory if it does not exist
+    return the compiled form of an xml template, read from disk only when the file is
+    new to the cache or its mtime has changed
+
+    the compiled form is a (literals, placeholders) pair, the template text split around
+    its template_* placeholders, see render_xml_template()
     """
 
-    if isinstance(path_output, Path) == False:
-        path_output = Path(path_output)
+    mtime = os.stat(path_xml_file).st_mtime_ns
 
-    path_output.mkdir(parents=True, exist_ok=True)
+    with _xml_templates_lock:
+        cached = _xml_templates.get(path_xml_file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
 
-    return path_output
+    with open(path_xml_file,'r') as template_xml:
+        parts = XML_PLACEHOLDER_PATTERN.split(template_xml.read())
 
-def find_minimum_cloud_list(df):
+    compiled = (parts[0::2], parts[1::2])
+
+    with _xml_templates_lock:
+        _xml_templates[path_xml_file] = (mtime, compiled)
+
+    return compiled
+
+def render_xml_template(compiled, xml_config):
     """
-    eods query "special" keyword function
-    + cross checks the dataframe with a static csv file of 'safe' granule list
-    + then groups by the unique granule-reference
-    + sorts by cloud cover and takes the lowest cloud value per granule
-    + returns a new dataframe
+    fill the placeholders of a compiled xml template from xml_config in one pass.
+    placeholders missing from xml_config are left as they are
+    """
+
+    literals, placeholders = compiled
+
+    if not xml_config:
+        values = {}
+    else:
+        values = dict(xml_config)
+        if 'template_mimetype' in values:
+            values['template_mimetype'] = '"' + values['template_mimetype'] + '"'
+
+    parts = [literals[0]]
+    for placeholder, literal in zip(placeholders, literals[1:]):
+        parts.append(values.get(placeholder, placeholder))
+        parts.append(literal)
+
+    return ''.join(parts)
+
+def mod_the_xml(item):
+    """
+    function read xml payload template and modify the payload with the config
     """
+    path_xml_file = os.path.join(XML_TEMPLATE_DIR, item['template_xml'])
+
+    try:
+        compiled = compile_xml_template(path_xml_file)
+    except OSError as err:        
+        print('\n\t ### ERROR :: pyeods cannot find the specified xml file\n')
+        raise AssertionError(str(err)) from err
+
+    return render_xml_template(compiled, item['xml_config'])
     
-    df['title_stub'] = df['title'].str.split('_T', expand=True).loc[:,0] + '_' + df['granule-ref'].str[:6]
+def query_catalog_many(conn, geoms, **kwargs):
+    """
+    find the candidate layers for many AOIs (e.g. field parcels) with a single catalog
+    query. the catalog is queried once over the bbox of all the AOIs (or the local mirror
+    with source='local'), then each AOI is matched against the footprints with a
+    CatalogIndex, so there is one request and one results file however many AOIs
+
+    Parameters:
+    -----------
+        conn: dict,
+            Connection parameters, see query_catalog()
+
+        geoms: iterable, dict or pandas Series,
+            AOIs as WGS84 shapely geometries or WKT strings. dict keys or the Series
+            index label the AOIs, otherwise they are labelled by position
+
+        predicate: str, optional:
+            match layers whose footprint intersects the AOI or fully contains it
+            Default Value:
+                * 'intersects'
+            Possible values:
+                * 'intersects'
+                * 'contains'
+
+        start_date, end_date, sat_id, type, title, cloud_min, cloud_max, find_least_cloud,
+        limit, fields, source, cache, verify, session, ...: optional,
+            filters and settings as for query_catalog(), except geom which is set from
+            the AOIs
+
+    Returns:
+    -----------
+        pairs: DataFrame,
+            long format table with one row per matching AOI and layer, columns "aoi"
+            and "alternate", ordered by AOI
+
+        df: DataFrame,
+            the candidate layers, as returned by query_catalog()
+    """
+
+    if 'geom' in kwargs:
+        raise ValueError('ERROR. geom is set from the AOIs by query_catalog_many, aborting ...')
 
-    no_split_df = df[~df['title'].str.contains("SPLIT")]
+    predicate = kwargs.pop('predicate', 'intersects')
 
-    # import safe granule-orb list
-    if Path(Path(os.path.dirname(os.path.realpath(__file__))) / 'static' / 'safe-granule-orbit-list.txt').exists():
-        df_safe_list = pd.read_csv(Path(os.path.dirname(os.path.realpath(__file__))) / 'static' / 'safe-granule-orbit-list.txt')
+    if isinstance(geoms, pd.Series):
+        labels = geoms.index.to_numpy()
+        geoms = geoms.tolist()
+    elif isinstance(geoms, dict):
+        labels = np.array(list(geoms.keys()))
+        geoms = list(geoms.values())
     else:
-        raise ValueError('ERROR :: safe-granule-orbit-list.txt cannot be found')
+        labels = None
 
-    # create new col that matches the granule-orbit syntax
-    no_split_df['gran-orb'] = no_split_df['granule-ref'].str[:6] + '_' + no_split_df['orbit-ref']   
-    no_split_df['granule-stub'] = no_split_df['granule-ref'].str[:6]
+    aois = as_geometries(geoms)
 
-    df['gran-orb'] = df['granule-ref'].str[:6] + '_' + df['orbit-ref']
-    df['granule-stub'] = df['granule-ref'].str[:6]
+    if not aois:
+        raise ValueError('ERROR. no AOIs given to query_catalog_many, aborting ...')
 
-    safe_df = pd.merge(no_split_df, df_safe_list)
+    bounds = np.array([aoi.bounds for aoi in aois])
+    kwargs['geom'] = shapely.geometry.box(bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()).wkt
 
-    if len(safe_df) > 0:
-        return_df = safe_df.sort_values("split_cloud_cover").groupby(["granule-stub"], as_index=False).nth(0).sort_values("granule-stub")
+    # the footprints are needed to match the AOIs locally
+    if kwargs.get('fields') is not None and 'csw_wkt_geometry' not in kwargs['fields']:
+        kwargs['fields'] = list(kwargs['fields']) + ['csw_wkt_geometry']
 
-        if 'split_granule.name' in df.columns:
-            matching_split_series = return_df[return_df['split_granule.name'].notna()]['split_granule.name']
-            matching_split_df = df[df['alternate'].isin(matching_split_series)]
+    print(datetime.utcnow().isoformat() + ' :: QUERY FOR ' + str(len(aois)) + ' AOIS OVER BBOX = ' + kwargs['geom'])
 
-            return_df = pd.concat([return_df, matching_split_df], ignore_index=True)
-        
+    result = query_catalog(conn, **kwargs)
+
+    if result is None:
+        return None
+
+    _, df = result
+
+    if df is None:
+        aoi_idx, rows = np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+        df = pd.DataFrame(columns=['alternate', 'csw_wkt_geometry'])
     else:
-        raise ValueError('ERROR : You have selected find_least_cloud=True BUT your search criteria is too narrow, spatially or temporally and did not match any granule references in "./static/safe-granule-orbit-list.txt". Suggest widening your search')
+        aoi_idx, rows = CatalogIndex(df).query(aois, predicate)
 
-    return return_df  
+    pairs = pd.DataFrame({
+        'aoi':labels[aoi_idx] if labels is not None else aoi_idx,
+        'alternate':df['alternate'].to_numpy()[rows],
+        })
 
+    print(datetime.utcnow().isoformat() + ' :: AOI-LAYER MATCHES = ' + str(len(pairs)) + ', AOIS WITH NO LAYER = ' + str(len(aois) - pairs['aoi'].nunique()))
 
-def query_catalog(conn, **kwargs):
-    """Transform vectors from source to target coordinate reference system.
-    Transform vectors of x, y and optionally z from source
-    coordinate reference system into target.
+    return pairs, df
 
-    Parameters
-    ------------
-    conn: dict
-        connection dictionary 
-        Example: conn = {
-            'domain': 'https://earthobs.defra.gov.uk',
-            'username': '<insert-username>',
-            'access_token': '<insert-access-token>',
-            }}
-    start_date: str, optional
-        filter start date in format YYYY-MM-DD
-    end_date: str, optional
-        filter start end in format YYYY-MM-DD
-    sat_id: int, optional
-        filter for either sentinel-1 and sentinel-2
-        Possible values:
-            * 1
-            * 2        
-    type: str, optional,
-        filter on data type, user can override default
-        Default value:
-            * 'layer'        
-        Possible values:
-            * 'raster'
-            * 'vector'
-    title: str, optional,
-        filter on match or partial match of the layer name/title
-    cloud_min: int, optional,
-        filter on minima cloud value for s2 data, must be used
-        with cloud_max keyword
-        Possible values:
-            * 0 to 100
-    cloud_max: int, optional,
-        filter on minima cloud value for s2 data, must be used
-        with cloud_min keyword
-        Possible values:
-            * 0 to 100
-    geom: str, optional,
-        filter layers that intersect with Well Know Text WGS84 geometry
-        Example:
-            geom = 'Polygon((-2.4 51.9, -2.4 51.6, -1.9 51.6, -1.9 51.9, -2.4 51.9))'
-    limit: int, optional:
-        limit the number of records returned by query. As of 2020-09-11 there
-        are ~ 10,500 records on EODS
-        Default Value:
-            * 20000
-        Possible values:
-            * 0 to n 
-    find_least_cloud: bool, optional:
-        custom filter to generate a list of least cloud per granule
-    verify: str, optional:
-        add custom path to any organisation certificate stores that the
-        environment needs
-        Default Value:
-            * True
-        Possible Value:
-            * 'dir/dir/cert.file'
-    output_dir: str or pathlib object, optional:
-        user can specify custom output directory for data
-        Default Value:
-            * Path.cwd() the current working path.
-        Possible Value:
-            * 'some/dir/'
-            * Path('some/dir')
+def select_scenes_for_aoi(df, aoi, max_cloud=None, coverage=0.99, geometry_column='csw_wkt_geometry'):
+    """
+    choose a small, low cloud set of layers whose footprints cover an AOI, so fewer
+    WPS jobs are run and fewer whole granules downloaded
 
-    Returns
-    ---------
-    list_of_layers: list,
-        List of layer names that match the EODS input query
-    
-    df: Pandas DataFrame,
-        DataFrame table of results containing all metadata of query results
+    greedy set cover: each footprint is clipped to the AOI once, then the layer adding
+    the most clear area (new AOI area x (1 - cloud cover)) is taken until the covered
+    fraction reaches coverage. areas are planar in WGS84 degrees, fine for the
+    fractions of county sized AOIs. layers without a cloud value are not selected
+
+    Parameters:
+    -----------
+        df: DataFrame,
+            query results, e.g. from query_catalog(sat_id=2) or find_minimum_cloud_list()
+
+        aoi: shapely geometry or str,
+            AOI as WGS84 geometry or WKT
+
+        max_cloud: int or float, optional:
+            leave out layers with more cloud, in percent as for cloud_max
+            Default Value:
+                * None (no limit)
+
+        coverage: float, optional:
+            target fraction of the AOI area to cover
+            Default Value:
+                * 0.99
+
+        geometry_column: str, optional:
+            column of footprint WKT
+            Default Value:
+                * 'csw_wkt_geometry'
+
+    Returns:
+    -----------
+        selected_df: DataFrame,
+            the chosen rows of df in the order picked, with "aoi_area_added" (fraction
+            of the AOI each adds) and "aoi_coverage" (cumulative fraction) columns
     """
 
-    params = {
-        'username':conn['username'],
-        'api_key':conn['access_token'],
-        'offset':0,
-    }
+    if not 0 < coverage <= 1:
+        raise ValueError('ERROR. coverage must be in (0, 1], aborting ...')
 
-    # set output path if not specified
-    if 'output_dir' not in kwargs:
-        kwargs['output_dir']=Path.cwd()
+    aoi = as_geometries(aoi)[0]
 
-    # set limit to a sufficiently big number if not specified
-    if 'limit' not in kwargs:
-        params.update({'limit':20000})
-    else:
-        params.update({'limit':kwargs['limit']})
+    if aoi.area == 0:
+        raise ValueError('ERROR. aoi must be a polygon with an area, aborting ...')
 
-    # set type to layer if "raster" or "vector" not specified
-    if 'type' not in kwargs:
-        kwargs['type']='layer'
+    if 'ARCSI_CLOUD_COVER' not in df.columns:
+        df = add_s2_columns(df)
+
+    cloud = pd.to_numeric(df['ARCSI_CLOUD_COVER'], errors='coerce').to_numpy(dtype=float)
+
+    index = CatalogIndex(df, geometry_column)
+    _, rows = index.query(aoi)
+
+    if max_cloud is not None:
+        rows = rows[cloud[rows] * 100 <= max_cloud]
+
+    # footprints of the candidate rows, clipped to the AOI
+    footprints = [index.geoms[i] for i in np.searchsorted(index.positions, rows)]
+    if SHAPELY2:
+        clips = shapely.intersection(np.array(footprints, dtype=object), aoi)
+        areas = shapely.area(clips)
     else:
-        params.update({'type__in':kwargs['type']})
+        clips = [footprint.intersection(aoi) for footprint in footprints]
+        areas = np.array([clip.area for clip in clips])
 
-    if 'verify' not in kwargs:
-        kwargs['verify'] = True
+    clear = 1 - np.clip(np.nan_to_num(cloud[rows], nan=1.0), 0, 1)
 
-    if 'sat_id' in kwargs and 'find_least_cloud' in kwargs:
-        if kwargs['sat_id'] == 1 and kwargs['find_least_cloud'] == True:            
-            # throw an error if user specifies an s2 custom function with s1
-            raise ValueError("QUERY failed, you have specified 'sat_id'=1 and 'find_least_cloud'=True. Use 'sat_id'=2 and 'find_least_cloud'=True")
-    
-    if 'sat_id' in kwargs:
-        params.update({'keywords__slug__in': 'sentinel-' + str(kwargs['sat_id'])})        
-    
-    # date filter condition check and set
-    if 'start_date' in kwargs and 'end_date' not in kwargs:
-        raise ValueError("QUERY failed, if querying by date, please specify *BOTH* 'start_date' and 'end_date'")
-    elif 'start_date' not in kwargs and 'end_date' in kwargs:
-        raise ValueError("QUERY failed, if querying by date, please specify *BOTH* 'start_date' and 'end_date'")
-    elif 'start_date' in kwargs and 'end_date' in kwargs:
-        params.update({'date__range': kwargs['start_date'] + ' 00:00,' + kwargs['end_date'] + ' 23:59'})
-    
-    if 'title' in kwargs:
-        params.update({'q': kwargs['title']})
+    # lazy greedy, the clear area a layer adds only shrinks as others are taken so a
+    # stale score is an upper bound and only the head of the heap is re-evaluated
+    heap = [(-area * c, 1 - c, i) for i, (area, c) in enumerate(zip(areas, clear)) if area * c > 0]
+    heapq.heapify(heap)
 
-    if 'geom' in kwargs:
-        params.update({'geometry': kwargs['geom']})
+    aoi_area = aoi.area
+    covered = None
+    selected, added, fractions = [], [], []
+    fraction = 0
 
-    # cloud filter condition check and set    
-    if 'cloud_min' in kwargs and 'cloud_max' not in kwargs:
-        raise ValueError("QUERY failed, if querying by cloud cover, please specify *BOTH* 'cloud_min' and 'cloud_max'")
-    elif 'cloud_min' not in kwargs and 'cloud_max' in kwargs:
-        raise ValueError("QUERY failed, if querying by cloud cover, please specify *BOTH* 'cloud_min' and 'cloud_max'")
-    elif 'cloud_min' in kwargs and 'cloud_max' in kwargs:
-        if kwargs['sat_id'] == 1:
-            raise ValueError("QUERY failed, if querying by cloud cover, please specify 'sat_id'=2")
-        elif kwargs['sat_id'] == 2:
-            if 'find_least_cloud' not in kwargs:
-                params.update({'cc_min': kwargs['cloud_min']})
-                params.update({'cc_max': kwargs['cloud_max']})
-            elif kwargs['find_least_cloud'] != True:
-                params.update({'cc_min': kwargs['cloud_min']})
-                params.update({'cc_max': kwargs['cloud_max']})
-   
+    while heap and fraction < coverage:
+        _, layer_cloud, i = heapq.heappop(heap)
 
-    try:
-        response = requests.get(
-            conn['domain'] + '/api/base/search',
-            params=params,
-            verify=kwargs['verify'],
-            headers={'User-Agent': 'python'}
-        )
+        new_area = clips[i].area if covered is None else clips[i].difference(covered).area
+        score = new_area * clear[i]
 
-        if response.status_code == 200:
+        if heap and score < -heap[0][0]:
+            heapq.heappush(heap, (-score, layer_cloud, i))
+            continue
 
-            print(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = 200 (SUCCESS)')
-            print(datetime.utcnow().isoformat() + ' :: QUERY URL USED (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
-            
-            # create a json object of the api payload content
-            json_response = json.loads(response.content)
-
-            if json_response['meta']['total_count'] > 0:
-
-                df = json_normalize(json_response, 'objects')
-
-                # add extra cols to df for s2 info
-                if 'sat_id' in kwargs:
-                    if kwargs['sat_id'] == 2:
-                        df['granule-ref'] = df['title'].str.split('_',n=4).str[3]
-                        df['orbit-ref'] = df['title'].str.split('_',n=5).str[-2]
-                        df['ARCSI_CLOUD_COVER'] = df['supplemental_information'].str.split("ARCSI_CLOUD_COVER: ").str[-1].str.split("\n").str[0]
-
-                if 'find_least_cloud' in kwargs and kwargs['sat_id'] == 2:
-                    if kwargs['find_least_cloud']:
-                        if 'split_granule.name' in df.columns:
-                            temp_df = df[df['split_granule.name'].notna()][['alternate', 'ARCSI_CLOUD_COVER']].copy()
-                            temp_df.rename(columns={"alternate": "split_granule.name", "ARCSI_CLOUD_COVER": "split_ARCSI_CLOUD_COVER"}, inplace=True)
-                            merged_df = df[df['split_granule.name'].notna()].reset_index().merge(temp_df, how='outer', on='split_granule.name').set_index('index')
-                            df['split_ARCSI_CLOUD_COVER'] = np.nan
-                            df.loc[df['split_granule.name'].notna(), 'split_ARCSI_CLOUD_COVER'] = merged_df['split_ARCSI_CLOUD_COVER']
-
-                            split_cloud_cover = np.where(df['split_granule.name'].notna(), ((df['ARCSI_CLOUD_COVER'].astype(
-                                float) + df['split_ARCSI_CLOUD_COVER'].astype(
-                                float))/2).astype(str), df['ARCSI_CLOUD_COVER'])
-
-                            df['split_cloud_cover'] = split_cloud_cover
-
-                            if 'cloud_min' in kwargs and 'cloud_max' in kwargs:
-                                # print(df['split_cloud_cover'].astype(float).min())
-                                df = df[df['split_cloud_cover'].astype(float)*100 >= kwargs['cloud_min']]
-                                # print(df['split_cloud_cover'].astype(float).min())
-                                # print(df['split_cloud_cover'].astype(float).max())
-                                df = df[df['split_cloud_cover'].astype(float)*100 <= kwargs['cloud_max']]
-                                # print(df['split_cloud_cover'].astype(float).max())
-                        
-                        else:
-                            df['split_cloud_cover'] = df['ARCSI_CLOUD_COVER']
-
-                        filtered_df = find_minimum_cloud_list(df)
-                    else:
-                        filtered_df = df.copy()
-                else:
-                    filtered_df = df.copy()
+        if score <= 0:
+            break
 
+        covered = clips[i] if covered is None else covered.union(clips[i])
+        fraction = covered.area / aoi_area
 
-                # make output paths
-                path_output = make_output_dir(kwargs['output_dir'])
-                log_file_name = path_output / 'eods-query-all-results.csv'
-                filtered_df.to_csv(log_file_name)
-            
-                output_list = filtered_df['alternate'].tolist()
+        selected.append(rows[i])
+        added.append(new_area / aoi_area)
+        fractions.append(fraction)
+
+    selected_df = df.iloc[selected].copy()
+    selected_df['aoi_area_added'] = added
+    selected_df['aoi_coverage'] = fractions
 
-                print('\nMatching Layers:\n')
-                for item in output_list:
-                    print('\t' + item)
-                print('\n' + datetime.utcnow().isoformat() + ' :: NUMBER OF LAYERS RETURNED = ' + str(len(output_list)) + '\n')
+    print(datetime.utcnow().isoformat() + ' :: SCENES SELECTED = ' + str(len(selected_df)) + ' OF ' + str(len(rows)) + ' INTERSECTING, AOI COVERAGE = ' + str(round(fraction, 4)))
 
-            else:
-                output_list = []
-                filtered_df = None
-                print('\n' + datetime.utcnow().isoformat() + ' :: QUERY WAS ACCEPTED BUT PARAMETERS USED RETURNED ZERO MATCHING RECORDS, TRY A DIFFERENT SET OF PARAMETERS')
+    if fraction < coverage:
+        print(datetime.utcnow().isoformat() + ' :: WARNING, TARGET COVERAGE OF ' + str(coverage) + ' NOT REACHED BY THE CANDIDATE LAYERS')
 
-            return output_list, filtered_df
+    return selected_df
 
-        else:
-            raise ValueError(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = ' + str(response.status_code) + ' (NOT SUCCESSFUL)' + str(response.status_code) + ' :: QUERY URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + response.url)
+# pyproj transformers by (src, dst) epsg, per thread as a transformer is not shared across threads
+_transformers = threading.local()
 
-    except requests.exceptions.RequestException as e:
-        print('\n' + datetime.utcnow().isoformat() + ' :: ERROR, an Exception was raised, no list returned')
-        print(e)
-        return None
-    
-def mod_the_xml(item):
+def get_transformer(src_epsg, dst_epsg):
     """
-    function read xml payload template and modify the payload with the config
+    return an always_xy pyproj Transformer from src_epsg to dst_epsg, built once per
+    thread and epsg pair
     """
-    path_xml_file = Path(os.path.dirname(os.path.realpath(__file__))) / 'xml' / item['template_xml']
 
-    try:
-        assert path_xml_file.exists and path_xml_file.is_file()
-    except AssertionError as err:        
-        print('\n\t ### ERROR :: pyeods cannot find the specified xml file\n')
-        raise err
-    
-    with open(path_xml_file,'r') as template_xml:
-        file_data = template_xml.read()
-        
-        if item['xml_config'] is not None:
-            # update other "fixed" keys in the xml config
-            for key, value in item['xml_config'].items():
+    cache = getattr(_transformers, 'cache', None)
+    if cache is None:
+        cache = _transformers.cache = {}
+
+    key = (int(src_epsg), int(dst_epsg))
+
+    if key not in cache:
+        cache[key] = pyproj.Transformer.from_crs(pyproj.CRS('EPSG:' + str(key[0])), pyproj.CRS('EPSG:' + str(key[1])), always_xy=True)
+
+    return cache[key]
 
-                if key == 'template_mimetype':
-                    value = '"' + value + '"'
-                file_data = file_data.replace(key, value)
-    
-    return file_data
-    
 def get_bbox_corners_from_wkt(csw_wkt_geometry,epsg):
     """
     function to return a bbox coordinate pair representing lower_left and upper_right of an EODS layer's bounds
     """
 
     wkt_obj = shapely.wkt.loads(csw_wkt_geometry)
+    minx, miny, maxx, maxy = wkt_obj.bounds
 
-    ll_wgs84_pt = shapely.geometry.Point(wkt_obj.bounds[0], wkt_obj.bounds[1])
-    ur_wgs84_pt = shapely.geometry.Point(wkt_obj.bounds[2], wkt_obj.bounds[3])
+    # both corners in one call
+    xs, ys = get_transformer(4326, epsg).transform([minx, maxx], [miny, maxy])
 
-    wgs84 = pyproj.CRS('EPSG:4326')
-    to_crs_epsg = pyproj.CRS('EPSG:' + str(epsg))
-
-    project = pyproj.Transformer.from_crs(wgs84, to_crs_epsg, always_xy=True).transform
-    ll_proj_pt = transform(project, ll_wgs84_pt)
-    ur_proj_pt = transform(project, ur_wgs84_pt)
+    ll_proj_pt = shapely.geometry.Point(xs[0], ys[0])
+    ur_proj_pt = shapely.geometry.Point(xs[1], ys[1])
 
     return ll_proj_pt, ur_proj_pt
 
-def post_to_layer_group_api(conn, url, the_json, quiet=True):
+def bbox_corners_for_frame(df, epsg, geometry_column='csw_wkt_geometry'):
+    """
+    get_bbox_corners_from_wkt() for every layer of a query DataFrame at once: the
+    footprints are parsed as one array, their bounds taken in bulk and all the corners
+    transformed in one call
+
+    Parameters:
+    -----------
+        df: DataFrame,
+            query results holding a footprint column
+
+        epsg: int,
+            epsg code of the output corners
+
+        geometry_column: str, optional:
+            column of WGS84 footprint WKT
+            Default Value:
+                * 'csw_wkt_geometry'
+
+    Returns:
+    -----------
+        corners_df: DataFrame,
+            indexed like df, with the corner coordinates "ll_x", "ll_y", "ur_x", "ur_y"
+            and the "template_ll" / "template_ur" strings of the xml templates. rows
+            without a footprint are left missing
+    """
+
+    wkts = df[geometry_column].to_numpy()
+    valid = pd.notna(wkts)
+
+    bounds = np.full((len(wkts), 4), np.nan)
+    if SHAPELY2:
+        bounds[valid] = shapely.bounds(shapely.from_wkt(wkts[valid]))
+    elif valid.any():
+        bounds[valid] = [shapely.wkt.loads(wkt).bounds for wkt in wkts[valid]]
+
+    xs, ys = get_transformer(4326, epsg).transform(
+        np.concatenate([bounds[:, 0], bounds[:, 2]]), np.concatenate([bounds[:, 1], bounds[:, 3]]))
+    # proj returns inf for the nan corners of rows without a footprint
+    xs, ys = np.where(np.isfinite(xs), xs, np.nan), np.where(np.isfinite(ys), ys, np.nan)
+
+    n = len(wkts)
+    corners_df = pd.DataFrame({'ll_x':xs[:n], 'll_y':ys[:n], 'ur_x':xs[n:], 'ur_y':ys[n:]}, index=df.index)
+
+    for corner in ['ll', 'ur']:
+        corners_df['template_' + corner] = [str(float(x)) + ' ' + str(float(y)) if ok else None
+                                            for x, y, ok in zip(corners_df[corner + '_x'], corners_df[corner + '_y'], valid)]
+
+    return corners_df
+
+def post_to_layer_group_api(conn, url, the_json, quiet=True, session=None):
     """
     post content layergroup endpoint
 
@@ -720,6 +3632,9 @@ def post_to_layer_group_api(conn, url, the_json, quiet=True):
     the_json : dict
         the dictionary that gets parsed to the 'json' parameter of the POST request
 
+    session : requests.Session, optional
+        keep-alive session to post through, see make_session()
+
     Returns
     -------
     json response from layergroup api
@@ -730,10 +3645,12 @@ def post_to_layer_group_api(conn, url, the_json, quiet=True):
 
     params = {'username':conn['username'],'api_key':conn['access_token']}
 
+    http = session or requests
+
     # post the the EODS layer group api endpoint
     if quiet:
         try:
-            response = requests.post(
+            response = http.post(
                 url,
                 params=params,
                 headers=headers,
@@ -754,7 +3671,7 @@ def post_to_layer_group_api(conn, url, the_json, quiet=True):
             print('Error caught as exception')
             print(error)
     else:
-        response = requests.post(
+        response = http.post(
             url,
             params=params,
             headers=headers,
@@ -771,7 +3688,7 @@ def post_to_layer_group_api(conn, url, the_json, quiet=True):
         
         return json.loads(response.content)
 
-def create_layer_group(conn, list_of_layers, name, abstract=None, quiet=True):
+def create_layer_group(conn, list_of_layers, name, abstract=None, quiet=True, session=None):
     """
     create a layer group 
 
@@ -796,6 +3713,9 @@ def create_layer_group(conn, list_of_layers, name, abstract=None, quiet=True):
     abstract : str, optional
         specify the abstract of the layer group
 
+    session : requests.Session, optional
+        keep-alive session to post through, see make_session()
+
     Returns
     -------
     json response from layergroup api
@@ -819,11 +3739,11 @@ def create_layer_group(conn, list_of_layers, name, abstract=None, quiet=True):
    
     the_json = {'name': name, 'abstract': abstract, 'layers': list_of_layers}
     
-    response_json = post_to_layer_group_api(conn, url, the_json, quiet=quiet)
+    response_json = post_to_layer_group_api(conn, url, the_json, quiet=quiet, session=session)
     
     return response_json
     
-def modify_layer_group(conn, list_of_layers, layergroup_id, abstract=None, quiet=True):
+def modify_layer_group(conn, list_of_layers, layergroup_id, abstract=None, quiet=True, session=None):
     """
     modify a layer group, referencing the layergroup ID and list of layers
 
@@ -848,6 +3768,9 @@ def modify_layer_group(conn, list_of_layers, layergroup_id, abstract=None, quiet
     abstract : str, optional
         specify the modified abstract of the layer group, to overwrite if required
 
+    session : requests.Session, optional
+        keep-alive session to post through, see make_session()
+
     Returns
     -------
     json response from layergroup api
@@ -868,6 +3791,408 @@ def modify_layer_group(conn, list_of_layers, layergroup_id, abstract=None, quiet
     
     the_json = {'abstract':abstract, 'layers':list_of_layers}
     
-    response_json = post_to_layer_group_api(conn, url, the_json, quiet=quiet)
+    response_json = post_to_layer_group_api(conn, url, the_json, quiet=quiet, session=session)
     
     return response_json
+
+def require_aiohttp():
+    """
+    raise if the optional aiohttp dependency of the async_* functions is missing
+    """
+
+    if aiohttp is None:
+        raise ValueError('ERROR. aiohttp is required by the async eodslib functions, install it with "pip install aiohttp", aborting ...')
+
+def make_async_session(limit=100, limit_per_host=10, headers=None):
+    """
+    create an aiohttp session for the async_* functions, must be called from inside a
+    running event loop. share one session between many async_run_wps calls so hundreds
+    of jobs can be polled and downloaded concurrently on one thread
+
+    Parameters
+    ----------
+    limit : int, optional
+        maximum number of open connections in total, default 100
+
+    limit_per_host : int, optional
+        maximum number of open connections to any single host, default 10
+
+    headers : dict, optional
+        default headers sent with every request made through the session
+
+    Returns
+    -------
+    aiohttp.ClientSession
+    
+    """
+
+    require_aiohttp()
+
+    default_headers = {'User-Agent': 'python'}
+    if headers is not None:
+        default_headers.update(headers)
+
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+
+    return aiohttp.ClientSession(connector=connector, headers=default_headers)
+
+@asynccontextmanager
+async def _async_session(session):
+    """
+    yield the given aiohttp session, or a new one that is closed on exit
+    """
+
+    if session is not None:
+        yield session
+    else:
+        session = make_async_session()
+        try:
+            yield session
+        finally:
+            await session.close()
+
+def _aiohttp_ssl(verify):
+    """
+    translate a requests style "verify" value into the aiohttp "ssl" argument
+    """
+
+    if verify is True:
+        return None
+    elif verify is False:
+        return False
+    else:
+        return ssl.create_default_context(cafile=verify)
+
+async def async_query_catalog(conn, **kwargs):
+    """
+    asyncio counterpart of query_catalog, takes the same keyword arguments and returns
+    the same (list_of_layers, df) pair without blocking the event loop on the search requests.
+    "source", "cache", "page_size" and "max_workers" behave as for query_catalog, the
+    pages after the first are fetched concurrently. stream=True is not supported
+
+    "session" is an optional aiohttp session, see make_async_session()
+    """
+
+    require_aiohttp()
+
+    if kwargs.get('stream'):
+        raise ValueError('ERROR. stream=True is not supported by async_query_catalog, aborting ...')
+
+    if 'session' not in kwargs:
+        kwargs['session'] = None
+
+    if 'verify' not in kwargs:
+        kwargs['verify'] = True
+
+    params = build_query_params(conn, kwargs)
+
+    if 'source' not in kwargs:
+        kwargs['source'] = 'remote'
+
+    loop = asyncio.get_running_loop()
+
+    # the mirror and the response cache are local files, read off the event loop
+    if kwargs['source'] == 'local':
+        return await loop.run_in_executor(None, query_local_catalog, params, kwargs)
+    elif kwargs['source'] != 'remote':
+        raise ValueError("ERROR. source must be 'remote' or 'local', aborting ...")
+
+    cache, cache_key, df = await loop.run_in_executor(None, query_cache_lookup, conn, params, kwargs)
+    if df is not None:
+        return process_query_frame(df, kwargs)
+
+    # request the first page only, the rest are fetched once total_count is known
+    limit = params['limit']
+    params['limit'] = min(kwargs.get('page_size', 1000), limit)
+
+    try:
+        async with _async_session(kwargs['session']) as session:
+
+            json_response = await async_fetch_search_page(session, conn, params, kwargs)
+
+            objects = json_response.get('objects', [])
+            wanted = min(json_response.get('meta', {}).get('total_count', 0), limit)
+
+            # step by the records the server actually returned, in case it caps the page size
+            step = len(objects)
+            offsets = list(range(params['offset'] + step, wanted, step)) if step else []
+
+            if offsets:
+                print(datetime.utcnow().isoformat() + ' :: FETCHING ' + str(len(offsets)) + ' MORE PAGES OF ' + str(step) + ' RECORDS')
+
+                semaphore = asyncio.Semaphore(kwargs.get('max_workers', 4))
+
+                async def fetch_page(offset):
+                    async with semaphore:
+                        page = await async_fetch_search_page(session, conn, dict(params, offset=offset, limit=min(step, wanted - offset)), kwargs)
+                        return page.get('objects', [])
+
+                for page in await asyncio.gather(*[fetch_page(offset) for offset in offsets]):
+                    objects.extend(page)
+
+                json_response['objects'] = objects
+
+        df = query_response_frame(json_response, kwargs)
+
+        if cache is not None and df is not None:
+            await loop.run_in_executor(None, cache.put, cache_key, df)
+
+        return process_query_frame(df, kwargs)
+
+    except aiohttp.ClientError as e:
+        print('\n' + datetime.utcnow().isoformat() + ' :: ERROR, an Exception was raised, no list returned')
+        print(e)
+        return None
+
+async def async_fetch_search_page(session, conn, params, kwargs):
+    """
+    request and decode one /api/base/search page with an aiohttp session
+    """
+
+    async with session.get(
+        conn['domain'] + '/api/base/search',
+        params=params,
+        ssl=_aiohttp_ssl(kwargs['verify']),
+        headers={'User-Agent': 'python'}
+    ) as response:
+
+        if response.status != 200:
+            raise ValueError(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = ' + str(response.status) + ' (NOT SUCCESSFUL) :: QUERY URL (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + str(response.url))
+
+        if params['offset'] == 0:
+            print(datetime.utcnow().isoformat() + ' :: RESPONSE STATUS = 200 (SUCCESS)')
+            print(datetime.utcnow().isoformat() + ' :: QUERY URL USED (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + str(response.url))
+
+        return json.loads(await response.read())
+
+async def async_run_wps(conn, config_wpsprocess, **kwargs):
+    """
+    asyncio counterpart of run_wps, takes the same arguments and returns the same
+    execution dict, awaiting between status checks instead of sleeping
+
+    "session" is an optional aiohttp session, see make_async_session(). run many jobs
+    concurrently with asyncio.gather(*[async_run_wps(conn, c, session=session) for c in configs])
+    """
+
+    require_aiohttp()
+
+    if 'output_dir' not in kwargs:
+        kwargs['output_dir'] = Path.cwd()
+
+    if 'verify' not in kwargs:
+        kwargs['verify'] = True
+
+    async with _async_session(kwargs.get('session')) as session:
+
+        kwargs['session'] = session
+        request_config = make_request_config(conn, kwargs)
+        execution_dict = resume_or_none(request_config, config_wpsprocess, kwargs)
+
+        if execution_dict is None:
+            execution_dict = await asyncio.get_running_loop().run_in_executor(None, cache_lookup, request_config, config_wpsprocess, kwargs['output_dir'])
+
+        if execution_dict is not None and execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL':
+            return finalise_execution_dict(execution_dict, make_output_dir(kwargs['output_dir']))
+
+        try:
+            if execution_dict is None:
+                execution_dict = await async_submit_wps_queue(request_config, config_wpsprocess)
+        except Exception as error:
+            print(error.args)
+            print('The WPS submission has failed')
+        else:
+
+            path_output = make_output_dir(kwargs['output_dir'])
+
+            polling = get_polling(config_wpsprocess, kwargs)
+
+            attempt = 0
+            while True:
+
+                execution_dict = await async_poll_api_status(execution_dict, request_config, path_output)
+                attempt += 1
+
+                if execution_dict['continue_process']:
+                    await asyncio.sleep(polling(execution_dict, attempt))
+                else:
+                    break
+
+            if execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL':
+                execution_dict = await asyncio.get_running_loop().run_in_executor(None, process_and_record, request_config, execution_dict)
+
+            return finalise_execution_dict(execution_dict, path_output)
+
+async def async_submit_wps_queue(request_config, config_wpsprocess):
+    """
+    asyncio counterpart of submit_wps_queue
+    """
+
+    print('\n\t\t### ' + datetime.utcnow().isoformat() + ' :: WPS SUBMISSION :: lyr=' + config_wpsprocess['xml_config']['template_layer_name'])
+
+    try:
+        payload = mod_the_xml(config_wpsprocess)
+
+        async with request_config['session'].post(
+            request_config['wps_server'],
+            params={'access_token':request_config['access_token'],'SERVICE':'WPS','VERSION':'1.0.0','REQUEST':'EXECUTE'},
+            data=payload,
+            headers=request_config['headers'],
+            ssl=_aiohttp_ssl(request_config['verify'])) as response:
+
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError as e:
+                # response status was not 200
+                raise ValueError('non-200 response, additional info (MAY CONTAIN SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE)' , str(e))
+
+            return parse_submission_response(await response.text(), request_config, config_wpsprocess)
+
+    except ValueError as error:
+
+        print(datetime.utcnow().isoformat() + ' :: WPS submission failed :: check log for errors (CONTAINS SENSITIVE AUTHENTICATION DETAILS, DO NOT SHARE) = ' + str(error.args))
+
+        return error
+
+async def async_poll_api_status(execution_dict, request_config, path_output, download=True):
+    """
+    asyncio counterpart of poll_api_status
+    """
+
+    try:
+
+        if execution_dict['continue_process']:
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: CHECKING STATUS')
+
+            params = {
+                'access_token':request_config['access_token'],
+                'SERVICE':'WPS',
+                'VERSION':'1.0.0',
+                'REQUEST':'GetExecutionstatus',
+                'EXECUTIONID':execution_dict['job_id'],
+                }
+
+            async with request_config['session'].get(
+                request_config['wps_server'],
+                params=params,
+                headers=request_config['headers'],
+                ssl=_aiohttp_ssl(request_config['verify'])
+                ) as response:
+
+                d = xmltodict.parse(await response.read())
+
+            execution_dict = parse_execution_status(d, execution_dict, request_config)
+
+            if download and execution_dict.get('job_status') == 'READY-TO-DOWNLOAD':
+                execution_dict = await async_download(request_config, execution_dict, path_output)
+
+        return execution_dict
+
+    except Exception as error:
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: UNKNOWN EXCEPTION')
+
+        execution_dict.update({
+            'job_status':'UNKNOWN-GENERAL-ERROR',
+            'continue_process':False,
+            'message':'UNKNOWN GENERAL ERROR ENCOUNTERED WHEN CHECKING STATUS OF WPS JOB. ERROR MESSAGE:' + str(error),
+            'timestamp_job_end':datetime.utcnow(),
+            })
+        record_state(request_config, execution_dict)
+        return execution_dict
+
+async def async_download(request_config, execution_dict, path_output):
+    """
+    asyncio counterpart of download_wps_result_single, streams the result to disk
+    with file writes handed to the default executor and resumes failed attempts
+    with HTTP Range requests in the same way
+    """
+
+    file_extension, filename_stub, local_file_name = make_download_path(execution_dict, path_output)
+    part_file = local_file_name.with_name(local_file_name.name + '.part')
+    retries = request_config.get('download_retries', 3)
+    validator = None
+    loop = asyncio.get_running_loop()
+
+    for i in range(1, retries + 1):
+
+        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD START : TRY ' + str(i) + ' of ' + str(retries))
+
+        try:
+
+            if i == 1 and part_file.exists():
+                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DISCARDING PARTIAL DOWNLOAD LEFT BY AN EARLIER RUN')
+                part_file.unlink()
+
+            headers, offset = make_range_headers(request_config, part_file, execution_dict, validator)
+
+            async with request_config['session'].get(
+                execution_dict['dl_url'],
+                headers=headers,
+                ssl=_aiohttp_ssl(request_config['verify'])) as response:
+
+                if offset and response.status == 416:
+
+                    # the part file is complete only if it holds all N bytes of "Content-Range: bytes */N"
+                    total_size = parse_content_range(response.headers.get('Content-Range'))[2]
+                    if total_size != offset:
+                        part_file.unlink()
+                        raise ValueError('range not satisfiable for ' + str(offset) + ' bytes on disk, result is ' + str(total_size) + ' bytes, restarting download')
+
+                else:
+
+                    if offset and response.status == 206 and parse_content_range(response.headers.get('Content-Range'))[0] != offset:
+                        part_file.unlink()
+                        raise ValueError('range response does not start at byte ' + str(offset) + ', restarting download')
+
+                    if offset and response.status != 206:
+                        print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: SERVER IGNORED RANGE REQUEST, RESTARTING DOWNLOAD')
+                        offset = 0
+
+                    response.raise_for_status()
+
+                    if not offset:
+                        validator = range_validator(response)
+
+                    with open(part_file, 'ab' if offset else 'wb') as f:
+                        async for chunk in response.content.iter_chunked(8192*1024):
+                            await loop.run_in_executor(None, f.write, chunk)
+
+            os.replace(part_file, local_file_name)
+
+            print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: DOWNLOAD COMPLETE ON TRY ' + str(i))
+
+            execution_dict.update({
+                'job_status':'DOWNLOAD-SUCCESSFUL',
+                'continue_process':False,
+                'dl_file':local_file_name,
+                'file_extension':file_extension,
+                'filename_stub':filename_stub,
+                'timestamp_dl_end':datetime.utcnow(),
+                'timestamp_job_end':datetime.utcnow(),
+                'download_try':i
+                })
+
+            record_state(request_config, execution_dict)
+
+            return execution_dict
+
+        except Exception as error:
+
+            if i == retries:
+
+                execution_dict.update({
+                    'job_status':'DOWNLOAD-FAILED',
+                    'continue_process':False,
+                    'message':str(error),
+                    'timestamp_job_end':datetime.utcnow(),
+                    'download_try': i,
+                    })
+
+                print('\t\t### ' + datetime.utcnow().isoformat() + ' :: job : ' + execution_dict['job_id'] + ' :: STATUS : ' + execution_dict['job_status'] + ' :: MESSAGE :' + execution_dict['message'])
+
+                record_state(request_config, execution_dict)
+
+                return execution_dict
+
+            await asyncio.sleep(download_backoff(request_config, i))
@@ -7,9 +7,15 @@ import responses
 import shapely
 import logging
 import pandas as pd
+from pandas import json_normalize
 import numpy as np
+import asyncio
+import json
+import time
+import threading
 from datetime import datetime
-from zipfile import ZipInfo
+from zipfile import ZipFile
+from urllib.parse import urlparse, parse_qsl
 
 def return_first_arg_side_effect_fn(*args, **kwargs):
     return args[0]
@@ -331,6 +337,35 @@ class TestGetBboxCornersFromWkt():
         assert error.value.args[0] == 'Could not create geometry because of errors while reading input.'
 
 
+    def test_transformer_built_once_per_epsg_pair(self, mocker):
+        mocker.patch('eodslib._transformers', eodslib.threading.local())
+        from_crs = mocker.spy(eodslib.pyproj.Transformer, 'from_crs')
+        test_polygon = 'POLYGON((-2.4591467333 51.7495497809,-2.4591467333 51.8218717504,-2.34253580452 51.8218717504,-2.34253580452 51.7495497809,-2.4591467333 51.7495497809))'
+
+        for _ in range(3):
+            eodslib.get_bbox_corners_from_wkt(test_polygon, 27700)
+        eodslib.get_bbox_corners_from_wkt(test_polygon, 3857)
+
+        assert from_crs.call_count == 2
+
+
+class TestBboxCornersForFrame():
+    def test_matches_get_bbox_corners_from_wkt(self):
+        wkts = ['POLYGON((-2.4591467333 51.7495497809,-2.4591467333 51.8218717504,-2.34253580452 51.8218717504,-2.34253580452 51.7495497809,-2.4591467333 51.7495497809))',
+                None, 'POLYGON((-1.18 50.94, -1.18 50.86, -1.06 50.86, -1.06 50.94, -1.18 50.94))']
+        df = pd.DataFrame({'alternate': ['geonode:a', 'geonode:b', 'geonode:c'], 'csw_wkt_geometry': wkts}, index=[5, 6, 7])
+
+        corners_df = eodslib.bbox_corners_for_frame(df, 27700)
+
+        assert corners_df.index.tolist() == [5, 6, 7]
+        for i in [5, 7]:
+            ll, ur = eodslib.get_bbox_corners_from_wkt(df['csw_wkt_geometry'][i], 27700)
+            assert (corners_df['ll_x'][i], corners_df['ll_y'][i], corners_df['ur_x'][i], corners_df['ur_y'][i]) == (ll.x, ll.y, ur.x, ur.y)
+            assert corners_df['template_ll'][i] == str(ll.x) + ' ' + str(ll.y)
+            assert corners_df['template_ur'][i] == str(ur.x) + ' ' + str(ur.y)
+        assert corners_df.loc[6, ['ll_x', 'll_y', 'ur_x', 'ur_y']].isna().all()
+        assert pd.isna(corners_df['template_ll'][6])
+
 class TestFindMinimumCloudList():
     @pytest.fixture(autouse=True, scope='function')
     def class_setup(self, mocker):
@@ -339,6 +374,7 @@ class TestFindMinimumCloudList():
         self.mock_read_csv = mocker.patch('eodslib.pd.read_csv')
         self.mock_read_csv.return_value = pd.DataFrame(
             data={'gran-orb': ['T12ABC_ORB034']})
+        mocker.patch('eodslib._safe_granule_orbits', None)
 
     def test_components_and_average_less_than_full_granule_return_both_splits(self, mocker):
         # S2A_date_lat1lon2_T12ABC_ORB034_etc = 0.05, S2A_date_lat1lon2_T12ABCSPLIT1_ORB034_etc = 0.1, S2A_date_lat1lon2_T12ABC_ORB034_fullgran = 0.12
@@ -440,10 +476,35 @@ class TestFindMinimumCloudList():
         assert error.value.args[0] == 'ERROR :: safe-granule-orbit-list.txt cannot be found'
 
 
+    def test_safe_list_read_once_until_refresh(self, mocker):
+        df = pd.DataFrame({'title': ['S2A_date_lat1lon2_T12ABC_ORB034_etc'], 'alternate': ['geonode:a'], 'granule-ref': ['T12ABC'],
+                           'orbit-ref': ['ORB034'], 'split_cloud_cover': [0.5]})
+
+        eodslib.find_minimum_cloud_list(df.copy())
+        eodslib.find_minimum_cloud_list(df.copy())
+
+        assert self.mock_read_csv.call_count == 1
+
+        eodslib.load_safe_granule_orbits(refresh=True)
+
+        assert self.mock_read_csv.call_count == 2
+
+    def test_least_cloud_compares_numbers_not_strings(self, mocker):
+        self.mock_read_csv.return_value = pd.DataFrame(data={'gran-orb': ['T12ABC_ORB034', 'T12ABD_ORB034']})
+        df = pd.DataFrame({'title': ['S2A_d1_lat1lon2_T12ABC_ORB034_etc', 'S2A_d2_lat1lon2_T12ABC_ORB034_etc', 'S2A_d3_lat1lon2_T12ABD_ORB034_etc', 'S2A_d4_lat1lon2_T12ABD_ORB034_etc'],
+                           'alternate': ['geonode:a', 'geonode:b', 'geonode:c', 'geonode:d'],
+                           'granule-ref': ['T12ABC', 'T12ABC', 'T12ABD', 'T12ABD'], 'orbit-ref': ['ORB034'] * 4,
+                           'split_cloud_cover': ['0.5', '1e-05', np.nan, '0.9']})
+
+        response = eodslib.find_minimum_cloud_list(df)
+
+        assert response['alternate'].tolist() == ['geonode:b', 'geonode:d']
+        assert response.index.tolist() == [0, 1]
+
 class TestQueryCatalog():
     @pytest.fixture(autouse=True, scope='function')
     def class_setup(self, mocker):
-        self.mock_get = mocker.patch('eodslib.requests.get')
+        self.mock_get = mocker.patch('eodslib.requests.Session.get')
         self.mock_get.return_value.status_code = 200
         self.mock_get.return_value.content = bytes(
             b'{"meta": {"total_count": 1}}')
@@ -624,7 +685,8 @@ class TestQueryCatalog():
 
         expected_filtered_df = pd.DataFrame({'title': "S2A_date_lat1lon2_T12ABC_ORB034_etc", "alternate": "geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc",
                                              "supplemental_information": "Data Collection Time: time\nARCSI_CLOUD_COVER: 0.12345\netc",
-                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": "0.12345"}, index=[0])
+                                             "satellite": "S2A", "acquisition_date": pd.NaT, "latlon": "lat1lon2",
+                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": 0.12345}, index=[0])
 
         expected_output_list = ["geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc"]
 
@@ -711,7 +773,8 @@ class TestQueryCatalog():
 
         expected_filtered_df = pd.DataFrame({'title': "S2A_date_lat1lon2_T12ABC_ORB034_etc", "alternate": "geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc",
                                              "supplemental_information": "Data Collection Time: time\nARCSI_CLOUD_COVER: 0.12345\netc",
-                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": "0.12345"}, index=[0])
+                                             "satellite": "S2A", "acquisition_date": pd.NaT, "latlon": "lat1lon2",
+                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": 0.12345}, index=[0])
 
         expected_output_list = ["geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc"]
 
@@ -745,7 +808,8 @@ class TestQueryCatalog():
 
         expected_filtered_df = pd.DataFrame({'title': "S2A_date_lat1lon2_T12ABC_ORB034_etc", "alternate": "geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc",
                                              "supplemental_information": "Data Collection Time: time\nARCSI_CLOUD_COVER: 0.12345\netc",
-                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": "0.12345", "split_cloud_cover": "0.12345"}, index=[0])
+                                             "satellite": "S2A", "acquisition_date": pd.NaT, "latlon": "lat1lon2",
+                                             "granule-ref": "T12ABC", "orbit-ref": "ORB034", "ARCSI_CLOUD_COVER": 0.12345, "split_cloud_cover": 0.12345}, index=[0])
 
         expected_output_list = ["geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc"]
 
@@ -787,11 +851,14 @@ class TestQueryCatalog():
                                              "supplemental_information": ["Data Collection Time: time\nARCSI_CLOUD_COVER: 0.1\netc",
                                                                           "Data Collection Time: time\nARCSI_CLOUD_COVER: 0.3\netc"],
                                              "split_granule.name": ["geonode:S2A_date_lat1lon2_T12ABCSPLIT1_ORB034_etc", "geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc"],
+                                             "satellite": ["S2A", "S2A"],
+                                             "acquisition_date": [pd.NaT, pd.NaT],
+                                             "latlon": ["lat1lon2", "lat1lon2"],
                                              "granule-ref": ["T12ABC", "T12ABCSPLIT1"],
                                              "orbit-ref": ["ORB034", "ORB034"],
-                                             "ARCSI_CLOUD_COVER": ["0.1", "0.3"],
-                                             "split_ARCSI_CLOUD_COVER": ["0.3", "0.1"],
-                                             "split_cloud_cover": ["0.2", "0.2"]
+                                             "ARCSI_CLOUD_COVER": [0.1, 0.3],
+                                             "split_ARCSI_CLOUD_COVER": [0.3, 0.1],
+                                             "split_cloud_cover": [0.2, 0.2]
                                              })
 
         expected_output_list = ["geonode:S2A_date_lat1lon2_T12ABC_ORB034_etc",
@@ -879,7 +946,8 @@ class TestRunWps():
             'wps_server': self.conn['domain'] + '/geoserver/ows',
             'access_token': self.conn['access_token'],
             'headers': {'Content-type': 'application/xml', 'User-Agent': 'python'},
-            'verify': True
+            'verify': True,
+            'session': eodslib.get_default_session(),
         }
 
         self.mock_submit_queue.assert_called_once_with(
@@ -948,7 +1016,27 @@ class TestRunWps():
 
         _ = eodslib.run_wps(self.conn, self.config_wpsprocess)
 
-        self.mock_sleep.assert_called_once_with(15)
+        self.mock_sleep.assert_called_once()
+        assert eodslib.POLLING_DEFAULTS['default']['min_interval'] <= self.mock_sleep.call_args.args[0] <= eodslib.POLLING_DEFAULTS['default']['max_interval']
+
+    def test_polling_kwarg_sets_sleep_between_polls(self, mocker):
+        self.mock_submit_queue.return_value = {'job_id': '123',
+                                               'timestamp_job_start': datetime(2021, 8, 17), 'timestamp_job_end': datetime(2021, 8, 18),
+                                               'job_status': None,
+                                               'continue_process': True}
+
+        def poll_side_effect_fn(*args, **kwargs):
+            execution_dict = args[0]
+            execution_dict['polls'] = execution_dict.get('polls', 0) + 1
+            execution_dict['continue_process'] = execution_dict['polls'] < 3
+            return execution_dict
+
+        self.mock_make_output_dir.side_effect = return_first_arg_side_effect_fn
+        self.mock_poll.side_effect = poll_side_effect_fn
+
+        _ = eodslib.run_wps(self.conn, self.config_wpsprocess, polling=lambda execution_dict, attempt: attempt * 10)
+
+        assert self.mock_sleep.call_args_list == [mocker.call(10), mocker.call(20)]
 
     def test_job_status_download_successful_process_wps_downloaded_files_called_once(self, mocker):
         self.mock_submit_queue = mocker.patch('eodslib.submit_wps_queue')
@@ -1272,6 +1360,126 @@ class TestPollApiStatus():
         self.mock_xml_dict_parse.assert_called_once_with('get content')
 
 
+    def test_process_started_percent_completed_recorded(self, mocker):
+        self.mock_xml_dict_parse = mocker.patch('eodslib.xmltodict.parse')
+        self.mock_xml_dict_parse.return_value = {
+            'wps:ExecuteResponse': {'wps:Status': {'wps:ProcessStarted': {'@percentCompleted': '40'}}}}
+
+        execution_dict = {'job_id': '123', 'continue_process': True}
+
+        execution_dict = eodslib.poll_api_status(
+            execution_dict, self.request_config, None)
+
+        assert execution_dict == {'job_id': '123', 'continue_process': True,
+                                  'job_status': 'OUTSTANDING', 'percent_completed': 40.0,
+                                  'timestamp_process_started': datetime(2021, 8, 17)}
+
+    @pytest.mark.parametrize('creation_time, expected', [
+        ('2021-08-16T23:40:00.000Z', datetime(2021, 8, 16, 23, 40)),
+        ('2021-08-17T00:40:00+01:00', datetime(2021, 8, 16, 23, 40)),
+        ('not a time', datetime(2021, 8, 17)),
+    ])
+    def test_process_started_taken_from_creation_time(self, mocker, creation_time, expected):
+        self.mock_datetime.fromisoformat.side_effect = datetime.fromisoformat
+        self.mock_xml_dict_parse = mocker.patch('eodslib.xmltodict.parse')
+        self.mock_xml_dict_parse.return_value = {
+            'wps:ExecuteResponse': {'wps:Status': {'@creationTime': creation_time,
+                                                   'wps:ProcessStarted': {'@percentCompleted': '40'}}}}
+
+        execution_dict = eodslib.poll_api_status(
+            {'job_id': '123', 'continue_process': True}, self.request_config, None)
+
+        assert execution_dict['timestamp_process_started'] == expected
+
+    def test_process_started_parsed_from_status_xml(self, mocker):
+        self.mock_datetime.fromisoformat.side_effect = datetime.fromisoformat
+        self.mock_get.return_value.content = bytes(
+            b'<?xml version="1.0" encoding="UTF-8"?><wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0" statusLocation="x"><wps:Status creationTime="2021-08-16T23:40:00.000Z"><wps:ProcessStarted percentCompleted="40"/></wps:Status></wps:ExecuteResponse>'
+        )
+
+        execution_dict = eodslib.poll_api_status(
+            {'job_id': '123', 'continue_process': True}, self.request_config, None)
+
+        assert execution_dict['timestamp_process_started'] == datetime(2021, 8, 16, 23, 40)
+        assert execution_dict['percent_completed'] == 40.0
+
+    def test_download_false_leaves_job_ready_to_download(self, mocker):
+        self.mock_get.return_value.content = bytes(
+            b'<?xml version="1.0" encoding="UTF-8"?><wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0"><wps:Status><wps:ProcessSucceeded></wps:ProcessSucceeded></wps:Status><wps:ProcessOutputs><wps:Output><wps:Reference href="href" mimeType="mime"/></wps:Output></wps:ProcessOutputs></wps:ExecuteResponse>'
+        )
+
+        execution_dict = eodslib.poll_api_status(
+            {'job_id': '123', 'continue_process': True}, self.request_config, None, download=False)
+
+        assert execution_dict['job_status'] == 'READY-TO-DOWNLOAD'
+        assert execution_dict['continue_process']
+        self.mock_download_single.assert_not_called()
+
+
+class TestBackoffPolling():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        self.mock_datetime = mocker.patch('eodslib.datetime')
+        self.mock_datetime.utcnow.return_value = datetime(2021, 8, 17, 0, 1, 0)
+
+    def test_backoff_grows_exponentially_without_progress(self):
+        polling = eodslib.BackoffPolling(min_interval=2, max_interval=100, factor=2, jitter=0)
+
+        assert [polling({}, attempt) for attempt in [1, 2, 3, 4]] == [2, 4, 8, 16]
+
+    def test_backoff_capped_at_max_interval(self):
+        polling = eodslib.BackoffPolling(min_interval=2, max_interval=10, factor=2, jitter=0)
+
+        assert polling({}, 10) == 10
+
+    def test_jitter_stays_within_bounds(self):
+        polling = eodslib.BackoffPolling(min_interval=2, max_interval=100, factor=2, jitter=0.5)
+
+        intervals = [polling({}, 3) for _ in range(50)]
+
+        assert all(4 <= i <= 12 for i in intervals)
+
+    def test_progress_predicts_remaining_time(self):
+        polling = eodslib.BackoffPolling(min_interval=1, max_interval=600, jitter=0)
+
+        # 60 seconds since the process started and 25% done leaves 180 seconds
+        execution_dict = {'percent_completed': 25.0, 'timestamp_process_started': datetime(2021, 8, 17, 0, 0, 0)}
+
+        assert polling(execution_dict, 1) == 180
+
+    def test_progress_prediction_clamped_to_min_interval(self):
+        polling = eodslib.BackoffPolling(min_interval=5, max_interval=600, jitter=0)
+
+        execution_dict = {'percent_completed': 99.0, 'timestamp_process_started': datetime(2021, 8, 17, 0, 0, 0)}
+
+        assert polling(execution_dict, 1) == 5
+
+    def test_invalid_intervals_trigger_exception(self):
+        with pytest.raises(ValueError):
+            eodslib.BackoffPolling(min_interval=10, max_interval=5)
+
+    def test_get_polling_uses_template_defaults(self):
+        polling = eodslib.get_polling({'template_xml': 'gsdownload_template.xml'}, {})
+
+        assert (polling.min_interval, polling.max_interval) == (
+            eodslib.POLLING_DEFAULTS['gsdownload_template.xml']['min_interval'],
+            eodslib.POLLING_DEFAULTS['gsdownload_template.xml']['max_interval'])
+
+    @pytest.mark.parametrize('template_xml', ['gsdownload-EODS-small-s2.xml', 'gsdownload-EODS-large-s1.xml'])
+    def test_shipped_gsdownload_templates_have_defaults(self, template_xml):
+        polling = eodslib.get_polling({'template_xml': template_xml}, {})
+
+        assert (polling.min_interval, polling.max_interval) == (
+            eodslib.POLLING_DEFAULTS[template_xml]['min_interval'],
+            eodslib.POLLING_DEFAULTS[template_xml]['max_interval'])
+        assert (Path(__file__).parent.parent / 'xml' / template_xml).exists()
+
+    def test_get_polling_returns_kwarg_strategy(self):
+        strategy = lambda execution_dict, attempt: 1
+
+        assert eodslib.get_polling({'template_xml': 'gsdownload_template.xml'}, {'polling': strategy}) is strategy
+
+
 class TestDownloadWpsResultSingle():
     @pytest.fixture(autouse=True, scope='function')
     def class_setup(self, mocker):
@@ -1287,6 +1495,10 @@ class TestDownloadWpsResultSingle():
         self.mock_open = mocker.patch(
             'builtins.open', mocker.mock_open())
 
+        self.mock_replace = mocker.patch('eodslib.os.replace')
+
+        self.mock_sleep = mocker.patch('eodslib.time.sleep')
+
         self.execution_dict = {'job_id': '123', 'layer_name': 'geonode:layername',
                           'mime_type': '/mime',
                           'dl_url': ''}
@@ -1323,7 +1535,7 @@ class TestDownloadWpsResultSingle():
         )
 
         calls = [
-            mocker.call(Path.cwd() / 'layername' / 'layername.mime', 'wb'),
+            mocker.call(Path.cwd() / 'layername' / 'layername.mime.part', 'wb'),
             mocker.call().__enter__(),
             mocker.call().write('te'),
             mocker.call().write('st'),
@@ -1388,7 +1600,282 @@ class TestDownloadWpsResultSingle():
 
         self.mock_get.assert_called_once_with('', headers='header', verify='verify', stream=True)
 
+    def test_successful_get_part_file_renamed_to_local_file(self, mocker):
+        eodslib.download_wps_result_single(
+            self.request_config, self.execution_dict, Path.cwd()
+        )
+
+        self.mock_replace.assert_called_once_with(
+            Path.cwd() / 'layername' / 'layername.mime.part', Path.cwd() / 'layername' / 'layername.mime')
+
+    def test_failed_get_backoff_doubles_between_attempts(self, mocker):
+        self.mock_get.side_effect = Exception('Error message')
+        self.request_config.update({'download_retries': 4, 'download_backoff': 2})
+
+        execution_dict = eodslib.download_wps_result_single(
+            self.request_config, self.execution_dict, Path.cwd()
+        )
+
+        assert self.mock_sleep.call_args_list == [mocker.call(2), mocker.call(4), mocker.call(8)]
+        assert execution_dict['download_try'] == 4
+
+
+class TestDownloadWpsResultSingleResume():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker, tmp_path):
+        mocker.patch('eodslib.time.sleep')
+
+        self.url = 'https://domain/dl?id=1'
+        self.content = bytes(range(256)) * 40
+        self.execution_dict = {'job_id': '123', 'layer_name': 'geonode:layername',
+                               'mime_type': 'application/zip', 'dl_url': self.url}
+        self.request_config = {'headers': {'User-Agent': 'python'}, 'verify': True}
+        self.path_output = tmp_path
+        self.part_file = tmp_path / 'layername' / 'layername.zip.part'
+        self.part_file.parent.mkdir()
+
+    def mock_response(self, mocker, status_code, body=None, headers=None, drop_after=None):
+        response = mocker.MagicMock()
+        response.__enter__.return_value.status_code = status_code
+        response.__enter__.return_value.headers = headers or {}
+
+        def stream(chunk_size):
+            yield body[:drop_after]
+            if drop_after is not None:
+                raise requests.exceptions.ChunkedEncodingError('connection dropped')
+
+        response.__enter__.return_value.iter_content.side_effect = stream
+        return response
+
+    @responses.activate
+    def test_part_file_of_earlier_run_discarded(self):
+        self.part_file.write_bytes(b'bytes of another job')
+        responses.add(responses.GET, self.url, status=200, body=self.content)
+
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert 'Range' not in responses.calls[0].request.headers
+        assert execution_dict['dl_file'].read_bytes() == self.content
+        assert not self.part_file.exists()
+
+    def test_failed_attempt_resumes_from_bytes_written(self, mocker):
+        first = self.mock_response(mocker, 200, self.content, {'ETag': '"v1"'}, drop_after=500)
+        second = self.mock_response(mocker, 206, self.content[500:], {'Content-Range': 'bytes 500-10239/10240'})
+
+        mock_get = mocker.patch('eodslib.requests.get')
+        mock_get.side_effect = [first, second]
+
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert mock_get.call_args_list[1].kwargs['headers']['Range'] == 'bytes=500-'
+        assert mock_get.call_args_list[1].kwargs['headers']['If-Range'] == '"v1"'
+        assert execution_dict['download_try'] == 2
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    def test_range_ignored_by_server_restarts_download(self, mocker):
+        first = self.mock_response(mocker, 200, self.content, drop_after=500)
+        second = self.mock_response(mocker, 200, self.content)
+
+        mocker.patch('eodslib.requests.get', side_effect=[first, second])
+
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    def test_range_response_at_wrong_offset_restarts_download(self, mocker):
+        first = self.mock_response(mocker, 200, self.content, drop_after=500)
+        second = self.mock_response(mocker, 206, self.content[100:], {'Content-Range': 'bytes 100-10239/10240'})
+        third = self.mock_response(mocker, 200, self.content)
+
+        mock_get = mocker.patch('eodslib.requests.get', side_effect=[first, second, third])
+
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert 'Range' not in mock_get.call_args_list[2].kwargs['headers']
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    def test_range_not_satisfiable_with_whole_result_on_disk_completes(self, mocker):
+        first = self.mock_response(mocker, 200, self.content, drop_after=len(self.content))
+        second = self.mock_response(mocker, 416, headers={'Content-Range': 'bytes */10240'})
+
+        mocker.patch('eodslib.requests.get', side_effect=[first, second])
+
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    def test_range_not_satisfiable_with_size_mismatch_restarts_download(self, mocker):
+        first = self.mock_response(mocker, 200, self.content, drop_after=500)
+        second = self.mock_response(mocker, 416, headers={'Content-Range': 'bytes */10240'})
+        third = self.mock_response(mocker, 200, self.content)
+
+        mock_get = mocker.patch('eodslib.requests.get', side_effect=[first, second, third])
 
+        execution_dict = eodslib.download_wps_result_single(self.request_config, self.execution_dict, self.path_output)
+
+        assert 'Range' not in mock_get.call_args_list[2].kwargs['headers']
+        assert execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+
+class TestDownloadWpsResultSegmented():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker, tmp_path):
+        mocker.patch('eodslib.time.sleep')
+
+        self.url = 'https://domain/dl?id=1'
+        self.content = bytes(range(256)) * 40
+        self.execution_dict = {'job_id': '123', 'layer_name': 'geonode:layername',
+                               'mime_type': 'application/zip', 'dl_url': self.url}
+        self.request_config = {'headers': {'User-Agent': 'python'}, 'verify': True,
+                               'segmented_download': True, 'max_segments': 4, 'min_segment_size': 1000}
+        self.path_output = tmp_path
+        self.ranges = []
+
+    def ranged_callback(self, request):
+        self.ranges.append(request.headers['Range'])
+        start, end = request.headers['Range'].split('=')[1].split('-')
+        start, end = int(start), int(end)
+        headers = {'Content-Range': 'bytes ' + str(start) + '-' + str(end) + '/' + str(len(self.content))}
+        return (206, headers, self.content[start:end + 1])
+
+    @responses.activate
+    def test_segments_reassembled_in_order(self):
+        responses.add_callback(responses.GET, self.url, callback=self.ranged_callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert execution_dict['download_segments'] == 4
+        assert execution_dict['dl_file'].read_bytes() == self.content
+        assert sorted(self.ranges[1:]) == sorted(['bytes=0-2559', 'bytes=2560-5119', 'bytes=5120-7679', 'bytes=7680-10239'])
+
+    @responses.activate
+    def test_segment_count_follows_content_length(self):
+        self.request_config['min_segment_size'] = 4000
+        responses.add_callback(responses.GET, self.url, callback=self.ranged_callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['download_segments'] == 3
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    @responses.activate
+    def test_no_range_support_falls_back_to_single_stream(self, mocker):
+        responses.add(responses.GET, self.url, status=200, body=self.content)
+        spy = mocker.spy(eodslib, 'download_wps_result_single')
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        spy.assert_called_once()
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    @responses.activate
+    def test_small_result_falls_back_to_single_stream(self, mocker):
+        self.request_config['min_segment_size'] = 6000
+        responses.add_callback(responses.GET, self.url, callback=self.ranged_callback)
+        spy = mocker.spy(eodslib, 'download_wps_result_single')
+
+        eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        spy.assert_called_once()
+
+    @responses.activate
+    def test_failed_segment_retried_alone(self):
+        failed = []
+
+        def flaky_callback(request):
+            if request.headers['Range'] == 'bytes=2560-5119' and not failed:
+                failed.append(True)
+                return (503, {}, b'')
+            return self.ranged_callback(request)
+
+        responses.add_callback(responses.GET, self.url, callback=flaky_callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert execution_dict['dl_file'].read_bytes() == self.content
+        assert self.ranges.count('bytes=0-2559') == 1
+        assert self.ranges.count('bytes=2560-5119') == 1
+
+    @responses.activate
+    def test_segment_failing_every_retry_fails_download(self):
+        def broken_callback(request):
+            if request.headers['Range'] == 'bytes=0-0':
+                return self.ranged_callback(request)
+            return (503, {}, b'')
+
+        responses.add_callback(responses.GET, self.url, callback=broken_callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-FAILED'
+        assert not (self.path_output / 'layername' / 'layername.zip').exists()
+
+
+    @responses.activate
+    def test_failed_download_removes_preallocated_part_file(self):
+        def broken_callback(request):
+            if request.headers['Range'] in ['bytes=0-0', 'bytes=0-2559']:
+                return self.ranged_callback(request)
+            return (503, {}, b'')
+
+        responses.add_callback(responses.GET, self.url, callback=broken_callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-FAILED'
+        assert not (self.path_output / 'layername' / 'layername.zip.part').exists()
+
+        # a later single stream attempt starts from scratch rather than "resuming" the zeros
+        responses.replace(responses.GET, self.url, body=self.content)
+        self.request_config['segmented_download'] = False
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['dl_file'].read_bytes() == self.content
+
+    @responses.activate
+    def test_first_failed_segment_stops_the_rest(self):
+        others = []
+
+        def callback(request):
+            if request.headers['Range'] == 'bytes=0-0':
+                return self.ranged_callback(request)
+            if request.headers['Range'] != 'bytes=0-2559':
+                others.append(request.headers['Range'])
+                # time.sleep is patched out in this class
+                threading.Event().wait(0.3)
+            return (503, {}, b'')
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-FAILED'
+        # the slow segments give up after at most their first request instead of retrying 3 times each
+        assert len(others) <= 3
+
+    @pytest.mark.parametrize('status, content_range', [(200, None), (206, 'bytes 0-2559/10240')])
+    @responses.activate
+    def test_response_not_at_requested_offset_fails_segment(self, status, content_range):
+        self.request_config['download_retries'] = 1
+
+        def callback(request):
+            if request.headers['Range'] in ['bytes=0-0', 'bytes=0-2559']:
+                return self.ranged_callback(request)
+            # full body, or the first range again, for every other segment
+            headers = {'Content-Range': content_range} if content_range else {}
+            return (status, headers, self.content if status == 200 else self.content[:2560])
+
+        responses.add_callback(responses.GET, self.url, callback=callback)
+
+        execution_dict = eodslib.download_wps_result(self.request_config, self.execution_dict, self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-FAILED'
+        assert not (self.path_output / 'layername' / 'layername.zip').exists()
 
 class TestProcessWpsDownloadedFiles():
     # real zip path manip
@@ -1414,25 +1901,12 @@ class TestProcessWpsDownloadedFiles():
     # layername # filename_stub
     # source/layername.txt # final path
 
-    class zipmock():
-            def __init__(self,filename):
-                info = ZipInfo(filename=filename)
-                info.file_size = 1
-                info.compress_size = 1
-                self.filelist = [info]
-
-            def extractall(self, _):
-                return None
-
-            def close(self):
-                return None
-    
     @pytest.fixture(autouse=True, scope='function')
     def class_setup(self, mocker):
         self.mock_datetime = mocker.patch('eodslib.datetime')
         self.mock_datetime.utcnow.return_value = datetime(2021, 8, 17)
 
-        self.mock_zip = mocker.patch('eodslib.ZipFile')
+        self.mock_extract = mocker.patch('eodslib.extract_wps_zip')
 
         self.mock_unlink = mocker.patch.object(Path, 'unlink')
         self.mock_replace = mocker.patch.object(Path, 'replace')
@@ -1442,8 +1916,6 @@ class TestProcessWpsDownloadedFiles():
         self.mock_rmdir = mocker.patch.object(Path, 'rmdir')
         
     def test_successful_get_zip_file_return_correct_execution_dict(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.tiff')
-
         execution_dict = {'job_id': '123',
                           'dl_file': Path('source/parent/filename.zip'),
                           'filename_stub': 'layername'}
@@ -1477,53 +1949,16 @@ class TestProcessWpsDownloadedFiles():
 
         assert execution_dict == expected_execution_dict
 
-    def test_successful_get_zip_file_sld_f_path_unlinked(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.sld')
-
-        execution_dict = {'job_id': '123',
-                          'dl_file': Path('source/parent/filename.zip'),
-                          'filename_stub': 'layername'}
-
-        eodslib.process_wps_downloaded_files(execution_dict)
-
-        assert self.mock_unlink.call_count == 2
-
-    def test_successful_get_zip_file_sld_f_path_not_replaced(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.sld')
-
-        execution_dict = {'job_id': '123',
-                          'dl_file': Path('source/parent/filename.zip'),
-                          'filename_stub': 'layername'}
-
-        eodslib.process_wps_downloaded_files(execution_dict)
-
-        self.mock_replace.assert_not_called()
-
-    def test_successful_get_zip_file_sld_f_path_not_renamed(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.sld')
-
-        execution_dict = {'job_id': '123',
-                          'dl_file': Path('source/parent/filename.zip'),
-                          'filename_stub': 'layername'}
-
-        eodslib.process_wps_downloaded_files(execution_dict)
-
-        self.mock_rename.assert_not_called()
-
-    def test_successful_get_zip_file_not_sld_f_path_correctly_replaced(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.txt')
-
+    def test_successful_get_zip_file_extracted_to_final_names(self, mocker):
         execution_dict = {'job_id': '123',
                           'dl_file': Path('source/parent/filename.zip'),
                           'filename_stub': 'layername'}
 
         eodslib.process_wps_downloaded_files(execution_dict)
 
-        self.mock_replace.assert_called_once_with(Path('source/layername.txt'))
-
-    def test_successful_get_zip_file_not_sld_f_path_not_unlinked(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.txt')
+        self.mock_extract.assert_called_once_with(Path('source/parent/filename.zip'), Path('source'), 'layername')
 
+    def test_successful_get_zip_file_only_zip_unlinked(self, mocker):
         execution_dict = {'job_id': '123',
                           'dl_file': Path('source/parent/filename.zip'),
                           'filename_stub': 'layername'}
@@ -1531,10 +1966,9 @@ class TestProcessWpsDownloadedFiles():
         eodslib.process_wps_downloaded_files(execution_dict)
 
         assert self.mock_unlink.call_count == 1
+        self.mock_replace.assert_not_called()
 
-    def test_successful_get_zip_file_not_sld_source_path_not_renamed(self, mocker):
-        self.mock_zip.return_value = self.zipmock('alphanumstr.txt')
-
+    def test_successful_get_zip_file_source_path_not_renamed(self, mocker):
         execution_dict = {'job_id': '123',
                           'dl_file': Path('source/parent/filename.zip'),
                           'filename_stub': 'layername'}
@@ -1559,7 +1993,7 @@ class TestProcessWpsDownloadedFiles():
 
         eodslib.process_wps_downloaded_files(execution_dict)
 
-        self.mock_zip.assert_not_called()
+        self.mock_extract.assert_not_called()
 
     def test_successful_get_source_file_parent_is_dir_parent_is_rm(self, mocker):
         self.mock_is_dir.return_value = True
@@ -1584,6 +2018,54 @@ class TestProcessWpsDownloadedFiles():
         self.mock_rmdir.assert_not_called()
         
 
+
+class TestExtractWpsZip():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, tmp_path):
+        self.path_output = tmp_path
+        self.zip_file = tmp_path / 'layername' / 'layername.zip'
+        self.zip_file.parent.mkdir()
+
+    def make_zip(self, members):
+        with ZipFile(self.zip_file, 'w') as zip_ref:
+            for name, data in members.items():
+                zip_ref.writestr(name, data)
+
+    def test_members_written_with_filename_stub(self):
+        self.make_zip({'ef5b64d1.tiff': b'raster bytes'})
+
+        extracted = eodslib.extract_wps_zip(self.zip_file, self.path_output, 'layername')
+
+        assert extracted == [self.path_output / 'layername.tiff']
+        assert (self.path_output / 'layername.tiff').read_bytes() == b'raster bytes'
+        assert not (self.path_output / 'ef5b64d1.tiff').exists()
+
+    def test_sld_members_not_written(self):
+        self.make_zip({'ef5b64d1.tiff': b'raster bytes', 'ef5b64d1.SLD': b'<sld/>'})
+
+        extracted = eodslib.extract_wps_zip(self.zip_file, self.path_output, 'layername')
+
+        assert extracted == [self.path_output / 'layername.tiff']
+        assert sorted(p.name for p in self.path_output.iterdir()) == ['layername', 'layername.tiff']
+
+    def test_directory_entries_skipped(self):
+        self.make_zip({'subdir/': b'', 'subdir/ef5b64d1.tiff': b'raster bytes'})
+
+        extracted = eodslib.extract_wps_zip(self.zip_file, self.path_output, 'layername')
+
+        assert extracted == [self.path_output / 'layername.tiff']
+        assert not (self.path_output / 'subdir').exists()
+
+    def test_process_downloaded_zip_end_to_end(self):
+        self.make_zip({'ef5b64d1.tiff': b'raster bytes', 'ef5b64d1.sld': b'<sld/>'})
+        execution_dict = {'job_id': '123', 'dl_file': self.zip_file, 'filename_stub': 'layername'}
+
+        execution_dict = eodslib.process_wps_downloaded_files(execution_dict)
+
+        assert execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL'
+        assert [p.name for p in self.path_output.iterdir()] == ['layername.tiff']
+
+
 class TestOutputLog():
     def test_successful_get_return_correct_execution_dict(self, mocker):
         self.mock_datetime = mocker.patch('eodslib.datetime')
@@ -1596,3 +2078,1474 @@ class TestOutputLog():
         eodslib.output_log(list_of_result)
 
         self.mock_to_csv.assert_called_once_with(Path.cwd(), index_label='num')
+
+
+class TestMakeSession():
+    def test_pool_settings_applied_to_mounted_adapters(self):
+        session = eodslib.make_session(pool_connections=3, pool_maxsize=7, pool_block=True)
+
+        adapter = session.get_adapter('https://domain')
+
+        assert (adapter._pool_connections, adapter._pool_maxsize, adapter._pool_block) == (3, 7, True)
+        assert session.get_adapter('http://domain') is adapter
+
+    def test_default_headers_and_verify_set_on_session(self):
+        session = eodslib.make_session(headers={'X-Test': 'a'}, verify='cert.file')
+
+        assert session.headers['X-Test'] == 'a'
+        assert session.headers['User-Agent'] == 'python'
+        assert session.verify == 'cert.file'
+
+    def test_default_session_created_once(self):
+        assert eodslib.get_default_session() is eodslib.get_default_session()
+
+    def test_query_catalog_uses_given_session(self, mocker):
+        mocker.patch('eodslib.make_output_dir')
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+        session = mocker.MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.url = 'testurl'
+        session.get.return_value.content = bytes(
+            b'{"meta": {"total_count": 1}, "objects": [{"alternate":"geonode:layername"}]}')
+
+        conn = {'domain': 'domainname', 'username': 'username', 'access_token': 'token'}
+        output_list, _ = eodslib.query_catalog(conn, session=session)
+
+        assert output_list == ['geonode:layername']
+        session.get.assert_called_once()
+        assert session.get.call_args.kwargs['verify'] == session.verify
+
+    @responses.activate
+    def test_post_to_layer_group_api_uses_given_session(self, mocker):
+        url = 'https://domain/api/layer_groups/'
+        responses.add(responses.POST, url, status=200, body='{"a":"b"}')
+        session = eodslib.make_session()
+        spy_post = mocker.spy(session, 'post')
+
+        conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        response_json = eodslib.post_to_layer_group_api(conn, url, {}, quiet=False, session=session)
+
+        assert response_json == {'a': 'b'}
+        spy_post.assert_called_once()
+
+
+class TestRunWpsBatch():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        self.submitted = []
+
+        def submit_side_effect_fn(request_config, config_wpsprocess):
+            lyr = config_wpsprocess['xml_config']['template_layer_name']
+            if lyr == 'bad':
+                return ValueError('wps server returned an exception', 'ExceptionReport')
+            self.submitted.append(lyr)
+            return {'job_id': lyr, 'layer_name': lyr, 'polls': 0,
+                    'timestamp_job_start': datetime(2021, 8, 17), 'continue_process': True}
+
+        self.mock_submit_queue = mocker.patch('eodslib.submit_wps_queue')
+        self.mock_submit_queue.side_effect = submit_side_effect_fn
+
+        def poll_side_effect_fn(execution_dict, request_config, path_output, download=True):
+            execution_dict['polls'] += 1
+            if execution_dict['polls'] == 2:
+                execution_dict['job_status'] = 'READY-TO-DOWNLOAD'
+            else:
+                execution_dict['job_status'] = 'OUTSTANDING'
+            return execution_dict
+
+        self.mock_poll = mocker.patch('eodslib.poll_api_status')
+        self.mock_poll.side_effect = poll_side_effect_fn
+
+        def download_side_effect_fn(request_config, execution_dict, path_output):
+            execution_dict.update({'job_status': 'DOWNLOAD-SUCCESSFUL', 'continue_process': False,
+                                   'timestamp_job_end': datetime(2021, 8, 18)})
+            return execution_dict
+
+        self.mock_download = mocker.patch('eodslib.download_wps_result_single')
+        self.mock_download.side_effect = download_side_effect_fn
+
+        self.mock_process = mocker.patch('eodslib.process_wps_downloaded_files')
+        self.mock_process.side_effect = return_first_arg_side_effect_fn
+
+        self.mock_make_output_dir = mocker.patch('eodslib.make_output_dir')
+        self.mock_make_output_dir.return_value = Path.cwd()
+
+        # fake clock advanced by the mocked sleep
+        self.clock = [0.0]
+        mocker.patch('eodslib.time.monotonic', side_effect=lambda: self.clock[0])
+
+        def sleep_side_effect_fn(seconds):
+            self.clock[0] += seconds
+
+        self.mock_sleep = mocker.patch('eodslib.time.sleep')
+        self.mock_sleep.side_effect = sleep_side_effect_fn
+
+        self.conn = {'domain': 'domainname', 'access_token': 'token'}
+
+    def make_configs(self, layers):
+        return [{'template_xml': 'gsdownload_template.xml', 'xml_config': {'template_layer_name': lyr}} for lyr in layers]
+
+    def test_all_jobs_return_in_config_order(self):
+        results = eodslib.run_wps_batch(self.conn, self.make_configs(['a', 'b', 'c']), max_in_flight=2)
+
+        assert [r['layer_name'] for r in results] == ['a', 'b', 'c']
+        assert all(r['job_status'] == 'DOWNLOAD-SUCCESSFUL' for r in results)
+        assert all(r['log_file_path'] == Path.cwd() / 'wps-log.csv' for r in results)
+        assert all(r['total_job_duration'] == 1440.0 for r in results)
+
+    def test_poll_api_status_does_not_download(self):
+        eodslib.run_wps_batch(self.conn, self.make_configs(['a']), max_in_flight=1)
+
+        assert all(c.kwargs['download'] is False for c in self.mock_poll.call_args_list)
+        self.mock_download.assert_called_once()
+
+    def test_max_in_flight_bounds_outstanding_jobs(self):
+        outstanding = []
+        finished = []
+
+        def poll_side_effect_fn(execution_dict, request_config, path_output, download=True):
+            outstanding.append(len(self.submitted) - len(finished))
+            finished.append(execution_dict['job_id'])
+            execution_dict['job_status'] = 'READY-TO-DOWNLOAD'
+            return execution_dict
+
+        self.mock_poll.side_effect = poll_side_effect_fn
+
+        eodslib.run_wps_batch(self.conn, self.make_configs(['a', 'b', 'c', 'd', 'e']), max_in_flight=2)
+
+        assert max(outstanding) <= 2
+        assert self.mock_submit_queue.call_count == 5
+
+    def test_failed_submission_recorded_and_batch_continues(self):
+        results = eodslib.run_wps_batch(self.conn, self.make_configs(['a', 'bad', 'c']), max_in_flight=3)
+
+        assert results[1]['job_status'] == 'WPS-SUBMISSION-FAILED'
+        assert results[1]['continue_process'] is False
+        assert [results[0]['job_status'], results[2]['job_status']] == ['DOWNLOAD-SUCCESSFUL'] * 2
+
+    def test_connection_error_on_submission_recorded_and_batch_continues(self, tmp_path):
+        submit_side_effect_fn = self.mock_submit_queue.side_effect
+
+        def connection_error_side_effect_fn(request_config, config_wpsprocess):
+            if config_wpsprocess['xml_config']['template_layer_name'] == 'down':
+                raise requests.exceptions.ConnectionError('Max retries exceeded with url')
+            return submit_side_effect_fn(request_config, config_wpsprocess)
+
+        self.mock_submit_queue.side_effect = connection_error_side_effect_fn
+        self.mock_make_output_dir.return_value = tmp_path
+
+        results = eodslib.run_wps_batch(self.conn, self.make_configs(['a', 'down', 'c']), max_in_flight=3, journal=True)
+
+        assert results[1]['job_status'] == 'WPS-SUBMISSION-FAILED'
+        assert 'Max retries exceeded' in results[1]['message']
+        assert [results[0]['job_status'], results[2]['job_status']] == ['DOWNLOAD-SUCCESSFUL'] * 2
+
+        journal = eodslib.JobJournal(tmp_path / 'wps-journal.jsonl')
+        assert journal.latest[results[1]['job_key']]['job_status'] == 'WPS-SUBMISSION-FAILED'
+
+    def test_download_worker_exception_fails_only_its_job(self):
+        download_side_effect_fn = self.mock_download.side_effect
+
+        def weird_mime_side_effect_fn(request_config, execution_dict, path_output):
+            if execution_dict['layer_name'] == 'weird':
+                execution_dict['mime_type'] = 'weird'
+                eodslib.make_download_path(execution_dict, path_output)
+            return download_side_effect_fn(request_config, execution_dict, path_output)
+
+        self.mock_download.side_effect = weird_mime_side_effect_fn
+
+        results = eodslib.run_wps_batch(self.conn, self.make_configs(['a', 'weird', 'c']), max_in_flight=3)
+
+        assert results[1]['job_status'] == 'UNKNOWN-GENERAL-ERROR'
+        assert results[1]['continue_process'] is False
+        assert 'list index out of range' in results[1]['message']
+        assert [results[0]['job_status'], results[2]['job_status']] == ['DOWNLOAD-SUCCESSFUL'] * 2
+
+    def test_polling_strategy_used_between_passes(self, mocker):
+        eodslib.run_wps_batch(self.conn, self.make_configs(['a']), max_in_flight=1,
+                              polling=lambda execution_dict, attempt: 2)
+
+        self.mock_sleep.assert_called_once_with(2)
+
+    def test_max_in_flight_less_than_one_triggers_exception(self):
+        with pytest.raises(ValueError) as error:
+            eodslib.run_wps_batch(self.conn, self.make_configs(['a']), max_in_flight=0)
+
+        assert error.value.args[0] == 'ERROR. max_in_flight must be 1 or more, aborting ...'
+
+
+class TestAsyncWithoutAiohttp():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch('eodslib.aiohttp', None)
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+
+    def test_async_query_catalog_triggers_exception(self):
+        with pytest.raises(ValueError) as error:
+            asyncio.run(eodslib.async_query_catalog(self.conn))
+
+        assert error.value.args[0].startswith('ERROR. aiohttp is required')
+
+    def test_async_run_wps_triggers_exception(self):
+        with pytest.raises(ValueError):
+            asyncio.run(eodslib.async_run_wps(self.conn, {'template_xml': 'gsdownload_template.xml', 'xml_config': {}}))
+
+    def test_make_async_session_triggers_exception(self):
+        with pytest.raises(ValueError):
+            eodslib.make_async_session()
+
+@pytest.mark.skipif(eodslib.aiohttp is None, reason='aiohttp is not installed')
+class TestAsyncClient():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        self.mock_datetime = mocker.patch('eodslib.datetime')
+        self.mock_datetime.utcnow.return_value = datetime(2021, 8, 17)
+
+        self.mock_mod_xml = mocker.patch('eodslib.mod_the_xml')
+        self.mock_mod_xml.return_value = '<xml/>'
+
+        self.search_records = [{'alternate': 'geonode:layername'}]
+        self.search_requests = []
+
+        self.status_body = b'<?xml version="1.0" encoding="UTF-8"?><wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0"><wps:Status><wps:ProcessSucceeded></wps:ProcessSucceeded></wps:Status><wps:ProcessOutputs><wps:Output><wps:Reference href="HREF" mimeType="image/tiff"/></wps:Output></wps:ProcessOutputs></wps:ExecuteResponse>'
+
+    def run_with_server(self, coro_fn):
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+
+        async def search(request):
+            assert 'username' in request.query
+            self.search_requests.append(dict(request.query))
+            # the server caps pages at 10 records
+            offset, limit = int(request.query['offset']), min(int(request.query['limit']), 10)
+            return web.json_response({'meta': {'total_count': len(self.search_records)},
+                                      'objects': self.search_records[offset:offset + limit]})
+
+        async def ows(request):
+            if request.method == 'POST':
+                return web.Response(text='<wps:ExecuteResponse statusLocation="x?executionId=123&y=z"/>')
+            return web.Response(body=self.status_body.replace(b'HREF', str(request.url.with_path('/dl').with_query({'id': '123'})).encode()))
+
+        async def dl(request):
+            return web.Response(body=b'tiffbytes')
+
+        async def main():
+            app = web.Application()
+            app.router.add_get('/api/base/search', search)
+            app.router.add_route('*', '/geoserver/ows', ows)
+            app.router.add_get('/dl', dl)
+            async with TestServer(app) as server:
+                conn = {'domain': str(server.make_url('')).rstrip('/'), 'username': 'username', 'access_token': 'token'}
+                return await coro_fn(conn)
+
+        return asyncio.run(main())
+
+    def test_async_query_catalog_returns_list_and_df(self, tmp_path):
+        output_list, df = self.run_with_server(
+            lambda conn: eodslib.async_query_catalog(conn, output_dir=tmp_path))
+
+        assert output_list == ['geonode:layername']
+        assert list(df['alternate']) == ['geonode:layername']
+        assert (tmp_path / 'eods-query-all-results.csv').exists()
+
+    def test_async_query_catalog_pages_concurrently_to_total_count(self, tmp_path):
+        self.search_records = [{'alternate': 'geonode:layer' + str(i)} for i in range(25)]
+
+        output_list, df = self.run_with_server(
+            lambda conn: eodslib.async_query_catalog(conn, output_dir=tmp_path, page_size=20, max_workers=2))
+
+        assert output_list == ['geonode:layer' + str(i) for i in range(25)]
+        assert sorted(int(r['offset']) for r in self.search_requests) == [0, 10, 20]
+
+    def test_async_query_catalog_cache_hit_skips_request(self, tmp_path):
+        cache = eodslib.QueryCache(tmp_path / 'query-cache')
+
+        async def query_twice(conn):
+            await eodslib.async_query_catalog(conn, output_dir=tmp_path, cache=cache)
+            return await eodslib.async_query_catalog(conn, output_dir=tmp_path, cache=cache)
+
+        output_list, df = self.run_with_server(query_twice)
+
+        assert output_list == ['geonode:layername']
+        assert len(self.search_requests) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_async_query_catalog_local_source_makes_no_request(self, tmp_path):
+        store = eodslib.CatalogStore(tmp_path / 'catalog.sqlite')
+        store.upsert([{'id': 1, 'alternate': 'geonode:mirrored', 'title': 'mirrored', 'date': '2021-01-01T11:00:00'}])
+        conn = {'domain': 'https://unreachable.invalid', 'username': 'username', 'access_token': 'token'}
+
+        output_list, df = asyncio.run(eodslib.async_query_catalog(
+            conn, source='local', catalog_path=tmp_path / 'catalog.sqlite', output_dir=tmp_path))
+
+        assert output_list == ['geonode:mirrored']
+
+    @pytest.mark.parametrize('kwargs', [{'source': 'elsewhere'}, {'stream': True}])
+    def test_async_query_catalog_unsupported_options_trigger_exception(self, kwargs):
+        conn = {'domain': 'https://unreachable.invalid', 'username': 'username', 'access_token': 'token'}
+
+        with pytest.raises(ValueError):
+            asyncio.run(eodslib.async_query_catalog(conn, **kwargs))
+
+    def test_async_run_wps_downloads_and_processes_result(self, tmp_path):
+        config_wpsprocess = {'template_xml': 'gsdownload_template.xml',
+                             'xml_config': {'template_layer_name': 'geonode:layername'}}
+
+        execution_dict = self.run_with_server(
+            lambda conn: eodslib.async_run_wps(conn, config_wpsprocess, output_dir=tmp_path))
+
+        assert execution_dict['job_id'] == '123'
+        assert execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL'
+        assert (tmp_path / 'layername.tiff').read_bytes() == b'tiffbytes'
+        assert execution_dict['log_file_path'] == tmp_path / 'wps-log.csv'
+
+    def test_async_download_failure_tried_three_times(self, mocker, tmp_path):
+        mocker.patch('eodslib.download_backoff', return_value=0)
+
+        execution_dict = {'job_id': '123', 'layer_name': 'geonode:layername',
+                          'mime_type': 'image/tiff', 'continue_process': True}
+
+        async def download(conn):
+            async with eodslib.make_async_session() as session:
+                request_config = {'headers': {}, 'verify': True, 'session': session}
+                execution_dict['dl_url'] = conn['domain'] + '/missing'
+                return await eodslib.async_download(request_config, execution_dict, tmp_path)
+
+        result = self.run_with_server(download)
+
+        assert result['job_status'] == 'DOWNLOAD-FAILED'
+        assert result['download_try'] == 3
+
+
+    def test_async_download_discards_part_file_of_earlier_run(self, tmp_path):
+        (tmp_path / 'layername').mkdir()
+        (tmp_path / 'layername' / 'layername.tiff.part').write_bytes(b'bytes of another job')
+        execution_dict = {'job_id': '123', 'layer_name': 'geonode:layername',
+                          'mime_type': 'image/tiff', 'continue_process': True}
+
+        async def download(conn):
+            async with eodslib.make_async_session() as session:
+                request_config = {'headers': {}, 'verify': True, 'session': session}
+                execution_dict['dl_url'] = conn['domain'] + '/dl?id=123'
+                return await eodslib.async_download(request_config, execution_dict, tmp_path)
+
+        result = self.run_with_server(download)
+
+        assert result['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert result['dl_file'].read_bytes() == b'tiffbytes'
+
+class TestJobJournal():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, tmp_path):
+        self.path = tmp_path / 'wps-journal.jsonl'
+        self.config_wpsprocess = {'template_xml': 'gsdownload_template.xml',
+                                  'xml_config': {'template_layer_name': 'geonode:layername'}}
+        self.key = eodslib.job_key(self.config_wpsprocess)
+
+    def make_record(self, **kwargs):
+        execution_dict = {'job_key': self.key, 'job_id': '123', 'layer_name': 'geonode:layername',
+                          'timestamp_job_start': datetime(2021, 8, 17), 'continue_process': True,
+                          'job_status': 'SUBMITTED'}
+        execution_dict.update(kwargs)
+        return execution_dict
+
+    def test_records_read_back_with_types_restored(self, tmp_path):
+        eodslib.JobJournal(self.path).record(self.make_record(
+            job_status='DOWNLOAD-SUCCESSFUL', dl_file=tmp_path / 'a.zip', timestamp_job_end=datetime(2021, 8, 18)))
+
+        execution_dict = eodslib.JobJournal(self.path).latest[self.key]
+
+        assert execution_dict['timestamp_job_start'] == datetime(2021, 8, 17)
+        assert execution_dict['timestamp_job_end'] == datetime(2021, 8, 18)
+        assert execution_dict['dl_file'] == tmp_path / 'a.zip'
+
+    def test_unchanged_status_not_written_twice(self):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status='OUTSTANDING'))
+        journal.record(self.make_record(job_status='OUTSTANDING'))
+        journal.record(self.make_record(job_status='READY-TO-DOWNLOAD'))
+
+        assert len(self.path.read_text().splitlines()) == 2
+
+    def test_truncated_last_line_ignored(self):
+        eodslib.JobJournal(self.path).record(self.make_record())
+        with open(self.path, 'a') as f:
+            f.write('{"job_key": "abc", "job_st')
+
+        journal = eodslib.JobJournal(self.path)
+
+        assert list(journal.latest) == [self.key]
+
+    def test_job_key_independent_of_dict_order(self):
+        reordered = {'xml_config': {'template_layer_name': 'geonode:layername'}, 'template_xml': 'gsdownload_template.xml'}
+
+        assert eodslib.job_key(reordered) == self.key
+
+    def test_resume_unknown_job_returns_none(self):
+        assert eodslib.JobJournal(self.path).resume(self.config_wpsprocess) is None
+
+    def test_resume_outstanding_job_reattaches(self):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status='OUTSTANDING'))
+
+        execution_dict = journal.resume(self.config_wpsprocess)
+
+        assert execution_dict['job_id'] == '123'
+        assert execution_dict['continue_process'] is True
+
+    def test_resume_completed_job_returned_as_complete(self):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status='LOCAL-POST-PROCESSING-SUCCESSFUL', continue_process=False))
+
+        assert journal.resume(self.config_wpsprocess)['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL'
+
+    @pytest.mark.parametrize('job_status', ['WPS-FAILURE', 'WPS-GENERAL-ERROR'])
+    def test_resume_server_failure_returns_none(self, job_status):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status=job_status, continue_process=False))
+
+        assert journal.resume(self.config_wpsprocess) is None
+
+    def test_resume_client_error_reattaches(self):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status='UNKNOWN-GENERAL-ERROR', continue_process=False))
+
+        execution_dict = journal.resume(self.config_wpsprocess)
+
+        assert execution_dict['job_id'] == '123'
+        assert execution_dict['continue_process'] is True
+
+    def test_resume_client_error_without_execution_id_returns_none(self):
+        journal = eodslib.JobJournal(self.path)
+        journal.record(self.make_record(job_status='UNKNOWN-GENERAL-ERROR', job_id=None, continue_process=False))
+
+        assert journal.resume(self.config_wpsprocess) is None
+
+    def test_submission_written_to_journal(self, mocker):
+        mocker.patch('eodslib.mod_the_xml', return_value='<xml/>')
+        mock_post = mocker.patch('eodslib.requests.post')
+        mock_post.return_value.text = 'statusLocation="x?executionId=123&y=z"'
+
+        request_config = {'wps_server': 'https://domain', 'access_token': 'token', 'headers': {},
+                          'verify': True, 'journal': eodslib.JobJournal(self.path)}
+
+        execution_dict = eodslib.submit_wps_queue(request_config, self.config_wpsprocess)
+
+        assert execution_dict['job_status'] == 'SUBMITTED'
+        assert eodslib.JobJournal(self.path).latest[self.key]['job_id'] == '123'
+
+    def test_run_wps_resume_skips_completed_job(self, mocker, tmp_path):
+        eodslib.JobJournal(self.path).record(self.make_record(
+            job_status='LOCAL-POST-PROCESSING-SUCCESSFUL', continue_process=False, timestamp_job_end=datetime(2021, 8, 18)))
+        mock_submit = mocker.patch('eodslib.submit_wps_queue')
+
+        execution_dict = eodslib.run_wps({'domain': 'domainname', 'access_token': 'token'},
+                                         self.config_wpsprocess, output_dir=tmp_path, resume=True)
+
+        mock_submit.assert_not_called()
+        assert execution_dict['job_status'] == 'LOCAL-POST-PROCESSING-SUCCESSFUL'
+        assert execution_dict['total_job_duration'] == 1440.0
+
+    def test_run_wps_batch_resume_only_submits_new_jobs(self, mocker, tmp_path):
+        configs = [{'template_xml': 'gsdownload_template.xml', 'xml_config': {'template_layer_name': lyr}} for lyr in ['a', 'b', 'c']]
+        journal = eodslib.JobJournal(self.path)
+        journal.record({'job_key': eodslib.job_key(configs[0]), 'job_id': 'a', 'layer_name': 'a', 'continue_process': False,
+                        'job_status': 'LOCAL-POST-PROCESSING-SUCCESSFUL',
+                        'timestamp_job_start': datetime(2021, 8, 17), 'timestamp_job_end': datetime(2021, 8, 18)})
+        journal.record({'job_key': eodslib.job_key(configs[1]), 'job_id': 'b', 'layer_name': 'b', 'continue_process': True,
+                        'job_status': 'OUTSTANDING', 'timestamp_job_start': datetime(2021, 8, 17)})
+
+        mock_submit = mocker.patch('eodslib.submit_wps_queue')
+        mock_submit.return_value = {'job_id': 'c', 'layer_name': 'c', 'continue_process': True,
+                                    'timestamp_job_start': datetime(2021, 8, 17)}
+
+        def poll_side_effect_fn(execution_dict, request_config, path_output, download=True):
+            execution_dict.update({'job_status': 'WPS-FAILURE', 'continue_process': False,
+                                   'timestamp_job_end': datetime(2021, 8, 18)})
+            return execution_dict
+
+        mock_poll = mocker.patch('eodslib.poll_api_status')
+        mock_poll.side_effect = poll_side_effect_fn
+
+        results = eodslib.run_wps_batch({'domain': 'domainname', 'access_token': 'token'}, configs,
+                                        output_dir=tmp_path, resume=True)
+
+        mock_submit.assert_called_once()
+        assert sorted(c.args[0]['job_id'] for c in mock_poll.call_args_list) == ['b', 'c']
+        assert [r['job_id'] for r in results] == ['a', 'b', 'c']
+
+
+class TestResultCache():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, tmp_path):
+        self.cache_dir = tmp_path / 'cache'
+        self.path_output = tmp_path / 'output'
+        self.request_config = {'wps_server': 'https://domain/geoserver/ows'}
+        self.config_wpsprocess = {'template_xml': 'gsdownload_template.xml',
+                                  'xml_config': {'template_layer_name': 'geonode:layername',
+                                                 'template_mimetype': 'application/zip'}}
+
+    def make_download(self, key, content=b'zip bytes', layer_name='geonode:layername'):
+        dl_file = self.path_output / 'download' / (key + '.zip')
+        dl_file.parent.mkdir(parents=True, exist_ok=True)
+        dl_file.write_bytes(content)
+        return {'job_id': '123', 'layer_name': layer_name, 'mime_type': 'application/zip',
+                'dl_file': dl_file, 'cache_key': key, 'cache_status': 'MISS'}
+
+    def test_key_depends_on_payload_and_server(self):
+        key = eodslib.result_cache_key(self.request_config, self.config_wpsprocess)
+        other_server = eodslib.result_cache_key({'wps_server': 'https://other/geoserver/ows'}, self.config_wpsprocess)
+        self.config_wpsprocess['xml_config']['template_layer_name'] = 'geonode:otherlayer'
+        other_payload = eodslib.result_cache_key(self.request_config, self.config_wpsprocess)
+
+        assert len({key, other_server, other_payload}) == 3
+
+    def test_stored_result_fetched_as_downloaded_file(self):
+        cache = eodslib.ResultCache(self.cache_dir)
+        cache.store(self.make_download('abc'))
+
+        execution_dict = eodslib.ResultCache(self.cache_dir).fetch('abc', self.path_output)
+
+        assert execution_dict['job_status'] == 'DOWNLOAD-SUCCESSFUL'
+        assert execution_dict['dl_file'] == self.path_output / 'layername' / 'layername.zip'
+        assert execution_dict['dl_file'].read_bytes() == b'zip bytes'
+        assert execution_dict['cache_status'] == 'HIT'
+
+    def test_hit_and_miss_counters(self):
+        cache = eodslib.ResultCache(self.cache_dir)
+        cache.fetch('abc', self.path_output)
+        cache.store(self.make_download('abc'))
+
+        execution_dict = cache.fetch('abc', self.path_output)
+
+        assert (execution_dict['cache_hits'], execution_dict['cache_misses']) == (1, 1)
+
+    def test_expired_entry_is_a_miss_and_removed(self, mocker):
+        cache = eodslib.ResultCache(self.cache_dir, max_age=60)
+        cache.store(self.make_download('abc'))
+        mocker.patch('eodslib.time.time', return_value=cache.entries['abc']['created'] + 61)
+
+        assert cache.fetch('abc', self.path_output) is None
+        assert not (self.cache_dir / 'abc').exists()
+
+    def test_least_recently_used_evicted_over_max_bytes(self, mocker):
+        clock = mocker.patch('eodslib.time.time')
+        cache = eodslib.ResultCache(self.cache_dir, max_bytes=20)
+
+        clock.return_value = 1
+        cache.store(self.make_download('old', b'x' * 10))
+        clock.return_value = 2
+        cache.store(self.make_download('used', b'x' * 10))
+        clock.return_value = 3
+        cache.fetch('old', self.path_output)
+        clock.return_value = 4
+        cache.store(self.make_download('new', b'x' * 10))
+
+        assert sorted(cache.entries) == ['new', 'old']
+        assert not (self.cache_dir / 'used').exists()
+
+    def test_entries_shared_between_instances_on_one_directory(self, mocker):
+        clock = mocker.patch('eodslib.time.time')
+        other_process = eodslib.ResultCache(self.cache_dir, max_bytes=20)
+        cache = eodslib.ResultCache(self.cache_dir, max_bytes=20)
+
+        clock.return_value = 1
+        other_process.store(self.make_download('old', b'x' * 10))
+        clock.return_value = 2
+        cache.store(self.make_download('used', b'x' * 10))
+        clock.return_value = 3
+        other_process.store(self.make_download('new', b'x' * 10))
+
+        assert cache.fetch('new', self.path_output)['cache_status'] == 'HIT'
+        assert sorted(other_process.entries) == ['new', 'used']
+        assert not (self.cache_dir / 'old').exists()
+
+    def test_cache_path_memoised_across_runs(self, mocker):
+        mocker.patch('eodslib.get_default_session')
+        conn = {'domain': 'domainname', 'access_token': 'token'}
+
+        first = eodslib.make_request_config(conn, {'cache': self.cache_dir})['cache']
+        first.fetch('abc', self.path_output)
+        second = eodslib.make_request_config(conn, {'cache': str(self.cache_dir / '..' / 'cache')})['cache']
+
+        assert second is first
+        assert second.misses == 1
+
+    def test_run_wps_cache_hit_skips_submission(self, mocker):
+        mock_submit = mocker.patch('eodslib.submit_wps_queue')
+        mocker.patch('eodslib.process_wps_downloaded_files', side_effect=return_first_arg_side_effect_fn)
+        cache = eodslib.ResultCache(self.cache_dir)
+        key = eodslib.result_cache_key({'wps_server': 'domainname/geoserver/ows'}, self.config_wpsprocess)
+        cache.store(self.make_download(key))
+
+        execution_dict = eodslib.run_wps({'domain': 'domainname', 'access_token': 'token'}, self.config_wpsprocess,
+                                         output_dir=self.path_output, cache=cache)
+
+        mock_submit.assert_not_called()
+        assert execution_dict['cache_status'] == 'HIT'
+        assert execution_dict['log_file_path'] == self.path_output / 'wps-log.csv'
+
+    def test_miss_stored_before_post_processing(self, mocker):
+        mocker.patch('eodslib.process_wps_downloaded_files', side_effect=return_first_arg_side_effect_fn)
+        cache = eodslib.ResultCache(self.cache_dir)
+
+        eodslib.process_and_record({'cache': cache}, self.make_download('abc'))
+
+        assert 'abc' in cache.entries
+        assert (self.cache_dir / 'abc' / 'abc.zip').read_bytes() == b'zip bytes'
+
+
+class TestCatalogMirror():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker, tmp_path):
+        self.catalog_path = tmp_path / 'catalog.sqlite'
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        self.records = [
+            self.make_record(1, 'S2A_20210101_lat1lon2_T30UXC_ORB037_etc', '2021-01-01T11:00:00', 0.1,
+                             'POLYGON((0 50, 1 50, 1 51, 0 51, 0 50))'),
+            self.make_record(2, 'S2B_20210105_lat1lon2_T30UXD_ORB037_etc', '2021-01-05T11:00:00', 0.6,
+                             'POLYGON((5 50, 6 50, 6 51, 5 51, 5 50))'),
+            self.make_record(3, 'S1A_20210103_lat1lon2_etc', '2021-01-03T06:00:00', None,
+                             'POLYGON((0 50, 1 50, 1 51, 0 51, 0 50))'),
+        ]
+        self.requests = []
+        self.reject_last_updated = False
+
+    def make_record(self, id, title, date, cloud, wkt):
+        record = {'id': id, 'title': title, 'alternate': 'geonode:' + title, 'date': date,
+                  'last_updated': date, 'storeType': 'coverageStore', 'csw_wkt_geometry': wkt}
+        if cloud is not None:
+            record['supplemental_information'] = 'ARCSI_CLOUD_COVER: ' + str(cloud) + '\nOTHER: 1'
+        return record
+
+    def search_callback(self, request):
+        params = dict(parse_qsl(urlparse(request.url).query))
+        self.requests.append(params)
+        if 'last_updated__gte' in params and self.reject_last_updated:
+            return (400, {}, '{"error": "The \'last_updated\' field does not allow filtering."}')
+        records = self.records
+        if 'last_updated__gte' in params:
+            records = [r for r in records if r['last_updated'] >= params['last_updated__gte']]
+        if 'date__range' in params:
+            date_from, date_to = params['date__range'].split(',')
+            records = [r for r in records if date_from <= r['date'][:10] + ' ' + r['date'][11:16] <= date_to]
+        offset, limit = int(params['offset']), int(params['limit'])
+        return (200, {}, json.dumps({'meta': {'total_count': len(records)}, 'objects': records[offset:offset + limit]}))
+
+    def sync(self, **kwargs):
+        return eodslib.sync_catalog(self.conn, catalog_path=self.catalog_path, page_size=2, **kwargs)
+
+    def add_late_ingested_record(self, last_updated):
+        record = self.make_record(4, 'S1B_20210102_lat1lon2_etc', '2021-01-02T06:00:00', None,
+                                  'POLYGON((0 50, 1 50, 1 51, 0 51, 0 50))')
+        record['last_updated'] = last_updated
+        self.records.append(record)
+
+    @responses.activate
+    def test_first_sync_pages_whole_catalog(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        summary = self.sync()
+
+        assert [r['offset'] for r in self.requests] == ['0', '2']
+        assert 'date__range' not in self.requests[0]
+        assert summary['inserted'] == 3 and summary['total'] == 3
+
+    @responses.activate
+    def test_later_sync_only_requests_modified_records_and_skips_unchanged(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        self.requests.clear()
+
+        summary = self.sync()
+
+        assert self.requests[0]['last_updated__gte'] == '2021-01-05T11:00:00'
+        assert 'date__range' not in self.requests[0]
+        assert summary['inserted'] == 0 and summary['updated'] == 0
+
+    @responses.activate
+    def test_later_ingested_record_with_older_date_picked_up(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        self.add_late_ingested_record('2021-01-10T00:00:00')
+
+        summary = self.sync()
+
+        assert summary['inserted'] == 1 and summary['unchanged'] == 1
+        assert eodslib.CatalogStore(self.catalog_path).get_state('updated_to') == '2021-01-10T00:00:00'
+
+    @responses.activate
+    def test_rejected_last_updated_filter_rescans_overlap_window(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        self.add_late_ingested_record('2021-01-10T00:00:00')
+        self.reject_last_updated = True
+        self.requests.clear()
+
+        summary = self.sync(overlap_days=3)
+
+        assert self.requests[-1]['date__range'].startswith('2021-01-02 00:00,')
+        assert summary['inserted'] == 1
+
+    @responses.activate
+    def test_records_without_last_updated_rescan_overlap_window(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        for record in self.records:
+            record['last_updated'] = None
+        self.sync()
+        self.requests.clear()
+
+        self.sync()
+
+        assert all('last_updated__gte' not in r for r in self.requests)
+        assert self.requests[0]['date__range'].startswith('2020-12-29 00:00,')
+
+    @responses.activate
+    def test_explicit_window_does_not_advance_sync_state(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.records[1]['date'] = self.records[1]['last_updated'] = '2021-03-01T11:00:00'
+
+        self.sync(start_date='2021-03-01', end_date='2021-03-31')
+
+        store = eodslib.CatalogStore(self.catalog_path)
+        assert store.count() == 1
+        assert store.get_state('synced_to') is None and store.get_state('updated_to') is None
+
+    @responses.activate
+    def test_modified_record_updated(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        self.records[0]['last_updated'] = '2021-02-01T00:00:00'
+
+        summary = self.sync(full=True)
+
+        assert summary['updated'] == 1 and summary['unchanged'] == 2
+
+    @pytest.mark.parametrize('kwargs', [{'start_date': '2021-03-01'}, {'end_date': '2021-03-31'}])
+    def test_explicit_window_needs_both_dates(self, kwargs):
+        with pytest.raises(ValueError) as error:
+            self.sync(**kwargs)
+
+        assert "*BOTH* 'start_date' and 'end_date'" in error.value.args[0]
+
+    @responses.activate
+    def test_local_query_filters_match_search_params(self, mocker):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        mocker.patch('eodslib.make_output_dir', return_value=Path.cwd())
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+        self.requests.clear()
+
+        output_list, df = eodslib.query_catalog(self.conn, source='local', catalog_path=self.catalog_path, sat_id=2,
+                                                start_date='2021-01-01', end_date='2021-01-31', cloud_min=0, cloud_max=50,
+                                                geom='POLYGON((0.5 50.5, 2 50.5, 2 52, 0.5 52, 0.5 50.5))')
+
+        assert self.requests == []
+        assert output_list == ['geonode:S2A_20210101_lat1lon2_T30UXC_ORB037_etc']
+        assert df['granule-ref'].tolist() == ['T30UXC']
+
+    @responses.activate
+    def test_local_query_title_and_type(self, mocker):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+        self.sync()
+        store = eodslib.CatalogStore(self.catalog_path)
+
+        assert store.query({'q': 't30uxd'})['meta']['total_count'] == 1
+        assert store.query({'type__in': 'vector'})['meta']['total_count'] == 0
+        assert store.query({'keywords__slug__in': 'sentinel-1'})['objects'][0]['id'] == 3
+
+    def test_unknown_source_triggers_exception(self):
+        with pytest.raises(ValueError) as error:
+            eodslib.query_catalog(self.conn, source='elsewhere')
+
+        assert error.value.args[0] == "ERROR. source must be 'remote' or 'local', aborting ..."
+
+
+class TestIterCatalog():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self):
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        self.records = [{'id': i, 'alternate': 'geonode:S2A_date_lat1lon2_T30UXC_ORB0' + str(i) + '_etc',
+                         'title': 'S2A_date_lat1lon2_T30UXC_ORB0' + str(i) + '_etc',
+                         'supplemental_information': 'ARCSI_CLOUD_COVER: 0.' + str(i) + '\nOTHER: 1'}
+                        for i in range(5)]
+        self.requests = []
+
+    def search_callback(self, request):
+        params = dict(parse_qsl(urlparse(request.url).query))
+        self.requests.append(params)
+        offset, limit = int(params['offset']), int(params['limit'])
+        return (200, {}, json.dumps({'meta': {'total_count': len(self.records)}, 'objects': self.records[offset:offset + limit]}))
+
+    @responses.activate
+    def test_pages_walk_offsets_until_exhausted(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        pages = list(eodslib.iter_catalog(self.conn, page_size=2))
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [r['offset'] for r in self.requests] == ['0', '2', '4']
+        assert pd.concat(pages)['id'].tolist() == [0, 1, 2, 3, 4]
+
+    @responses.activate
+    def test_server_capped_page_size_still_walks_to_total_count(self):
+        self.records = self.records * 5
+
+        def capped_callback(request):
+            params = dict(parse_qsl(urlparse(request.url).query))
+            self.requests.append(params)
+            offset, limit = int(params['offset']), min(int(params['limit']), 10)
+            return (200, {}, json.dumps({'meta': {'total_count': len(self.records)}, 'objects': self.records[offset:offset + limit]}))
+
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=capped_callback)
+
+        pages = list(eodslib.iter_catalog(self.conn, page_size=20, as_frame=False))
+
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert [r['offset'] for r in self.requests] == ['0', '10', '20']
+
+    @responses.activate
+    def test_pages_requested_lazily(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        next(eodslib.iter_catalog(self.conn, page_size=2))
+
+        assert len(self.requests) == 1
+
+    @responses.activate
+    def test_limit_caps_records_yielded(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        pages = list(eodslib.iter_catalog(self.conn, page_size=2, limit=3, as_frame=False))
+
+        assert [[r['id'] for r in page] for page in pages] == [[0, 1], [2]]
+        assert self.requests[-1]['limit'] == '1'
+
+    @responses.activate
+    def test_s2_pages_have_query_catalog_columns(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        page = next(eodslib.iter_catalog(self.conn, page_size=2, sat_id=2))
+
+        assert page['granule-ref'].tolist() == ['T30UXC', 'T30UXC']
+        assert page['ARCSI_CLOUD_COVER'].tolist() == [0.0, 0.1]
+        assert self.requests[0]['keywords__slug__in'] == 'sentinel-2'
+
+    @responses.activate
+    def test_failed_page_triggers_exception(self):
+        responses.add(responses.GET, 'https://domain/api/base/search', status=500)
+
+        with pytest.raises(ValueError):
+            list(eodslib.iter_catalog(self.conn))
+
+
+class TestQueryCatalogPages():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch('eodslib.make_output_dir', return_value=Path.cwd())
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        self.records = [{'id': i, 'alternate': 'geonode:layer' + str(i)} for i in range(10)]
+        self.server_max_page = None
+        self.requests = []
+
+    def search_callback(self, request):
+        params = dict(parse_qsl(urlparse(request.url).query))
+        self.requests.append(params)
+        offset, limit = int(params['offset']), int(params['limit'])
+        if self.server_max_page:
+            limit = min(limit, self.server_max_page)
+        # later pages answer first, so completion order differs from page order
+        time.sleep(0.02 * (len(self.records) - offset) / len(self.records))
+        return (200, {}, json.dumps({'meta': {'total_count': len(self.records)}, 'objects': self.records[offset:offset + limit]}))
+
+    @responses.activate
+    def test_parallel_pages_identical_to_serial(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        serial_list, serial_df = eodslib.query_catalog(self.conn, page_size=3, max_workers=1)
+        parallel_list, parallel_df = eodslib.query_catalog(self.conn, page_size=3, max_workers=4)
+
+        assert parallel_list == serial_list == ['geonode:layer' + str(i) for i in range(10)]
+        assert parallel_df.equals(serial_df)
+
+    @responses.activate
+    def test_limit_bounds_pages_requested(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        output_list, _ = eodslib.query_catalog(self.conn, page_size=2, limit=5)
+
+        assert len(output_list) == 5
+        assert sorted((r['offset'], r['limit']) for r in self.requests) == [('0', '2'), ('2', '2'), ('4', '1')]
+
+    @responses.activate
+    def test_pages_follow_server_page_cap(self):
+        self.server_max_page = 4
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        output_list, _ = eodslib.query_catalog(self.conn, page_size=100)
+
+        assert len(output_list) == 10
+        assert sorted(r['offset'] for r in self.requests) == ['0', '4', '8']
+
+
+class TestQueryCache():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker, tmp_path):
+        mocker.patch('eodslib.make_output_dir', side_effect=lambda p: Path(p).mkdir(parents=True, exist_ok=True) or Path(p))
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+
+        self.cache_dir = tmp_path / 'query-cache'
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+
+    @responses.activate
+    def test_hit_skips_request_and_normalise(self, mocker):
+        responses.add(responses.GET, 'https://domain/api/base/search',
+                      body=json.dumps({'meta': {'total_count': 1}, 'objects': [{'alternate': 'geonode:layername'}]}))
+        cache = eodslib.QueryCache(self.cache_dir)
+        first = eodslib.query_catalog(self.conn, title='layer', cache=cache)
+        spy = mocker.spy(eodslib, 'json_normalize')
+
+        second = eodslib.query_catalog(self.conn, title='layer', cache=cache)
+
+        assert len(responses.calls) == 1
+        spy.assert_not_called()
+        assert second[0] == first[0] == ['geonode:layername']
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    @responses.activate
+    def test_fields_query_keyed_on_fields_read(self):
+        records = [{'alternate': 'geonode:S2A_20210101_lat52lon1_T30UXC_ORB037_etc', 'title': 'S2A_20210101_lat52lon1_T30UXC_ORB037_etc',
+                    'supplemental_information': 'ARCSI_CLOUD_COVER: 0.1', 'split_granule': {'name': None}}]
+        responses.add(responses.GET, 'https://domain/api/base/search',
+                      body=json.dumps({'meta': {'total_count': 1}, 'objects': records}))
+        cache = eodslib.QueryCache(self.cache_dir)
+        eodslib.query_catalog(self.conn, sat_id=2, fields=['title'], cache=cache)
+
+        # a single record is too few for find_least_cloud, the request has been made by then
+        with pytest.raises(ValueError):
+            eodslib.query_catalog(self.conn, sat_id=2, fields=['title'], find_least_cloud=True, cache=cache)
+
+        assert len(responses.calls) == 2
+        assert (cache.hits, cache.misses) == (0, 2)
+
+    def test_key_ignores_credentials_and_value_types(self):
+        params = {'username': 'a', 'api_key': 'b', 'offset': 0, 'limit': 20000, 'q': 'layer'}
+        other_user = {'username': 'c', 'api_key': 'd', 'offset': '0', 'limit': '20000', 'q': 'layer'}
+
+        assert eodslib.query_cache_key(self.conn, params) == eodslib.query_cache_key(self.conn, other_user)
+        assert eodslib.query_cache_key(self.conn, params) != eodslib.query_cache_key(self.conn, dict(params, q='other'))
+
+    def test_expired_entry_is_a_miss_and_removed(self, mocker):
+        cache = eodslib.QueryCache(self.cache_dir, ttl=60)
+        cache.put('abc', pd.DataFrame({'alternate': ['geonode:layername']}))
+        mocker.patch('eodslib.time.time', return_value=time.time() + 61)
+
+        assert cache.get('abc') is None
+        assert not (self.cache_dir / 'abc.json').exists()
+
+    def test_least_recently_used_evicted_over_max_bytes(self):
+        df = pd.DataFrame({'alternate': ['geonode:layername'] * 100})
+        cache = eodslib.QueryCache(self.cache_dir)
+        cache.put('old', df)
+        # room for two entries but not three, the json size varies by a few bytes with the fetch time
+        cache.max_bytes = 2 * (self.cache_dir / 'old.json').stat().st_size + (self.cache_dir / 'old.json').stat().st_size // 2
+        cache.put('used', df)
+        os.utime(self.cache_dir / 'old.json', (1, 1))
+        os.utime(self.cache_dir / 'used.json', (2, 2))
+        cache.get('old')
+
+        cache.put('new', df)
+
+        assert sorted(p.stem for p in self.cache_dir.glob('*.json')) == ['new', 'old']
+
+    def test_entries_stored_as_json_round_trip_dtypes(self):
+        df = pd.DataFrame({'alternate': ['geonode:a', 'geonode:b'], 'id': [1, 2], 'cloud': [0.123456789012, float('nan')],
+                           'date': pd.to_datetime(['2021-01-01T11:00:00', '2021-01-02T11:00:00']),
+                           'keywords': [['sentinel-2'], []], 'owner.username': ['eods', None]})
+        cache = eodslib.QueryCache(self.cache_dir)
+
+        cache.put('abc', df)
+
+        assert json.loads((self.cache_dir / 'abc.json').read_text())['columns'] == list(df.columns)
+        pd.testing.assert_frame_equal(cache.get('abc'), df)
+
+    def test_pickled_entry_not_loaded(self):
+        import pickle
+        cache = eodslib.QueryCache(self.cache_dir)
+        with open(self.cache_dir / 'abc.pkl', 'wb') as f:
+            pickle.dump((time.time(), pd.DataFrame({'alternate': ['geonode:layername']})), f)
+        (self.cache_dir / 'abc.json').write_bytes((self.cache_dir / 'abc.pkl').read_bytes())
+
+        assert cache.get('abc') is None
+        assert cache.misses == 1
+
+    def test_concurrent_writers_leave_readable_entries(self):
+        from concurrent.futures import ThreadPoolExecutor
+        df = pd.DataFrame({'alternate': ['geonode:layername'] * 1000})
+        cache = eodslib.QueryCache(self.cache_dir)
+
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: cache.put('abc', df), range(32)))
+
+        assert cache.get('abc').equals(df)
+        assert list(self.cache_dir.glob('*.part')) == []
+
+
+class TestAddS2Columns():
+    def test_title_parsed_into_typed_columns(self):
+        df = pd.DataFrame({'title': ['S2A_20210301_lat52lon1_T30UXC_ORB037_utm30n_osgb_vmsk_sharp_rad_srefdem_stdsref',
+                                     'S2B_20210302_lat51lon0_T30UYCSPLIT1_ORB080_utm30n_osgb_vmsk_sharp_rad_srefdem_stdsref'],
+                           'supplemental_information': ['Data Collection Time: time\nARCSI_CLOUD_COVER: 0.25\netc',
+                                                        'ARCSI_CLOUD_COVER: 0.5']})
+
+        df = eodslib.add_s2_columns(df)
+
+        assert df['satellite'].tolist() == ['S2A', 'S2B']
+        assert df['acquisition_date'].tolist() == [pd.Timestamp('2021-03-01'), pd.Timestamp('2021-03-02')]
+        assert df['latlon'].tolist() == ['lat52lon1', 'lat51lon0']
+        assert df['granule-ref'].tolist() == ['T30UXC', 'T30UYCSPLIT1']
+        assert df['orbit-ref'].tolist() == ['ORB037', 'ORB080']
+        assert df['ARCSI_CLOUD_COVER'].tolist() == [0.25, 0.5]
+        assert isinstance(df['granule-ref'].dtype, pd.CategoricalDtype)
+        assert isinstance(df['orbit-ref'].dtype, pd.CategoricalDtype)
+
+    def test_missing_cloud_cover_is_nan(self):
+        df = pd.DataFrame({'title': ['S2A_20210301_lat52lon1_T30UXC_ORB037_etc'], 'supplemental_information': ['no cloud here']})
+
+        df = eodslib.add_s2_columns(df)
+
+        assert df['ARCSI_CLOUD_COVER'].isna().all()
+
+
+class TestQueryCatalogFields():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch('eodslib.make_output_dir', return_value=Path.cwd())
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        self.records = [{'id': i, 'alternate': 'geonode:S2A_20210101_lat52lon1_T30UXC_ORB037_' + str(i),
+                         'title': 'S2A_20210101_lat52lon1_T30UXC_ORB037_' + str(i),
+                         'abstract': 'long text ' * 50, 'csw_type': 'dataset',
+                         'owner': {'username': 'eods', 'id': 1},
+                         'supplemental_information': 'ARCSI_CLOUD_COVER: 0.' + str(i + 1) + '\nOTHER: 1'}
+                        for i in range(4)]
+
+    def query(self, **kwargs):
+        responses.add(responses.GET, 'https://domain/api/base/search',
+                      body=json.dumps({'meta': {'total_count': len(self.records)}, 'objects': self.records}))
+        return eodslib.query_catalog(self.conn, **kwargs)
+
+    @responses.activate
+    def test_fields_keep_only_requested_columns(self):
+        _, df = self.query(fields=['id', 'owner.username'])
+
+        assert list(df.columns) == ['id', 'alternate', 'owner.username']
+
+    @responses.activate
+    def test_fields_keep_nested_children_of_requested_field(self):
+        _, df = self.query(fields=['owner'])
+
+        assert sorted(df.columns) == ['alternate', 'owner.id', 'owner.username']
+
+    @responses.activate
+    def test_fields_with_s2_keep_derived_columns_and_drop_inputs(self):
+        _, df = self.query(fields=['id'], sat_id=2)
+
+        assert 'title' not in df.columns and 'supplemental_information' not in df.columns
+        assert df['ARCSI_CLOUD_COVER'].tolist() == [0.1, 0.2, 0.3, 0.4]
+        assert df['granule-ref'].tolist() == ['T30UXC'] * 4
+
+    @responses.activate
+    def test_compact_drops_bulky_text_and_shrinks_dtypes(self):
+        _, full_df = self.query(sat_id=2)
+        _, df = self.query(sat_id=2, compact=True)
+
+        assert 'abstract' not in df.columns and 'supplemental_information' not in df.columns
+        assert df['id'].dtype == np.int8
+        assert isinstance(df['csw_type'].dtype, pd.CategoricalDtype)
+        assert df.memory_usage(deep=True).sum() < full_df.memory_usage(deep=True).sum()
+
+    def test_compact_keeps_floats_float32_cannot_hold(self):
+        df = eodslib.compact_frame(pd.DataFrame({'cloud': [0.3, 0.1], 'whole': [1.0, 2.5]}))
+
+        assert df['cloud'].dtype == np.float64
+        assert df['whole'].dtype == np.float32
+
+
+class TestStreamSearchResponse():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        self.records = [{'id': 1, 'alternate': 'geonode:a', 'title': 'café \\"quoted\\"', 'owner': {'username': 'eods', 'id': 7},
+                         'keywords': ['sentinel-2', 'ard'], 'popular_count': 12345, 'rating': None},
+                        {'id': 2, 'alternate': 'geonode:b', 'title': 'second', 'owner': {'username': 'other', 'id': 8},
+                         'keywords': [], 'popular_count': 0, 'extra': True}]
+        self.body = json.dumps({'objects': self.records, 'meta': {'total_count': 2, 'limit': 1000}}, ensure_ascii=False).encode('utf-8')
+        self.response = mocker.MagicMock()
+
+    def chunked(self, size):
+        self.response.iter_content.side_effect = lambda chunk_size: (self.body[i:i + size] for i in range(0, len(self.body), size))
+        return self.response
+
+    @pytest.mark.parametrize('size', [1, 7, 4096])
+    def test_columns_match_json_normalize_at_any_chunk_size(self, size):
+        json_response = eodslib.stream_search_response(self.chunked(size))
+
+        expected = json_normalize(self.records)
+        df = json_response['objects'].to_frame()
+
+        assert json_response['meta'] == {'total_count': 2, 'limit': 1000}
+        assert sorted(df.columns) == sorted(expected.columns)
+        assert df[expected.columns].astype(str).equals(expected.astype(str))
+
+    def test_fields_keep_only_requested_columns(self):
+        json_response = eodslib.stream_search_response(self.chunked(5), fields=['alternate', 'owner'])
+
+        assert list(json_response['objects'].columns) == ['alternate', 'owner.username', 'owner.id']
+
+    def test_truncated_body_triggers_exception(self):
+        self.body = self.body[:-40]
+
+        with pytest.raises(ValueError):
+            eodslib.stream_search_response(self.chunked(16))
+
+    @responses.activate
+    def test_query_catalog_stream_matches_buffered(self, mocker):
+        mocker.patch('eodslib.make_output_dir', return_value=Path.cwd())
+        mocker.patch('eodslib.pd.DataFrame.to_csv')
+        conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        responses.add(responses.GET, 'https://domain/api/base/search', body=self.body)
+
+        buffered_list, buffered_df = eodslib.query_catalog(conn, fields=['id', 'owner.username'], page_size=1)
+        streamed_list, streamed_df = eodslib.query_catalog(conn, fields=['id', 'owner.username'], page_size=1, stream=True)
+
+        assert streamed_list == buffered_list
+        assert streamed_df.equals(buffered_df)
+
+class TestWriteQueryResults():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self):
+        self.df = pd.DataFrame({
+            'alternate': ['geonode:a', 'geonode:b'],
+            'ARCSI_CLOUD_COVER': [0.125, 0.5],
+            'csw_wkt_geometry': ['POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))', None],
+            })
+
+    @pytest.mark.parametrize('output_format', ['csv', 'parquet', 'feather'])
+    def test_round_trip_keeps_values(self, tmp_path, output_format):
+        path = eodslib.write_query_results(self.df, tmp_path, output_format)
+
+        assert path.name == 'eods-query-all-results.' + output_format
+        df = eodslib.read_query_results(path)
+        assert df['alternate'].tolist() == ['geonode:a', 'geonode:b']
+        assert df['ARCSI_CLOUD_COVER'].tolist() == [0.125, 0.5]
+
+    def test_geoparquet_stores_wkb_geometry_and_metadata(self, tmp_path):
+        path = eodslib.write_query_results(self.df, tmp_path, 'geoparquet')
+
+        geo = json.loads(eodslib.pyarrow.parquet.read_schema(path).metadata[b'geo'])
+        assert geo['primary_column'] == 'geometry'
+        assert geo['columns']['geometry']['encoding'] == 'WKB'
+
+        df = eodslib.read_query_results(path)
+        assert df['geometry'][0].equals(shapely.wkt.loads(self.df['csw_wkt_geometry'][0]))
+        assert df['geometry'][1] is None
+
+    @responses.activate
+    def test_geoparquet_fields_query_reads_footprints(self, tmp_path):
+        records = [{'alternate': 'geonode:a', 'title': 'a', 'abstract': 'text',
+                    'csw_wkt_geometry': 'POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))'}]
+        responses.add(responses.GET, 'https://domain/api/base/search',
+                      body=json.dumps({'meta': {'total_count': 1}, 'objects': records}))
+        conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+
+        _, df = eodslib.query_catalog(conn, fields=['title'], output_format='geoparquet', output_dir=tmp_path)
+
+        assert 'abstract' not in df.columns
+        geometry = eodslib.read_query_results(tmp_path / 'eods-query-all-results.geoparquet')['geometry']
+        assert geometry[0].equals(shapely.wkt.loads(records[0]['csw_wkt_geometry']))
+
+    def test_geoparquet_without_footprints_triggers_exception(self, tmp_path):
+        with pytest.raises(ValueError) as error:
+            eodslib.write_query_results(self.df.drop(columns=['csw_wkt_geometry']), tmp_path, 'geoparquet')
+
+        assert error.value.args[0].startswith("ERROR. output_format='geoparquet' needs the csw_wkt_geometry column")
+
+    def test_unknown_format_triggers_exception(self, tmp_path):
+        with pytest.raises(ValueError):
+            eodslib.write_query_results(self.df, tmp_path, 'xlsx')
+
+    def test_missing_pyarrow_triggers_exception(self, tmp_path, mocker):
+        mocker.patch('eodslib.pyarrow', None)
+
+        with pytest.raises(ValueError):
+            eodslib.write_query_results(self.df, tmp_path, 'parquet')
+
+class TestCatalogIndex():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self):
+        self.df = pd.DataFrame({
+            'alternate': ['geonode:a', 'geonode:b', 'geonode:c', 'geonode:d'],
+            'csw_wkt_geometry': ['POLYGON((0 0, 2 0, 2 2, 0 2, 0 0))', 'POLYGON((1 1, 3 1, 3 3, 1 3, 1 1))',
+                                 None, 'POLYGON((10 10, 11 10, 11 11, 10 11, 10 10))'],
+            }, index=[10, 11, 12, 13])
+        self.index = eodslib.CatalogIndex(self.df)
+
+    def test_rows_without_footprint_are_not_indexed(self):
+        assert len(self.index) == 3
+
+    def test_intersects_many_aois_in_long_format(self):
+        aois = ['POLYGON((1.5 1.5, 1.6 1.5, 1.6 1.6, 1.5 1.6, 1.5 1.5))', shapely.geometry.Point(10.5, 10.5), shapely.geometry.Point(50, 50)]
+
+        df = self.index.intersects(aois)
+
+        assert df['aoi'].tolist() == [0, 0, 1]
+        assert df['alternate'].tolist() == ['geonode:a', 'geonode:b', 'geonode:d']
+        assert df.index.tolist() == [10, 11, 13]
+
+    def test_contains_needs_whole_aoi_inside_footprint(self):
+        df = self.index.contains('POLYGON((0.5 0.5, 2.5 0.5, 2.5 1.5, 0.5 1.5, 0.5 0.5))')
+
+        assert df.empty
+
+        df = self.index.contains('POLYGON((1.5 1.5, 2.5 1.5, 2.5 2.5, 1.5 2.5, 1.5 1.5))')
+
+        assert df['alternate'].tolist() == ['geonode:b']
+
+    def test_nearest_returns_one_row_per_aoi(self):
+        df = self.index.nearest([shapely.geometry.Point(9, 9), shapely.geometry.Point(-1, -1)])
+
+        assert df['aoi'].tolist() == [0, 1]
+        assert df['alternate'].tolist() == ['geonode:d', 'geonode:a']
+
+    def test_save_and_load_round_trip(self, tmp_path):
+        self.index.save(tmp_path / 'index.pkl')
+
+        index = eodslib.CatalogIndex.load(tmp_path / 'index.pkl')
+
+        assert index.intersects(shapely.geometry.Point(2.5, 2.5))['alternate'].tolist() == ['geonode:b']
+
+    def test_invalid_predicate_triggers_exception(self):
+        with pytest.raises(ValueError):
+            self.index.query(shapely.geometry.Point(0, 0), 'touches')
+
+class TestQueryCatalogMany():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch('eodslib.make_output_dir', return_value=Path.cwd())
+        self.to_csv = mocker.patch('eodslib.pd.DataFrame.to_csv')
+
+        self.conn = {'domain': 'https://domain', 'username': 'username', 'access_token': 'token'}
+        self.records = [
+            {'id': 1, 'alternate': 'geonode:a', 'csw_wkt_geometry': 'POLYGON((0 0, 2 0, 2 2, 0 2, 0 0))'},
+            {'id': 2, 'alternate': 'geonode:b', 'csw_wkt_geometry': 'POLYGON((1 1, 3 1, 3 3, 1 3, 1 1))'},
+            ]
+        self.requests = []
+
+    def search_callback(self, request):
+        self.requests.append(dict(parse_qsl(urlparse(request.url).query)))
+        return (200, {}, json.dumps({'meta': {'total_count': len(self.records)}, 'objects': self.records}))
+
+    @responses.activate
+    def test_one_request_over_union_bbox(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        aois = [shapely.geometry.Point(0.5, 0.5), 'POINT (2.5 2.5)', shapely.geometry.Point(1.5, 1.5), shapely.geometry.Point(9, 9)]
+        pairs, df = eodslib.query_catalog_many(self.conn, aois)
+
+        assert len(self.requests) == 1
+        assert self.to_csv.call_count == 1
+        assert shapely.wkt.loads(self.requests[0]['geometry']).bounds == (0.5, 0.5, 9, 9)
+        assert pairs['aoi'].tolist() == [0, 1, 2, 2]
+        assert pairs['alternate'].tolist() == ['geonode:a', 'geonode:b', 'geonode:a', 'geonode:b']
+        assert df['alternate'].tolist() == ['geonode:a', 'geonode:b']
+
+    @responses.activate
+    def test_series_index_labels_aois(self):
+        responses.add_callback(responses.GET, 'https://domain/api/base/search', callback=self.search_callback)
+
+        aois = pd.Series(['POLYGON((1.2 1.2, 1.8 1.2, 1.8 1.8, 1.2 1.8, 1.2 1.2))', 'POLYGON((1.5 1.5, 2.5 1.5, 2.5 2.5, 1.5 2.5, 1.5 1.5))'],
+                         index=['parcel-1', 'parcel-2'])
+        pairs, _ = eodslib.query_catalog_many(self.conn, aois, predicate='contains')
+
+        assert pairs['aoi'].tolist() == ['parcel-1', 'parcel-1', 'parcel-2']
+        assert pairs['alternate'].tolist() == ['geonode:a', 'geonode:b', 'geonode:b']
+
+    def test_geom_kwarg_triggers_exception(self):
+        with pytest.raises(ValueError):
+            eodslib.query_catalog_many(self.conn, ['POINT (0 0)'], geom='POINT (0 0)')
+
+class TestResolveSplitPairs():
+    def test_halves_get_counterpart_cloud_and_average(self):
+        df = pd.DataFrame({'alternate': ['geonode:a', 'geonode:b', 'geonode:c', 'geonode:d'],
+                           'ARCSI_CLOUD_COVER': [0.1, 0.3, 0.5, 0.7],
+                           'split_granule.name': ['geonode:b', 'geonode:a', np.nan, 'geonode:missing']})
+
+        df = eodslib.resolve_split_pairs(df)
+
+        assert df['split_ARCSI_CLOUD_COVER'].dtype == np.float64
+        assert df['split_cloud_cover'].dtype == np.float64
+        assert df['split_ARCSI_CLOUD_COVER'].tolist()[:2] == [0.3, 0.1]
+        assert df['split_ARCSI_CLOUD_COVER'][2:].isna().all()
+        assert df['split_cloud_cover'].tolist()[:3] == pytest.approx([0.2, 0.2, 0.5])
+        assert np.isnan(df['split_cloud_cover'][3])
+
+    def test_string_cloud_values_become_numeric(self):
+        df = pd.DataFrame({'alternate': ['geonode:a', 'geonode:b'], 'ARCSI_CLOUD_COVER': ['0.25', '0.75'],
+                           'split_granule.name': ['geonode:b', 'geonode:a']})
+
+        df = eodslib.resolve_split_pairs(df)
+
+        assert df['split_cloud_cover'].tolist() == [0.5, 0.5]
+
+    def test_no_split_column_uses_own_cloud(self):
+        df = pd.DataFrame({'alternate': ['geonode:a'], 'ARCSI_CLOUD_COVER': [0.4]})
+
+        df = eodslib.resolve_split_pairs(df)
+
+        assert 'split_ARCSI_CLOUD_COVER' not in df.columns
+        assert df['split_cloud_cover'].tolist() == [0.4]
+
+    def test_sentinel_2_columns_added_when_missing(self):
+        df = pd.DataFrame({'alternate': ['geonode:a'], 'title': ['S2A_20210101_lat52lon1_T30UXC_ORB037_utm30n'],
+                           'supplemental_information': ['ARCSI_CLOUD_COVER: 0.125\nOTHER: 1']})
+
+        df = eodslib.resolve_split_pairs(df)
+
+        assert df['split_cloud_cover'].tolist() == [0.125]
+
+class TestSelectScenesForAoi():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self):
+        self.aoi = 'POLYGON((0 0, 4 0, 4 4, 0 4, 0 0))'
+        self.df = pd.DataFrame({
+            'alternate': ['geonode:west', 'geonode:east', 'geonode:all_cloudy', 'geonode:away'],
+            'ARCSI_CLOUD_COVER': [0.1, 0.1, 0.5, 0.0],
+            'csw_wkt_geometry': ['POLYGON((-1 -1, 2 -1, 2 5, -1 5, -1 -1))', 'POLYGON((2 -1, 5 -1, 5 5, 2 5, 2 -1))',
+                                 'POLYGON((-1 -1, 5 -1, 5 5, -1 5, -1 -1))', 'POLYGON((10 10, 11 10, 11 11, 10 11, 10 10))'],
+            })
+
+    def test_one_covering_layer_beats_two_halves_with_more_clear_area(self):
+        df = eodslib.select_scenes_for_aoi(self.df, self.aoi)
+
+        assert df['alternate'].tolist() == ['geonode:all_cloudy']
+        assert df['aoi_coverage'].tolist() == [1.0]
+
+    def test_max_cloud_leaves_out_cloudy_layers(self):
+        df = eodslib.select_scenes_for_aoi(self.df, self.aoi, max_cloud=20)
+
+        assert df['alternate'].tolist() == ['geonode:west', 'geonode:east']
+        assert df['aoi_area_added'].tolist() == [0.5, 0.5]
+        assert df['aoi_coverage'].tolist() == [0.5, 1.0]
+
+    def test_stops_at_target_coverage(self):
+        df = eodslib.select_scenes_for_aoi(self.df, self.aoi, max_cloud=20, coverage=0.5)
+
+        assert df['alternate'].tolist() == ['geonode:west']
+
+    def test_overlapping_layer_adding_nothing_is_not_selected(self):
+        self.df.loc[2, 'ARCSI_CLOUD_COVER'] = 0.8
+        self.df.loc[4] = ['geonode:west_again', 0.0, 'POLYGON((-1 -1, 2 -1, 2 5, -1 5, -1 -1))']
+
+        df = eodslib.select_scenes_for_aoi(self.df, self.aoi)
+
+        assert df['alternate'].tolist() == ['geonode:west_again', 'geonode:east']
+
+    def test_point_aoi_triggers_exception(self):
+        with pytest.raises(ValueError):
+            eodslib.select_scenes_for_aoi(self.df, 'POINT (1 1)')
+
+class TestFindLeastCloudK():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch('eodslib._safe_granule_orbits', pd.Index(['T30UXC_ORB037', 'T30UXD_ORB037']))
+        rows = [('S2A_20210105_lat52lon1_T30UXC_ORB037_a', 0.3), ('S2A_20210110_lat52lon1_T30UXC_ORB037_b', 0.1),
+                ('S2A_20210203_lat52lon1_T30UXC_ORB037_c', 0.2), ('S2A_20210220_lat52lon1_T30UXC_ORB037_d', 0.05),
+                ('S2A_20210107_lat52lon1_T30UXD_ORB037_e', 0.4), ('S2A_20210107_lat52lon1_T30UXE_ORB037_f', 0.0)]
+        self.df = pd.DataFrame({'title': [r[0] for r in rows], 'alternate': ['geonode:' + r[0] for r in rows],
+                                'supplemental_information': ['ARCSI_CLOUD_COVER: ' + str(r[1]) for r in rows]})
+
+    def test_k_least_cloud_per_granule(self):
+        df = eodslib.find_least_cloud_k(self.df, 2)
+
+        assert [a[-1] for a in df['alternate']] == ['d', 'b', 'e']
+        assert df['cloud_rank'].tolist() == [1, 2, 1]
+
+    def test_window_ranks_within_each_time_bin(self):
+        df = eodslib.find_least_cloud_k(self.df, 1, window='M')
+
+        assert [a[-1] for a in df['alternate']] == ['b', 'd', 'e']
+        assert df['time_bin'].tolist() == [pd.Timestamp('2021-01-01'), pd.Timestamp('2021-02-01'), pd.Timestamp('2021-01-01')]
+
+    def test_split_counterpart_kept_with_its_half(self):
+        self.df['split_granule.name'] = np.nan
+        self.df.loc[6] = ['S2A_20210220_lat52lon1_T30UXCSPLIT1_ORB037_d2', 'geonode:split_d2', 'ARCSI_CLOUD_COVER: 0.15', self.df['alternate'][3]]
+        self.df.loc[3, 'split_granule.name'] = 'geonode:split_d2'
+
+        df = eodslib.find_least_cloud_k(self.df, 1)
+
+        # d averages to 0.1 with its counterpart and ties with b, the earlier row wins
+        assert [a[-1] for a in df['alternate']] == ['b', 'e']
+
+        df = eodslib.find_least_cloud_k(self.df, 2)
+
+        assert df['alternate'].tolist()[-1] == 'geonode:split_d2'
+        assert df['cloud_rank'].tolist() == [1, 2, 1, 2]
+
+    def test_k_below_one_triggers_exception(self):
+        with pytest.raises(ValueError):
+            eodslib.find_least_cloud_k(self.df, 0)
+
+class TestModTheXml():
+    @pytest.fixture(autouse=True, scope='function')
+    def class_setup(self, mocker):
+        mocker.patch.dict('eodslib._xml_templates', clear=True)
+
+    def use_template_dir(self, mocker, tmp_path, text):
+        mocker.patch('eodslib.XML_TEMPLATE_DIR', tmp_path)
+        (tmp_path / 'test.xml').write_text(text)
+        return {'template_xml': 'test.xml', 'xml_config': None}
+
+    def test_gsdownload_template_rendered(self):
+        xml = eodslib.mod_the_xml({'template_xml': 'gsdownload_template.xml',
+                                   'xml_config': {'template_layer_name': 'geonode:layer', 'template_outputformat': 'image/tiff', 'template_mimetype': 'application/zip'}})
+
+        assert '<wps:LiteralData>geonode:layer</wps:LiteralData>' in xml
+        assert '<wps:LiteralData>image/tiff</wps:LiteralData>' in xml
+        assert 'mimeType="application/zip"' in xml
+        assert 'template_' not in xml
+
+    def test_placeholders_match_whole_tokens_only(self, mocker, tmp_path):
+        item = self.use_template_dir(mocker, tmp_path, '<a>template_ll</a><b>template_llx</b><c>template_layer_name</c>')
+        item['xml_config'] = {'template_ll': '1 2'}
+
+        assert eodslib.mod_the_xml(item) == '<a>1 2</a><b>template_llx</b><c>template_layer_name</c>'
+
+    def test_values_are_not_substituted_again(self, mocker, tmp_path):
+        item = self.use_template_dir(mocker, tmp_path, '<a>template_a</a><b>template_b</b>')
+        item['xml_config'] = {'template_a': 'template_b', 'template_b': 'B'}
+
+        assert eodslib.mod_the_xml(item) == '<a>template_b</a><b>B</b>'
+
+    def test_template_reread_only_when_mtime_changes(self, mocker, tmp_path):
+        item = self.use_template_dir(mocker, tmp_path, '<a>template_a</a>')
+        item['xml_config'] = {'template_a': 'A'}
+        template = tmp_path / 'test.xml'
+        mtime = template.stat().st_mtime_ns
+
+        assert eodslib.mod_the_xml(item) == '<a>A</a>'
+
+        template.write_text('<b>template_a</b>')
+        os.utime(template, ns=(mtime, mtime))
+
+        assert eodslib.mod_the_xml(item) == '<a>A</a>'
+
+        os.utime(template, ns=(mtime + 10**9, mtime + 10**9))
+
+        assert eodslib.mod_the_xml(item) == '<b>A</b>'
+
+    def test_missing_template_triggers_exception(self):
+        with pytest.raises(AssertionError):
+            eodslib.mod_the_xml({'template_xml': 'no-such-template.xml', 'xml_config': None})